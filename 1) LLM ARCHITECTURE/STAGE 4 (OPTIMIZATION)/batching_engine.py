@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import deque
+import torch
+
+from gpt_model import GPTModel, modelConfigs, generate, sampleNextToken
+
+
+class GenerationRequest:
+    def __init__(self, promptIds, maxNewTokens, temperature=1.0, topK=None, eosId=None):
+        self.promptIds = list(promptIds)
+        self.maxNewTokens = maxNewTokens
+        self.temperature = temperature
+        self.topK = topK
+        self.eosId = eosId
+
+        self.outputIds = []
+        self.finishReason = None  # "eos", "length" or "context"
+        self.done = threading.Event()  # Set when the request retires, callers on other threads can wait on it
+
+    def nextPosition(self):
+        # Absolute position of the last sampled token (it is fed back into the model on the next decode step)
+        return len(self.promptIds) + len(self.outputIds) - 1
+
+
+'Continuous Batching'
+class ContinuousBatchingEngine:
+    """
+    Serves many prompts with one GPTModel by decoding all running requests in a single batch.
+    New requests are admitted between decode steps and finished ones free their cache slot right away,
+    so the batch never waits for its slowest member.
+    """
+    def __init__(self, model, maxSlots=8, contextSize=None):
+        self.model = model
+        self.maxSlots = maxSlots
+        self.contextSize = contextSize or model.positionalEmbeddings.weight.shape[0]
+        self.device = model.tokenEmbeddings.weight.device
+
+        self.waiting = deque()
+        self.running = []  # running[i] owns KV cache slot i (kept compact, see retire)
+        self.lock = threading.Lock()
+        self.generatedTokens = 0
+
+        self.model.eval()
+        self.model.allocateCache(maxSlots)
+
+    def submit(self, request):
+        # Checked here: a bad request would otherwise fail inside prefill and take down every running request
+        if not request.promptIds:
+            raise ValueError("promptIds must contain at least one token")
+        if request.maxNewTokens < 1:
+            raise ValueError(f"maxNewTokens must be at least 1, got {request.maxNewTokens}")
+        # Keep room for at least one generated token inside the context window
+        request.promptIds = request.promptIds[-(self.contextSize - 1):]
+        with self.lock:
+            self.waiting.append(request)
+        return request
+
+    def hasWork(self):
+        with self.lock:
+            return bool(self.waiting) or bool(self.running)
+
+    @torch.no_grad()
+    def step(self):
+        # S1) Decode one token for every request that is already running
+        finished = []
+        if self.running:
+            self.decode(self.running)
+            finished += self.retire()
+
+        # S2) Admit waiting requests into the free slots and prefill them together
+        with self.lock:
+            admitted = []
+            while self.waiting and len(self.running) + len(admitted) < self.maxSlots:
+                admitted.append(self.waiting.popleft())
+        if admitted:
+            self.prefill(admitted)
+            self.running += admitted
+            finished += self.retire()
+        return finished
+
+    def run(self):
+        finished = []
+        while self.hasWork():
+            finished += self.step()
+        return finished
+
+    def prefill(self, requests):
+        # Mixed-length prompts are right-padded into one batch, per-row positions keep padding out of real tokens
+        slotOffset = len(self.running)
+        lengths = torch.tensor([len(r.promptIds) for r in requests], device=self.device)
+        maxLen = int(lengths.max())
+        inputIds = torch.zeros(len(requests), maxLen, dtype=torch.long, device=self.device)
+        for row, request in enumerate(requests):
+            inputIds[row, :len(request.promptIds)] = torch.tensor(request.promptIds, device=self.device)
+        positions = torch.arange(maxLen, device=self.device).expand(len(requests), maxLen)
+
+        logits = self.model(inputIds, positions=positions, slotOffset=slotOffset, logitIndex=lengths - 1)[:, -1, :]
+        self.appendSampledTokens(requests, logits)
+
+    def decode(self, requests):
+        inputIds = torch.tensor([[r.outputIds[-1]] for r in requests], device=self.device)
+        positions = torch.tensor([[r.nextPosition()] for r in requests], device=self.device)
+        logits = self.model(inputIds, positions=positions, slotOffset=0)[:, -1, :]
+        self.appendSampledTokens(requests, logits)
+
+    def appendSampledTokens(self, requests, logits):
+        # Every request carries its own sampling settings
+        for row, request in enumerate(requests):
+            nextId = sampleNextToken(logits[row:row + 1], request.temperature, request.topK).item()
+            request.outputIds.append(nextId)
+            self.generatedTokens += 1
+
+            if request.eosId is not None and nextId == request.eosId:
+                request.finishReason = "eos"
+            elif len(request.outputIds) >= request.maxNewTokens:
+                request.finishReason = "length"
+            elif request.nextPosition() >= self.contextSize:
+                request.finishReason = "context"
+
+    def retire(self):
+        # Finished requests leave immediately, the last running request moves into the freed slot
+        # so the running requests always occupy slots 0..n-1 and decode works on one contiguous cache block
+        finished = []
+        slot = 0
+        while slot < len(self.running):
+            request = self.running[slot]
+            if request.finishReason is None:
+                slot += 1
+                continue
+            lastSlot = len(self.running) - 1
+            if slot != lastSlot:
+                self.model.copyCacheSlot(lastSlot, slot)
+                self.running[slot] = self.running[lastSlot]
+            self.running.pop()
+            request.done.set()
+            finished.append(request)
+        return finished
+
+
+if __name__ == "__main__":
+    # Aggregate throughput: one request at a time with generate() vs the continuous batching engine
+    BASE_CONFIG = {"vocab_size": 50257, "context_length": 1024, "drop_rate": 0.0, "qkv_bias": True}
+    cfg = {**BASE_CONFIG, **modelConfigs["gpt2-small (124M)"]}
+    torch.manual_seed(123)
+    model = GPTModel(cfg).eval()
+
+    numRequests = 16
+    prompts = [torch.randint(0, cfg["vocab_size"], (int(n),)).tolist() for n in torch.randint(8, 64, (numRequests,))]
+    maxNewTokens = [int(n) for n in torch.randint(8, 32, (numRequests,))]
+
+    startTime = time.time()
+    sequentialOutputs = []
+    for prompt, newTokens in zip(prompts, maxNewTokens):
+        tokenIds = generate(model, torch.tensor([prompt]), newTokens, cfg["context_length"], temperature=0.0, useCache=True)
+        sequentialOutputs.append(tokenIds[0, len(prompt):].tolist())
+    sequentialTime = time.time() - startTime
+    print(f"Sequential generate(): {sum(maxNewTokens) / sequentialTime:.2f} tokens/sec")
+
+    for maxSlots in [4, 8]:
+        engine = ContinuousBatchingEngine(model, maxSlots=maxSlots)
+        requests = [engine.submit(GenerationRequest(p, n, temperature=0.0)) for p, n in zip(prompts, maxNewTokens)]
+        startTime = time.time()
+        engine.run()
+        engineTime = time.time() - startTime
+        print(f"Continuous batching (maxSlots={maxSlots}): {engine.generatedTokens / engineTime:.2f} tokens/sec")
+        print("Same greedy tokens as generate():", all(r.outputIds == out for r, out in zip(requests, sequentialOutputs)))
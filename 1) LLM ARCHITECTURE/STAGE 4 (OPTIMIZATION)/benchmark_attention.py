@@ -0,0 +1,118 @@
+import multiprocessing
+import resource
+import time
+import numpy as np
+import torch
+
+from gpt_model import GPTModel, MultiHeadAttention, modelConfigs, loadWeights, generate
+
+BASE_CONFIG = {"vocab_size": 50257, "context_length": 1024, "drop_rate": 0.0, "qkv_bias": True}
+
+
+def randomGpt2Params(cfg, seed=123):
+    # Same layout as the params dict returned by download_and_load_gpt2, so loadWeights is exercised exactly
+    rng = np.random.default_rng(seed)
+    embDim = cfg["emb_dim"]
+
+    def rand(*shape, scale=0.02):
+        return (rng.standard_normal(shape) * scale).astype(np.float32)
+
+    blocks = []
+    for _ in range(cfg["n_layers"]):
+        blocks.append({
+            "attn": {"c_attn": {"w": rand(embDim, 3 * embDim), "b": rand(3 * embDim)},
+                     "c_proj": {"w": rand(embDim, embDim), "b": rand(embDim)}},
+            "mlp": {"c_fc": {"w": rand(embDim, 4 * embDim), "b": rand(4 * embDim)},
+                    "c_proj": {"w": rand(4 * embDim, embDim), "b": rand(embDim)}},
+            "ln_1": {"g": 1 + rand(embDim), "b": rand(embDim)},
+            "ln_2": {"g": 1 + rand(embDim), "b": rand(embDim)},
+        })
+    return {"wte": rand(cfg["vocab_size"], embDim), "wpe": rand(cfg["context_length"], embDim),
+            "g": 1 + rand(embDim), "b": rand(embDim), "blocks": blocks}
+
+
+def buildModel(cfg, fusedQkv, params=None):
+    torch.manual_seed(123)
+    model = GPTModel({**cfg, "fused_qkv": fusedQkv})
+    if params is not None:
+        loadWeights(model, params)
+    return model.eval()
+
+
+def bufferMegabytes(model):
+    return sum(buf.numel() * buf.element_size() for buf in model.buffers()) / 1024**2
+
+
+def peakAttentionMegabytes(cfg, fusedQkv, seqLen, batchSize, queue):
+    # Runs in a fresh process: ru_maxrss is a high-water mark, so each measurement needs its own process.
+    # Only one attention layer is built so its activations are not hidden below the model's init peak
+    attention = MultiHeadAttention(cfg["emb_dim"], cfg["emb_dim"], cfg["context_length"], 0.0,
+                                   cfg["n_heads"], cfg["qkv_bias"], fused_qkv=fusedQkv,
+                                   sliding_window=cfg.get("sliding_window")).eval()
+    x = torch.randn(batchSize, seqLen, cfg["emb_dim"])
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with torch.no_grad():
+        attention(x)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((after - before) / 1024)  # KB -> MB (Linux)
+
+
+def measurePeakMegabytes(cfg, fusedQkv, seqLen, batchSize=8):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=peakAttentionMegabytes, args=(cfg, fusedQkv, seqLen, batchSize, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def forwardLatency(model, seqLen, vocabSize, repeats=5):
+    idx = torch.randint(0, vocabSize, (1, seqLen))
+    with torch.no_grad():
+        model(idx)  # Warmup
+        startTime = time.time()
+        for _ in range(repeats):
+            model(idx)
+    return (time.time() - startTime) / repeats * 1000
+
+
+if __name__ == "__main__":
+    cfg = {**BASE_CONFIG, **modelConfigs["gpt2-small (124M)"]}
+    seqLens = [128, 256, 512, 1024]
+
+    # S1) Peak extra memory of one attention layer (batch 8). Measured first: a spawned child inherits
+    # the parent's ru_maxrss, so it must run before the full models below are built
+    peaks = {seqLen: [measurePeakMegabytes(cfg, fusedQkv, seqLen) for fusedQkv in [False, True]] for seqLen in seqLens}
+
+    # S2) Resident buffers: the unfused path keeps one context_length x context_length mask per block
+    for modelName in ["gpt2-small (124M)", "gpt2-xl (1558M)"]:
+        modelCfg = {**BASE_CONFIG, **modelConfigs[modelName]}
+        for fusedQkv in [False, True]:
+            with torch.device("meta"):  # Shapes only, no weights are allocated
+                model = GPTModel({**modelCfg, "fused_qkv": fusedQkv})
+            print(f"{modelName} fused_qkv={fusedQkv}: mask buffers {bufferMegabytes(model):.1f} MB")
+            del model
+
+    # S3) Parity: both attention paths loaded from the same GPT-2 style params through loadWeights
+    params = randomGpt2Params(cfg)
+    unfused = buildModel(cfg, fusedQkv=False, params=params)
+    fused = buildModel(cfg, fusedQkv=True, params=params)
+
+    idx = torch.randint(0, cfg["vocab_size"], (2, 128))
+    with torch.no_grad():
+        maxDiff = (unfused(idx) - fused(idx)).abs().max().item()
+    print(f"Max logit difference (unfused vs fused): {maxDiff:.2e}")
+    assert maxDiff < 1e-3
+    for useCache in [False, True]:
+        prompt = idx[:1, :16]
+        same = torch.equal(generate(unfused, prompt, 20, cfg["context_length"], temperature=0.0, useCache=useCache),
+                           generate(fused, prompt, 20, cfg["context_length"], temperature=0.0, useCache=useCache))
+        print(f"Same greedy tokens (useCache={useCache}):", same)
+        assert same
+
+    # S4) Full 124M forward latency next to the attention memory from S1
+    print(f"\n{'seqLen':>6} | {'unfused ms':>10} | {'fused ms':>8} | {'unfused MB':>10} | {'fused MB':>8}")
+    for seqLen in seqLens:
+        latencies = [forwardLatency(model, seqLen, cfg["vocab_size"]) for model in [unfused, fused]]
+        print(f"{seqLen:>6} | {latencies[0]:>10.1f} | {latencies[1]:>8.1f} | {peaks[seqLen][0]:>10.1f} | {peaks[seqLen][1]:>8.1f}")
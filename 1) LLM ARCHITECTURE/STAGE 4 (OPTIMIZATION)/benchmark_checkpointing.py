@@ -0,0 +1,64 @@
+import multiprocessing
+import time
+import torch
+
+from gpt_model import GPT_CONFIG_124M, GPTModel
+from pretraining import calculateLossBatch
+
+# GPT-2 small at its full context (the notebooks cut it to 256)
+FULL_CONTEXT_CONFIG = {**GPT_CONFIG_124M, "context_length": 1024}
+SETUPS = [("no checkpointing", {}), ("every 2nd block", {"checkpoint_every": 2}), ("every block", {"checkpoint_every": 1}),
+          ("budget 1024 MB", {"checkpoint_budget_mb": 1024})]
+
+
+def peakMegabytes():
+    with open("/proc/self/status") as status:
+        return next(int(line.split()[1]) for line in status if line.startswith("VmHWM")) / 1024
+
+
+def stepWorker(cfg, batchSize, numTokens, queue):
+    # Fresh process: peak memory above weights + gradients + AdamW state, and the time of one training step
+    torch.manual_seed(123)
+    model = GPTModel(cfg)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=0.0004, weight_decay=0.1)
+    for shape in [(1, 16), (batchSize, numTokens)]:  # Warm-up step allocates the optimizer state
+        inputBatch = torch.randint(0, cfg["vocab_size"], shape)
+        baseline, startTime = peakMegabytes(), time.time()
+        calculateLossBatch(inputBatch[:, :-1], inputBatch[:, 1:], model, "cpu").backward()
+        optimizer.step()
+        optimizer.zero_grad()
+    queue.put((peakMegabytes() - baseline, time.time() - startTime, len(model.checkpointedBlocks(batchSize, numTokens - 1))))
+
+
+def gradientParity():
+    # Same seed + dropout on: checkpointed blocks must give exactly the same gradients
+    cfg = {**GPT_CONFIG_124M, "n_layers": 4}
+    inputBatch = torch.randint(0, cfg["vocab_size"], (2, 257))
+    gradients = []
+    for _, options in SETUPS:
+        torch.manual_seed(123)
+        model = GPTModel({**cfg, **options})
+        calculateLossBatch(inputBatch[:, :-1], inputBatch[:, 1:], model, "cpu").backward()
+        gradients.append(torch.cat([p.grad.flatten() for p in model.parameters()]))
+    return max((g - gradients[0]).abs().max().item() for g in gradients)
+
+
+if __name__ == "__main__":
+    print(f"Gradient parity (4 blocks, dropout 0.1), max difference vs no checkpointing: {gradientParity():.1e}")
+
+    # Activation memory / step time of GPT-2 small per context length and batch size, each step in a fresh process
+    # (a process killed by the OOM killer = does not fit in this machine's RAM)
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    for numTokens in [256, 512, 1024]:
+        for batchSize in [1, 2, 4]:
+            for name, options in SETUPS:
+                process = context.Process(target=stepWorker, args=({**FULL_CONTEXT_CONFIG, **options}, batchSize, numTokens + 1, queue))
+                process.start()
+                process.join()
+                if process.exitcode != 0:
+                    print(f"context {numTokens}, batch {batchSize}, {name}: out of memory (exit code {process.exitcode})")
+                    continue
+                memory, elapsed, numCheckpointed = queue.get()
+                print(f"context {numTokens}, batch {batchSize}, {name}: +{memory:.0f} MB, {elapsed:.1f} s/step, "
+                      f"{numCheckpointed}/12 blocks checkpointed")
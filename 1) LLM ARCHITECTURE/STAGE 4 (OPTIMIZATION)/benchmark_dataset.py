@@ -0,0 +1,57 @@
+import multiprocessing
+import os
+import tempfile
+import time
+import tiktoken
+import torch
+
+from benchmark_training import loadVerdict
+from pretraining import dataLoaderV1, writeTokenFile
+
+
+def anonMegabytes():
+    # Private (heap) memory of this process, shared libraries and page cache of the token file are not counted
+    with open("/proc/self/status") as status:
+        return next(int(line.split()[1]) for line in status if line.startswith("RssAnon")) / 1024
+
+
+def loaderWorker(txt, tokenFile, maxLength, stride, batchSize, queue):
+    # Fresh process per setup: build the loader, run one shuffled epoch, report time and memory
+    baseline = anonMegabytes()
+    startTime = time.time()
+    torch.manual_seed(123)
+    loader = dataLoaderV1(txt, batch_size=batchSize, max_length=maxLength, stride=stride, tokenFile=tokenFile)
+    buildTime = time.time() - startTime
+    startTime = time.time()
+    for inputBatch, targetBatch in loader:
+        pass
+    queue.put((len(loader.dataset), buildTime, time.time() - startTime, anonMegabytes() - baseline))
+
+
+if __name__ == "__main__":
+    # Parity on "The Verdict": the memmap loader yields the same shuffled batches as GPTDatasetV1
+    rawtext = loadVerdict()
+    tokenFile = os.path.join(tempfile.mkdtemp(), "the-verdict.bin")
+    torch.manual_seed(123)
+    referenceBatches = list(dataLoaderV1(rawtext, batch_size=4, max_length=256, stride=64))
+    torch.manual_seed(123)
+    memmapBatches = list(dataLoaderV1(rawtext, batch_size=4, max_length=256, stride=64, tokenFile=tokenFile))
+    print(f"Parity: {len(referenceBatches)} batches, identical inputs/targets/dtypes: "
+          f"{all(torch.equal(a, c) and torch.equal(b, d) and a.dtype == c.dtype for (a, b), (c, d) in zip(referenceBatches, memmapBatches))}")
+
+    # Larger corpus ("The Verdict" x 200, ~1M tokens), 256-token windows with stride 32 (each token in 8 windows)
+    corpus = "<|endoftext|>".join([rawtext] * 200)
+    tokenFile = os.path.join(tempfile.mkdtemp(), "corpus.bin")
+    startTime = time.time()
+    numTokens = writeTokenFile(corpus, tiktoken.get_encoding("gpt2"), tokenFile)
+    print(f"Token file: {numTokens} tokens, {os.path.getsize(tokenFile) / 1024**2:.1f} MB, written once in {time.time() - startTime:.1f} s")
+
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    for name, txt, file in [("GPTDatasetV1", corpus, None), ("GPTDatasetMemmap", None, tokenFile)]:
+        process = context.Process(target=loaderWorker, args=(txt, file, 256, 32, 8, queue))
+        process.start()
+        numWindows, buildTime, epochTime, memory = queue.get()
+        process.join()
+        print(f"{name}: {numWindows} windows, build {buildTime:.2f} s, one epoch (batch 8) {epochTime:.2f} s, "
+              f"+{memory:.0f} MB private memory")
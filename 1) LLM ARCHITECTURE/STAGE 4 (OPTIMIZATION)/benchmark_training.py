@@ -0,0 +1,90 @@
+import argparse
+import os
+import time
+import tiktoken
+import torch
+
+from gpt_model import GPT_CONFIG_124M, TRAIN_CONFIG_124M, GPTModel
+from pretraining import dataLoaderV1, trainModel
+
+
+def loadVerdict():
+    filePath = os.path.join(os.path.dirname(__file__), "..", "STAGE 1", "1) DATA PREP & SAMPLING", "TOKENIZATION", "the-verdict.txt")
+    with open(filePath, "r", encoding="utf-8") as file:
+        return file.read()
+
+
+def verdictLoaders(cfg, batchSize, trainRatio=0.90):
+    # Same split and windows as the STAGE 2 notebook run
+    rawtext = loadVerdict()
+    splitIdx = int(trainRatio * len(rawtext))
+    torch.manual_seed(123)
+    trainLoader = dataLoaderV1(rawtext[:splitIdx], batch_size=batchSize, max_length=cfg["context_length"],
+                               stride=cfg["context_length"], shuffle=True, drop_last=True)
+    validationLoader = dataLoaderV1(rawtext[splitIdx:], batch_size=batchSize, max_length=cfg["context_length"],
+                                    stride=cfg["context_length"], shuffle=False, drop_last=False)
+    return trainLoader, validationLoader
+
+
+def timedRun(cfg, trainLoader, validationLoader, numOfEpochs, trainConfig):
+    # Training tokens/sec (evaluation included, one evaluation per epoch in every setup) and the loss curves
+    device = torch.device("cpu")
+    torch.manual_seed(123)
+    model = GPTModel(cfg)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=0.0004, weight_decay=0.1)
+    stepsPerEpoch = -(-len(trainLoader) // (trainConfig["grad_accum_steps"] if trainConfig else 1))
+    startTime = time.time()
+    trainLosses, validationLosses, tokensSeen = trainModel(
+        model, trainLoader, validationLoader, optimizer, device, numOfEpochs=numOfEpochs, evalFreq=stepsPerEpoch,
+        evalIter=2, startContext=None, tokenizer=None, trainConfig=trainConfig)
+    elapsed = time.time() - startTime
+    return numOfEpochs * len(trainLoader) * trainLoader.batch_size * cfg["context_length"] / elapsed, trainLosses, validationLosses
+
+
+def evalOverheadRun(cfg, trainLoader, validationLoader, numOfEpochs, evalFreq, evalIter, cachedEval, asyncEval):
+    # Wall-clock time of the STAGE 2 run (sample after every epoch); evalFreq=None --> no evaluation, no samples
+    torch.manual_seed(123)
+    model = GPTModel(cfg)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=0.0004, weight_decay=0.1)
+    startTime = time.time()
+    trainLosses, validationLosses, _ = trainModel(
+        model, trainLoader, validationLoader, optimizer, "cpu", numOfEpochs=numOfEpochs, evalFreq=evalFreq, evalIter=evalIter,
+        startContext="Every effort moves you" if evalFreq else None, tokenizer=tiktoken.get_encoding("gpt2"),
+        cachedEval=cachedEval, asyncEval=asyncEval)
+    return time.time() - startTime, trainLosses, validationLosses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="trainModel benchmarks on \"The Verdict\"")
+    parser.add_argument("--eval", action="store_true", help="evaluation overhead instead of the TRAIN_CONFIG_124M comparison")
+    args = parser.parse_args()
+
+    if args.eval:
+        # Fraction of the wall-clock time spent in evaluation + sampling (evalFreq=5, evalIter=5 as in the notebook)
+        numOfEpochs = 3
+        trainLoader, validationLoader = verdictLoaders(GPT_CONFIG_124M, batchSize=2)
+        baseline, _, _ = evalOverheadRun(GPT_CONFIG_124M, trainLoader, validationLoader, numOfEpochs, None, 5, False, False)
+        print(f"no evaluation: {baseline:.1f} s")
+        results = {}
+        for name, cachedEval, asyncEval in [("evaluateModel + uncached samples", False, False),
+                                            ("cachedEval", True, False),
+                                            ("cachedEval + asyncEval", True, True)]:
+            elapsed, trainLosses, validationLosses = evalOverheadRun(GPT_CONFIG_124M, trainLoader, validationLoader, numOfEpochs,
+                                                                     5, 5, cachedEval, asyncEval)
+            results[name] = trainLosses, validationLosses
+            print(f"{name}: {elapsed:.1f} s, {(elapsed - baseline) / elapsed:.0%} of the wall-clock time in evaluation")
+        print(f"asyncEval losses identical to synchronous cachedEval: {results['cachedEval'] == results['cachedEval + asyncEval']}")
+    else:
+        # Current loop (fp32, batch 2, fixed LR) vs TRAIN_CONFIG_124M options on "The Verdict"
+        numOfEpochs = 10
+        trainLoader, validationLoader = verdictLoaders(GPT_CONFIG_124M, batchSize=2)
+        setups = [
+            ("current loop (fp32, batch 2, fixed LR)", None),
+            ("accumulation 4 + warmup/cosine + clipping, fp32", {**TRAIN_CONFIG_124M, "bf16": False}),
+            ("accumulation 4 + warmup/cosine + clipping, bf16", TRAIN_CONFIG_124M),
+        ]
+        for name, trainConfig in setups:
+            tokensPerSec, trainLosses, validationLosses = timedRun(GPT_CONFIG_124M, trainLoader, validationLoader, numOfEpochs, trainConfig)
+            print(f"{name}: {tokensPerSec:.0f} tokens/sec")
+            print(f"  training loss per epoch:   {' '.join(f'{loss:.2f}' for loss in trainLosses)}")
+            print(f"  validation loss per epoch: {' '.join(f'{loss:.2f}' for loss in validationLosses)}")
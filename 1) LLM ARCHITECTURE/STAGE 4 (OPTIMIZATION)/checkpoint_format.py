@@ -0,0 +1,206 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+
+from gpt_model import GPTModel, modelConfigs
+from model_downloader import downloadGpt2
+from tf_checkpoint_reader import latestCheckpoint, modelFromTfCheckpoint
+
+# Same header layout as safetensors: 8-byte little-endian header size, JSON header, then the raw tensor bytes.
+# Each header entry is {"dtype", "shape", "data_offsets": [begin, end]} relative to the start of the data
+DTYPES = {torch.float32: "F32", torch.float16: "F16", torch.bfloat16: "BF16",
+          torch.int64: "I64", torch.int32: "I32", torch.int8: "I8", torch.uint8: "U8", torch.bool: "BOOL"}
+NUMPY_DTYPES = {"F32": np.float32, "F16": np.float16, "BF16": np.int16,  # numpy has no bfloat16, reinterpreted in torch
+                "I64": np.int64, "I32": np.int32, "I8": np.int8, "U8": np.uint8, "BOOL": np.bool_}
+HEADER_ALIGNMENT = 64  # Header is padded with spaces so the tensor data starts on an aligned offset
+INDEX_NAME = "model.safetensors.index.json"
+
+GPT2_SIZES = {"124M": "gpt2-small (124M)", "355M": "gpt2-medium (355M)",
+              "774M": "gpt2-large (774M)", "1558M": "gpt2-xl (1558M)"}
+GPT2_BASE_CONFIG = {"vocab_size": 50257, "context_length": 1024, "drop_rate": 0.0, "qkv_bias": True}
+
+
+def writeShard(path, tensors, metadata=None):
+    # tensors: {name: tensor}, written in order of decreasing element size so every tensor stays aligned
+    names = sorted(tensors, key=lambda name: -tensors[name].element_size())
+    header, offset = {}, 0
+    for name in names:
+        tensor = tensors[name]
+        numBytes = tensor.numel() * tensor.element_size()
+        header[name] = {"dtype": DTYPES[tensor.dtype], "shape": list(tensor.shape), "data_offsets": [offset, offset + numBytes]}
+        offset += numBytes
+    if metadata:
+        header["__metadata__"] = {key: str(value) for key, value in metadata.items()}
+
+    headerBytes = json.dumps(header, separators=(",", ":")).encode()
+    headerBytes += b" " * (-(8 + len(headerBytes)) % HEADER_ALIGNMENT)
+    temporaryPath = path + ".tmp"
+    with open(temporaryPath, "wb") as file:
+        file.write(struct.pack("<Q", len(headerBytes)))
+        file.write(headerBytes)
+        for name in names:
+            tensor = tensors[name].detach().cpu().contiguous()
+            file.write(tensor.view(torch.uint8).flatten().numpy().data if tensor.numel() else b"")
+    os.replace(temporaryPath, path)  # A crash mid-write never leaves a truncated shard under the real name
+
+
+def readShard(path):
+    """
+    {name: tensor} of one shard, zero copy: every tensor is a view into a copy-on-write mmap of the file.
+    Nothing is read until a tensor is used, and processes reading the same shard share its page cache.
+    """
+    with open(path, "rb") as file:
+        headerSize = struct.unpack("<Q", file.read(8))[0]
+        header = json.loads(file.read(headerSize))
+    header.pop("__metadata__", None)
+    fileMap = np.memmap(path, dtype=np.uint8, mode="c")  # MAP_PRIVATE: writes (e.g. training) never reach the file
+    dataStart = 8 + headerSize
+
+    tensors = {}
+    for name, entry in header.items():
+        begin, end = entry["data_offsets"]
+        array = fileMap[dataStart + begin:dataStart + end].view(NUMPY_DTYPES[entry["dtype"]]).reshape(entry["shape"])
+        tensor = torch.from_numpy(array)
+        tensors[name] = tensor.view(torch.bfloat16) if entry["dtype"] == "BF16" else tensor
+    return tensors
+
+
+def saveModel(model, cfg, directory, maxShardBytes=2 * 1024**3):
+    """
+    Writes model as shards of at most maxShardBytes (a single tensor larger than that gets its own shard) plus
+    model.safetensors.index.json = {"config": cfg, "weight_map": {name: shard}}. The causal masks are not stored.
+    """
+    os.makedirs(directory, exist_ok=True)
+    stateDict = {name: tensor for name, tensor in model.state_dict().items() if not name.endswith(".mask")}
+    shards, shardBytes = [{}], 0
+    for name, tensor in stateDict.items():
+        numBytes = tensor.numel() * tensor.element_size()
+        if shards[-1] and shardBytes + numBytes > maxShardBytes:
+            shards.append({})
+            shardBytes = 0
+        shards[-1][name] = tensor
+        shardBytes += numBytes
+
+    weightMap = {}
+    for i, shard in enumerate(shards):
+        shardName = f"model-{i + 1:05d}-of-{len(shards):05d}.safetensors"
+        writeShard(os.path.join(directory, shardName), shard, {"format": "pt"})
+        weightMap.update({name: shardName for name in shard})
+    with open(os.path.join(directory, INDEX_NAME), "w") as file:
+        json.dump({"config": cfg, "weight_map": weightMap}, file, indent=2)
+
+
+def loadModel(directory, device="cpu"):
+    # GPTModel built on the meta device and given the mmapped tensors directly: no random init, no copy
+    with open(os.path.join(directory, INDEX_NAME)) as file:
+        index = json.load(file)
+    cfg = index["config"]
+    stateDict = {}
+    for shardName in sorted(set(index["weight_map"].values())):
+        stateDict.update(readShard(os.path.join(directory, shardName)))
+
+    with torch.device("meta"):
+        model = GPTModel(cfg)
+    model.load_state_dict(stateDict, strict=False, assign=True)
+    for block in model.trf_blocks:
+        if hasattr(block.attention, "mask"):
+            block.attention.mask = torch.triu(torch.ones(cfg["context_length"], cfg["context_length"]), diagonal=1)
+    missing = [name for name, tensor in model.state_dict().items() if tensor.is_meta]
+    if missing:
+        raise KeyError(f"Checkpoint is missing {len(missing)} tensor(s), e.g. {missing[:3]}")
+    return model.to(device).eval()
+
+
+def convertGpt2(modelSize, modelsDir, outputDir, cfgOverrides=None, manifestPath=None):
+    # One-time conversion of an OpenAI GPT-2 checkpoint to the mmap format (downloaded if needed, no TensorFlow)
+    modelDir = downloadGpt2(modelSize, modelsDir, manifestPath)
+    cfg = {**GPT2_BASE_CONFIG, **modelConfigs[GPT2_SIZES[modelSize]], **(cfgOverrides or {})}
+    saveModel(modelFromTfCheckpoint(latestCheckpoint(modelDir), cfg), cfg, outputDir)
+    return cfg
+
+
+def memoryMegabytes():
+    # (Rss, Pss) of this process: Pss splits each shared page between the processes mapping it
+    with open("/proc/self/smaps_rollup") as smaps:
+        values = {line.split(":")[0]: int(line.split()[1]) for line in smaps if line.split(":")[0] in ("Rss", "Pss")}
+    return values["Rss"] / 1024, values["Pss"] / 1024
+
+
+def sharedLoadWorker(directory, idx, barrier, queue):
+    model = loadModel(directory)
+    with torch.no_grad():
+        model(idx)
+    barrier.wait()  # Every process has touched all the weights before memory is measured
+    queue.put(memoryMegabytes())
+    barrier.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert GPT-2 checkpoints to the mmap format, or run the cold-start benchmark")
+    parser.add_argument("--convert", nargs="+", choices=list(GPT2_SIZES), help="GPT-2 sizes to download and convert")
+    parser.add_argument("--models_dir", default="gpt2", help="where the TF checkpoints are downloaded to (same layout as gpt_download3.py)")
+    parser.add_argument("--manifest", help="JSON {file: {size, sha256}} the downloaded files are checked against")
+    parser.add_argument("--output_dir", default="checkpoints", help="one sub-directory per converted size")
+    args = parser.parse_args()
+
+    if args.convert:
+        for modelSize in args.convert:
+            startTime = time.time()
+            convertGpt2(modelSize, args.models_dir, os.path.join(args.output_dir, modelSize), manifestPath=args.manifest)
+            print(f"{modelSize}: converted in {time.time() - startTime:.1f} s → {os.path.join(args.output_dir, modelSize)}")
+        sys.exit()
+
+    # Cold start of 774M (random weights): fresh GPTModel vs eager torch.load vs mmap
+    cfg = {**GPT2_BASE_CONFIG, **modelConfigs["gpt2-large (774M)"]}
+    directory = tempfile.mkdtemp()
+    idx = torch.randint(0, cfg["vocab_size"], (1, 16))
+
+    startTime = time.time()
+    torch.manual_seed(123)
+    model = GPTModel(cfg).eval()
+    print(f"GPTModel(cfg) (random init, before loadWeights even starts): {time.time() - startTime:.2f} s")
+    with torch.no_grad():
+        referenceLogits = model(idx)
+    saveModel(model, cfg, directory)
+    torchPath = os.path.join(directory, "model.pt")
+    torch.save(model.state_dict(), torchPath)
+    del model
+
+    startTime = time.time()
+    with torch.device("meta"):
+        model = GPTModel(cfg)
+    model.load_state_dict(torch.load(torchPath), assign=True)  # Eager, but at least without a random init
+    print(f"torch.load: {time.time() - startTime:.2f} s")
+    del model
+    os.remove(torchPath)
+
+    startTime = time.time()
+    model = loadModel(directory)
+    loadTime = time.time() - startTime
+    with torch.no_grad():
+        logits = model(idx)
+    print(f"loadModel (mmap): {loadTime:.3f} s, + first forward {time.time() - startTime:.2f} s, "
+          f"max logit diff {(logits - referenceLogits).abs().max().item():.1e}")
+    del model
+
+    # Several processes on the same checkpoint: the weights sit once in the page cache
+    for numProcesses in [1, 2]:
+        context = multiprocessing.get_context("spawn")
+        barrier, queue = context.Barrier(numProcesses), context.Queue()
+        processes = [context.Process(target=sharedLoadWorker, args=(directory, idx, barrier, queue)) for _ in range(numProcesses)]
+        for process in processes:
+            process.start()
+        usage = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+        print(f"{numProcesses} process(es): Rss {' / '.join(f'{rss:.0f}' for rss, _ in usage)} MB, "
+              f"Pss {' / '.join(f'{pss:.0f}' for _, pss in usage)} MB")
+    shutil.rmtree(directory)
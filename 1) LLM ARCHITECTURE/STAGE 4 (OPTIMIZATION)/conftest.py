@@ -0,0 +1,16 @@
+import pytest
+import tiktoken
+import tiktoken.registry
+from tiktoken_ext.openai_public import r50k_pat_str
+
+
+@pytest.fixture
+def toyTokenizer(monkeypatch):
+    # GPT-2 pre-tokenizer with byte-level tokens + a few whitespace merges, registered as "gpt2" so that
+    # tiktoken.get_encoding("gpt2") works offline (forked pool workers inherit it)
+    ranks = {bytes([i]): i for i in range(256)}
+    for merge in [b"\n\n", b" \n", b"  ", b"\n ", b"th", b"the", b" the"]:
+        ranks[merge] = len(ranks)
+    tokenizer = tiktoken.Encoding("gpt2", pat_str=r50k_pat_str, mergeable_ranks=ranks, special_tokens={"<|endoftext|>": 50256})
+    monkeypatch.setitem(tiktoken.registry.ENCODINGS, "gpt2", tokenizer)
+    return tokenizer
@@ -0,0 +1,151 @@
+import copy
+import time
+import torch
+import torch.nn.functional as F
+
+from gpt_model import GPTModel, modelConfigs, generate, loadWeights
+from pretraining import trainModel, calculateLossBatch, calculateLossLoader
+from benchmark_attention import randomGpt2Params
+
+
+def rowKey(tokenIds):
+    # Cache key of one input sequence (1D tensor of token ids)
+    return tokenIds.cpu().numpy().tobytes()
+
+
+@torch.no_grad()
+def cacheTeacherLogits(teacher, dataLoader, device, topK=64, teacherBatchSize=64):
+    """
+    Runs the teacher once over every distinct input sequence of dataLoader, teacherBatchSize rows per forward
+    pass (much larger than a training batch), and keeps per sequence either the top-k logits as
+    (values fp16, indices) or, with topK=None, the full logits in fp16. Returns {rowKey: (values, indices)}.
+    The output head runs one row at a time, so only seqLen x vocab logits exist at once
+    (teacherBatchSize x 1024 x 50257 fp32 logits would be ~13 GB at the default batch size).
+    """
+    rows = {}
+    for inputBatch, _ in dataLoader:
+        for row in inputBatch:
+            rows.setdefault(rowKey(row), row)
+    rows = list(rows.items())
+
+    teacher.eval()
+    cache = {}
+    for start in range(0, len(rows), teacherBatchSize):
+        keys, batch = zip(*rows[start:start + teacherBatchSize])
+        outHead = teacher.out_head
+        teacher.out_head = torch.nn.Identity()  # The forward pass returns the final hidden states (batch, seqLen, emb_dim)
+        try:
+            hidden = teacher(torch.stack(batch).to(device))
+        finally:
+            teacher.out_head = outHead
+        for i, key in enumerate(keys):
+            logits = outHead(hidden[i])
+            values, indices = torch.topk(logits, topK, dim=-1) if topK is not None else (logits, None)
+            cache[key] = (values.half().cpu(), None if indices is None else indices.int().cpu())
+    return cache
+
+
+def distillationLoss(studentLogits, teacherValues, teacherIndices, targetBatch, temperature=2.0, alpha=0.5):
+    """
+    alpha * T^2 * KL(teacher_T || student_T) + (1 - alpha) * next-token cross entropy.
+    With teacherIndices (top-k cache) the teacher distribution is renormalised over its top k tokens
+    and the student's log-probabilities are read at those tokens (sparse KL).
+    """
+    studentLogProbs = F.log_softmax(studentLogits / temperature, dim=-1)
+    teacherLogProbs = F.log_softmax(teacherValues.float() / temperature, dim=-1)
+    if teacherIndices is not None:
+        studentLogProbs = studentLogProbs.gather(-1, teacherIndices.long())
+    klDivergence = (teacherLogProbs.exp() * (teacherLogProbs - studentLogProbs)).sum(dim=-1).mean()
+    crossEntropy = F.cross_entropy(studentLogits.flatten(0, 1), targetBatch.flatten(), ignore_index=0)  # Same as calculateLossBatch
+    return alpha * temperature**2 * klDivergence + (1 - alpha) * crossEntropy
+
+
+'Distillation Loss'
+class DistillationLoss:
+    """
+    Training objective for trainModel(..., lossFn=DistillationLoss(...)): same call signature as calculateLossBatch.
+    Teacher logits come from teacherCache (cacheTeacherLogits) when the sequence is in it, otherwise the
+    teacher is run on the batch (top-k applied the same way).
+    """
+    def __init__(self, teacher=None, teacherCache=None, temperature=2.0, alpha=0.5, topK=64):
+        self.teacher = teacher
+        self.teacherCache = teacherCache or {}
+        self.temperature = temperature
+        self.alpha = alpha
+        self.topK = topK
+
+    def teacherLogits(self, inputBatch, device):
+        cached = [self.teacherCache.get(rowKey(row)) for row in inputBatch]
+        if all(entry is not None for entry in cached):
+            values = torch.stack([entry[0] for entry in cached]).to(device)
+            indices = None if cached[0][1] is None else torch.stack([entry[1] for entry in cached]).to(device)
+            return values, indices
+
+        with torch.no_grad():
+            self.teacher.eval()
+            logits = self.teacher(inputBatch.to(device))
+        if self.topK is None:
+            return logits, None
+        return torch.topk(logits, self.topK, dim=-1)
+
+    def __call__(self, inputBatch, targetBatch, model, device):
+        teacherValues, teacherIndices = self.teacherLogits(inputBatch, device)
+        studentLogits = model(inputBatch.to(device))
+        return distillationLoss(studentLogits, teacherValues, teacherIndices, targetBatch.to(device),
+                                self.temperature, self.alpha)
+
+
+def decodeTokensPerSec(model, prompt, numNewTokens, contextSize):
+    startTime = time.time()
+    generate(model, prompt, numNewTokens, contextSize, temperature=0.0, useCache=True)
+    return numNewTokens / (time.time() - startTime)
+
+
+if __name__ == "__main__":
+    # GPT-2 355M (GPT-2 style params through loadWeights, random here) → 6-layer student. The training text is
+    # sampled from the teacher, so the student's validation loss measures how well it imitates the teacher.
+    # With real weights use download_and_load_gpt2 params and dataLoaderV1 on your own text instead
+    BASE_CONFIG = {"vocab_size": 50257, "context_length": 1024, "drop_rate": 0.0, "qkv_bias": True}
+    teacherCfg = {**BASE_CONFIG, **modelConfigs["gpt2-medium (355M)"]}
+    studentCfg = {**BASE_CONFIG, "context_length": 256, "emb_dim": 384, "n_layers": 6, "n_heads": 6}
+    device = torch.device("cpu")
+    torch.manual_seed(123)
+    teacher = GPTModel(teacherCfg)
+    loadWeights(teacher, randomGpt2Params(teacherCfg))
+    teacher.eval()
+
+    # S1) Text: 96 training + 32 validation sequences of 128 tokens (sampled 8 at a time, the KV cache spans the full context)
+    sequences = torch.cat([generate(teacher, torch.randint(0, teacherCfg["vocab_size"], (8, 1)), 128,
+                                    teacherCfg["context_length"], temperature=1.0, topK=50, useCache=True)
+                           for _ in range(16)])
+    pairs = list(zip(sequences[:, :-1], sequences[:, 1:]))
+    trainLoader = torch.utils.data.DataLoader(pairs[:96], batch_size=8, shuffle=True, drop_last=True)
+    validationLoader = torch.utils.data.DataLoader(pairs[96:], batch_size=8)
+    with torch.no_grad():
+        teacherValidationLoss = calculateLossLoader(validationLoader, teacher, device)
+
+    # S2) Teacher top-64 logits, computed once in batches of 32 sequences
+    startTime = time.time()
+    teacherCache = cacheTeacherLogits(teacher, trainLoader, device, topK=64, teacherBatchSize=32)
+    cacheMegabytes = sum(v.numel() * v.element_size() + i.numel() * i.element_size() for v, i in teacherCache.values()) / 1024**2
+    print(f"Teacher cache: {len(teacherCache)} sequences, {cacheMegabytes:.1f} MB, built in {time.time() - startTime:.1f} s")
+
+    # S3) Same student init and steps, trained with cross entropy only vs with distillation
+    torch.manual_seed(123)
+    initialStudent = GPTModel(studentCfg)
+    results = {}
+    for lossName, lossFn in [("cross entropy", calculateLossBatch), ("distillation", DistillationLoss(teacher, teacherCache))]:
+        student = copy.deepcopy(initialStudent)
+        optimizer = torch.optim.AdamW(student.parameters(), lr=0.0005, weight_decay=0.1)
+        trainModel(student, trainLoader, validationLoader, optimizer, device, numOfEpochs=8, evalFreq=1000, evalIter=4,
+                   startContext=None, tokenizer=None, lossFn=lossFn)
+        student.eval()
+        with torch.no_grad():
+            results[lossName] = calculateLossLoader(validationLoader, student, device)
+        print(f"Student trained with {lossName}: validation loss {results[lossName]:.3f} (teacher {teacherValidationLoss:.3f})")
+
+    prompt = torch.randint(0, teacherCfg["vocab_size"], (1, 32))
+    teacherSpeed = decodeTokensPerSec(teacher, prompt, 32, teacherCfg["context_length"])
+    studentSpeed = decodeTokensPerSec(student, prompt, 32, studentCfg["context_length"])
+    print(f"Decode: teacher {teacherSpeed:.2f} tokens/sec, student {studentSpeed:.2f} tokens/sec "
+          f"({studentSpeed / teacherSpeed:.1f}x faster)")
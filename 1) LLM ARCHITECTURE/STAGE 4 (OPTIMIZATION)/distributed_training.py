@@ -0,0 +1,163 @@
+import argparse
+import functools
+import os
+import time
+import tiktoken
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Subset
+from torch.utils.data.distributed import DistributedSampler
+
+from gpt_model import GPT_CONFIG_124M, GPTModel
+from pretraining import GPTDatasetV1, trainModel
+from benchmark_training import loadVerdict
+from checkpoint_format import loadModel
+from instruction_finetuning import InstructionDataset, finalCollate, loadInstructionData
+
+
+def setupDistributed(rank, worldSize, port=29500, numThreads=None):
+    # One CPU process per rank, gradients exchanged over gloo. Threads are split between the ranks
+    os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+    os.environ.setdefault("MASTER_PORT", str(port))
+    dist.init_process_group("gloo", rank=rank, world_size=worldSize)
+    torch.set_num_threads(numThreads or max(1, (os.cpu_count() or 1) // worldSize))
+
+
+def distributedLoader(dataset, batch_size, shuffle=True, drop_last=True, collate_fn=None, seed=123):
+    # Every rank iterates over its own 1/worldSize of the dataset (GPTDatasetV1, InstructionDataset + finalCollate, ...).
+    # The sampler shuffles indices with a seed shared by all ranks, trainModel reshuffles it every epoch (set_epoch)
+    sampler = DistributedSampler(dataset, shuffle=shuffle, seed=seed, drop_last=drop_last)
+    return DataLoader(dataset, batch_size=batch_size, sampler=sampler, drop_last=drop_last, collate_fn=collate_fn)
+
+
+def wrapDistributed(model, bucketCapMb=25):
+    # Gradients are all-reduced in buckets of bucketCapMb while backward is still running; the buckets are
+    # views of the .grad tensors, so no extra gradient copy is kept
+    return DistributedDataParallel(model, bucket_cap_mb=bucketCapMb, gradient_as_bucket_view=True)
+
+
+def launch(worker, worldSize, *args, join=True):
+    # worker(rank, worldSize, *args) in worldSize local processes. join=False returns the process context
+    # (read results from a queue first, then context.join())
+    return mp.spawn(worker, args=(worldSize, *args), nprocs=worldSize, join=join)
+
+
+def collectResult(processes, queue):
+    # First result put on the queue by rank 0. A crashed (or OOM-killed) rank raises here instead of blocking forever
+    while queue.empty():
+        processes.join(timeout=1)
+    result = queue.get()
+    processes.join()
+    return result
+
+
+def pretrainWorker(rank, worldSize, cfg, numOfEpochs, batchSize, port):
+    # STAGE 2 run ("The Verdict") with every rank training on its share of the windows
+    setupDistributed(rank, worldSize, port)
+    rawtext = loadVerdict()
+    splitIdx = int(0.90 * len(rawtext))
+    tokenizer = tiktoken.get_encoding("gpt2")
+    trainDataset = GPTDatasetV1(rawtext[:splitIdx], tokenizer, cfg["context_length"], cfg["context_length"])
+    validationDataset = GPTDatasetV1(rawtext[splitIdx:], tokenizer, cfg["context_length"], cfg["context_length"])
+    trainLoader = distributedLoader(trainDataset, batchSize)
+    validationLoader = DataLoader(validationDataset, batch_size=batchSize, shuffle=False)  # Rank 0 evaluates everything
+
+    torch.manual_seed(123)  # Same initial weights on every rank (DDP also broadcasts rank 0's)
+    model = wrapDistributed(GPTModel(cfg))
+    optimizer = torch.optim.AdamW(model.parameters(), lr=0.0004, weight_decay=0.1)
+    trainModel(model, trainLoader, validationLoader, optimizer, torch.device("cpu"), numOfEpochs=numOfEpochs,
+               evalFreq=5, evalIter=5, startContext="Every effort moves you", tokenizer=tokenizer)
+    dist.destroy_process_group()
+
+
+def finetuneWorker(rank, worldSize, cfg, numOfEpochs, batchSize, port, checkpointDir):
+    # STAGE 3 instruction finetuning: InstructionDataset split over the ranks, padded per batch by finalCollate.
+    # Padding targets use ignore_index=0, the index calculateLossBatch already ignores
+    setupDistributed(rank, worldSize, port)
+    tokenizer = tiktoken.get_encoding("gpt2")
+    trainData, validationData, _ = loadInstructionData()
+    collate = functools.partial(finalCollate, ignore_index=0, allowed_max_length=cfg["context_length"])
+    trainLoader = distributedLoader(InstructionDataset(trainData, tokenizer), batchSize, collate_fn=collate)
+    validationLoader = DataLoader(InstructionDataset(validationData, tokenizer), batch_size=batchSize, shuffle=False, collate_fn=collate)
+
+    torch.manual_seed(123)
+    model = loadModel(checkpointDir) if checkpointDir else GPTModel(cfg)  # checkpoint_format.py directory, e.g. converted GPT-2
+    model = wrapDistributed(model)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=0.00005, weight_decay=0.1)
+    trainModel(model, trainLoader, validationLoader, optimizer, torch.device("cpu"), numOfEpochs=numOfEpochs,
+               evalFreq=5, evalIter=5, startContext=None, tokenizer=tokenizer)
+    dist.destroy_process_group()
+
+
+def parityWorker(rank, worldSize, cfg, port, queue):
+    # One SGD step on the same 4 windows: worldSize ranks x (4 / worldSize) rows vs one process x 4 rows
+    setupDistributed(rank, worldSize, port)
+    dataset = Subset(GPTDatasetV1(loadVerdict(), tiktoken.get_encoding("gpt2"), cfg["context_length"], cfg["context_length"]), range(4))
+    trainLoader = distributedLoader(dataset, 4 // worldSize, shuffle=False)
+    torch.manual_seed(123)
+    model = wrapDistributed(GPTModel(cfg))
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    trainModel(model, trainLoader, trainLoader, optimizer, torch.device("cpu"), numOfEpochs=1, evalFreq=1000, evalIter=1,
+               startContext=None, tokenizer=None)
+    if rank == 0:
+        queue.put(torch.cat([p.detach().flatten() for p in model.module.parameters()]).numpy())
+    dist.destroy_process_group()
+
+
+def scalingWorker(rank, worldSize, cfg, batchSize, port, queue):
+    # Weak scaling: batchSize rows per rank, one epoch over the windows
+    setupDistributed(rank, worldSize, port)
+    dataset = GPTDatasetV1(loadVerdict(), tiktoken.get_encoding("gpt2"), cfg["context_length"], cfg["context_length"] // 4)
+    trainLoader = distributedLoader(dataset, batchSize)
+    torch.manual_seed(123)
+    model = wrapDistributed(GPTModel(cfg))
+    optimizer = torch.optim.AdamW(model.parameters(), lr=0.0004, weight_decay=0.1)
+    dist.barrier()
+    startTime = time.time()
+    trainModel(model, trainLoader, trainLoader, optimizer, torch.device("cpu"), numOfEpochs=1, evalFreq=10**9, evalIter=1,
+               startContext=None, tokenizer=None)
+    dist.barrier()
+    if rank == 0:
+        queue.put((len(trainLoader) * batchSize * cfg["context_length"] * worldSize, time.time() - startTime))
+    dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Data-parallel GPTModel training on local CPU processes (gloo)")
+    parser.add_argument("--task", choices=["pretrain", "finetune"], default="pretrain")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint_format.py directory to finetune from")
+    parser.add_argument("--nproc", type=int, default=2, help="number of training processes")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch_size", type=int, default=2, help="rows per process and step")
+    parser.add_argument("--port", type=int, default=29500)
+    parser.add_argument("--benchmark", action="store_true", help="parity check + scaling over --world_sizes processes")
+    parser.add_argument("--world_sizes", default="1,2,4,8", help="process counts of the scaling benchmark")
+    args = parser.parse_args()
+
+    if not args.benchmark and args.task == "pretrain":
+        launch(pretrainWorker, args.nproc, GPT_CONFIG_124M, args.epochs, args.batch_size, args.port)
+    elif not args.benchmark:
+        launch(finetuneWorker, args.nproc, GPT_CONFIG_124M, args.epochs, args.batch_size, args.port, args.checkpoint)
+    else:
+        # Small config so that 8 replicas (weights + grads + AdamW state + 50257-wide logits each) fit in RAM
+        cfg = {**GPT_CONFIG_124M, "context_length": 64, "emb_dim": 128, "n_layers": 4, "n_heads": 4, "n_kv_heads": 4, "drop_rate": 0.0}
+        context = mp.get_context("spawn")
+        queue = context.Queue()
+
+        parameters = {}
+        for worldSize in [1, 2]:
+            processes = launch(parityWorker, worldSize, cfg, args.port + worldSize, queue, join=False)
+            parameters[worldSize] = collectResult(processes, queue)
+        print(f"Parity, 2 ranks x 2 rows vs 1 rank x 4 rows, max parameter difference after one step: "
+              f"{abs(parameters[1] - parameters[2]).max():.1e}")
+
+        baseline = None
+        for worldSize in [int(size) for size in args.world_sizes.split(",")]:
+            processes = launch(scalingWorker, worldSize, cfg, args.batch_size, args.port + 10 + worldSize, queue, join=False)
+            numTokens, elapsed = collectResult(processes, queue)
+            tokensPerSec = numTokens / elapsed
+            baseline = baseline or tokensPerSec
+            print(f"{worldSize} process(es): {tokensPerSec:.0f} tokens/sec, {tokensPerSec / baseline:.2f}x "
+                  f"(efficiency {tokensPerSec / baseline / worldSize:.0%})")
@@ -0,0 +1,746 @@
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+
+GPT_CONFIG_124M = {
+    "vocab_size": 50257,
+    "context_length":256, # 1024-->256 (for local pc)
+    "emb_dim":768,
+    "n_layers":12,
+    "n_heads":12,
+    "drop_rate":0.1,
+    "qkv_bias": False,
+    "fused_qkv": False, # True --> one QKV matmul + scaled_dot_product_attention, no mask buffer
+    "n_kv_heads": 12, # < n_heads --> groups of query heads share one K/V head (GQA), 1 --> multi-query attention
+    "sliding_window": None, # int --> each token attends only to the last sliding_window tokens, inputs may exceed context_length
+    "checkpoint_every": None, # k --> activations of every k-th TransformerBlock are recomputed in backward instead of stored
+    "checkpoint_budget_mb": None # MB --> as few blocks checkpointed as keep the block activations of a training step under this
+}
+
+# trainModel(..., trainConfig=TRAIN_CONFIG_124M), None --> plain fp32 AdamW steps as in the STAGE 2 notebook
+TRAIN_CONFIG_124M = {
+    "peak_lr": 0.0004,
+    "min_lr": 0.00004, # Cosine decay ends here
+    "warmup_steps": 10, # Linear warmup from 0 (in optimizer steps)
+    "grad_accum_steps": 4, # Effective batch size = batch_size * grad_accum_steps
+    "max_grad_norm": 1.0, # None --> no clipping
+    "bf16": True # torch.autocast to bfloat16 for forward + loss (weights and optimizer state stay fp32)
+}
+
+# scaled_dot_product_attention(..., enable_gqa=) exists from torch 2.5 on
+SDPA_ENABLE_GQA = tuple(int(part) for part in torch.__version__.split("+")[0].split(".")[:2]) >= (2, 5)
+
+modelConfigs = {
+    "gpt2-small (124M)": {"emb_dim":768, "n_layers": 12, "n_heads": 12},
+    "gpt2-medium (355M)": {"emb_dim":1024, "n_layers": 24, "n_heads": 16},
+    "gpt2-large (774M)": {"emb_dim":1280, "n_layers": 36, "n_heads": 20},
+    "gpt2-xl (1558M)": {"emb_dim":1600, "n_layers": 48, "n_heads": 25}
+}
+
+
+'Layer Normalization'
+class LayerNorm(nn.Module):
+    def __init__(self, emb_dim):
+        super().__init__()
+        self.eps = 1e-5
+        self.scale = nn.Parameter(torch.ones(emb_dim))
+        self.shift = nn.Parameter(torch.zeros(emb_dim))
+
+    def forward(self, x):
+        mean = x.mean(dim =-1, keepdim= True) # Mean Along Column
+        var = x.var(dim =-1, keepdim= True, unbiased = False) # Variance Along Column
+        normalizedX = (x-mean)/torch.sqrt(var+self.eps)  # Eps is small constant to prevent dividing by 0 during normalization
+        return self.scale * normalizedX + self.shift
+
+
+'GELU ACTIVATION FUNCTION'
+class GELU(nn.Module):
+    def __init__(self):
+        super().__init__()
+
+    def forward(self, x):
+        return 0.5 * x * (1 + torch.tanh(
+            torch.sqrt(torch.tensor(2 / torch.pi)) * (x + 0.044715 * torch.pow(x, 3))
+        ))
+
+
+'Feed Forward Neural Network'
+class FeedForward(nn.Module):
+    def __init__(self, cfg):
+        super().__init__()
+        self.layers = nn.Sequential(
+            nn.Linear(cfg["emb_dim"], 4*cfg["emb_dim"]), #Expansion
+            nn.GELU(), # Activation
+            nn.Linear(4*cfg["emb_dim"], cfg["emb_dim"]), # Compression
+        )
+
+    def forward(self, x):
+        return self.layers(x)
+
+
+'Masked Self Attention'
+class MultiHeadAttention(nn.Module):
+    def __init__(self, d_in, d_out, context_length, dropout, num_heads, qkv_bias=False, fused_qkv=False, num_kv_heads=None,
+                 sliding_window=None):
+        super().__init__()
+        assert (d_out % num_heads == 0), \
+            "d_out must be divisible by num_heads"
+        num_kv_heads = num_kv_heads or num_heads
+        assert (num_heads % num_kv_heads == 0), \
+            "num_heads must be divisible by num_kv_heads"
+
+        self.d_out = d_out
+        self.num_heads = num_heads
+        self.num_kv_heads = num_kv_heads
+        self.group_size = num_heads // num_kv_heads # Query heads sharing one K/V head
+        self.head_dim = d_out // num_heads # Reduce the projection dim to match desired output dim
+        self.kv_dim = num_kv_heads * self.head_dim
+        self.context_length = context_length
+        self.fused_qkv = fused_qkv
+        self.sliding_window = sliding_window
+        # A sliding window only ever reads its last sliding_window keys, so the cache is a ring buffer of that size
+        self.cacheSize = sliding_window or context_length
+
+        if fused_qkv:
+            # One matmul for Q, K and V (same layout as GPT-2's c_attn), causal masking is left to SDPA
+            self.W_qkv = nn.Linear(d_in, d_out + 2 * self.kv_dim, bias=qkv_bias)
+        else:
+            self.W_query = nn.Linear(d_in, d_out, bias=qkv_bias)
+            self.W_key = nn.Linear(d_in, self.kv_dim, bias=qkv_bias)
+            self.W_value = nn.Linear(d_in, self.kv_dim, bias=qkv_bias)
+            self.register_buffer(
+                "mask",
+                torch.triu(torch.ones(context_length, context_length),
+                           diagonal=1)
+            )
+        self.out_proj = nn.Linear(d_out, d_out)  # Linear layer to combine head outputs
+        self.dropout = nn.Dropout(dropout)
+
+        # KV cache: keys/values of the tokens seen so far, filled only when forward is called with useCache=True
+        self.cacheK, self.cacheV = None, None
+        self.ptrCurrentPos = 0
+
+    def resetCache(self):
+        self.cacheK, self.cacheV = None, None
+        self.ptrCurrentPos = 0
+
+    def truncateCache(self, numTokens):
+        if self.sliding_window is not None and numTokens < self.ptrCurrentPos:
+            raise NotImplementedError("Rolling back a sliding-window cache is not supported, its ring buffer overwrites old keys")
+        # Entries past numTokens are never read again and get overwritten by the next write
+        self.ptrCurrentPos = min(self.ptrCurrentPos, numTokens)
+
+    def allocateCache(self, batchSize, device=None, dtype=None):
+        # Cache is allocated once for the full context and filled in place, so decoding never re-concatenates
+        cacheShape = (batchSize, self.num_kv_heads, self.cacheSize, self.head_dim)
+        self.cacheK = torch.zeros(cacheShape, device=device, dtype=dtype)
+        self.cacheV = torch.zeros(cacheShape, device=device, dtype=dtype)
+        self.cachePositions = torch.full((self.cacheSize,), -1, dtype=torch.long, device=device)  # Absolute position held by each slot
+        self.ptrCurrentPos = 0
+
+    def forward(self, x, useCache=False, positions=None, slotOffset=0):
+        b, num_tokens, d_in = x.shape
+
+        if self.fused_qkv:
+            # (b, num_tokens, d_out + 2*kv_dim) -> queries (b, num_tokens, num_heads, head_dim), keys/values with num_kv_heads
+            queries, keys, values = self.W_qkv(x).split([self.d_out, self.kv_dim, self.kv_dim], dim=-1)
+            queries = queries.view(b, num_tokens, self.num_heads, self.head_dim)
+            keys = keys.view(b, num_tokens, self.num_kv_heads, self.head_dim)
+            values = values.view(b, num_tokens, self.num_kv_heads, self.head_dim)
+        else:
+            keys = self.W_key(x) # Shape: (b, num_tokens, d_out)
+            queries = self.W_query(x)
+            values = self.W_value(x)
+
+            # We implicitly split the matrix by adding a `num_heads` dimension
+            # Unroll last dim: (b, num_tokens, d_out) -> (b, num_tokens, num_heads, head_dim)
+            keys = keys.view(b, num_tokens, self.num_kv_heads, self.head_dim)
+            values = values.view(b, num_tokens, self.num_kv_heads, self.head_dim)
+            queries = queries.view(b, num_tokens, self.num_heads, self.head_dim)
+
+        if positions is not None:
+            if self.sliding_window is not None:
+                raise NotImplementedError("Slot mode (positions) is not supported with sliding_window")
+            # Slot mode (continuous batching): row i owns cache row slotOffset+i and carries its own positions
+            rows = torch.arange(slotOffset, slotOffset + b, device=x.device).unsqueeze(1)
+            self.cacheK[rows, :, positions] = keys
+            self.cacheV[rows, :, positions] = values
+            kvLen = int(positions.max()) + 1
+            keys = self.cacheK[slotOffset:slotOffset + b, :, :kvLen]
+            values = self.cacheV[slotOffset:slotOffset + b, :, :kvLen]
+            queries = queries.transpose(1, 2)
+
+            # A key is visible only if it is not ahead of the query, this also hides stale entries of a reused slot
+            keyPositions = torch.arange(kvLen, device=x.device)
+            mask_bool = (keyPositions.view(1, 1, kvLen) > positions.unsqueeze(-1)).unsqueeze(1)
+            if self.fused_qkv:
+                return self.attendFused(queries, keys, values, mask_bool)
+            return self.attend(queries, keys, values, mask_bool)
+
+        # Transpose: (b, num_tokens, num_heads, head_dim) -> (b, num_heads, num_tokens, head_dim)
+        keys = keys.transpose(1, 2)
+        queries = queries.transpose(1, 2)
+        values = values.transpose(1, 2)
+
+        if self.sliding_window is not None:
+            return self.forwardSlidingWindow(queries, keys, values, useCache)
+
+        startPos = 0
+        if useCache:
+            if self.cacheK is None or self.cacheK.shape[0] != b:
+                self.allocateCache(b, device=keys.device, dtype=keys.dtype)
+            startPos = self.ptrCurrentPos
+            endPos = startPos + num_tokens
+            if endPos > self.context_length:
+                raise ValueError(f"KV cache overflow: {endPos} tokens exceed context length {self.context_length}")
+            self.cacheK[:, :, startPos:endPos] = keys
+            self.cacheV[:, :, startPos:endPos] = values
+            self.ptrCurrentPos = endPos
+            keys = self.cacheK[:, :, :endPos]
+            values = self.cacheV[:, :, :endPos]
+
+        if self.fused_qkv:
+            if startPos == 0:
+                return self.attendFused(queries, keys, values, isCausal=True)
+            if num_tokens == 1:
+                return self.attendFused(queries, keys, values)  # A single new token sees every cached key
+            # Several new tokens after cached ones: causal mask offset by startPos, built on the fly
+            mask_bool = torch.triu(torch.ones(num_tokens, startPos + num_tokens, dtype=torch.bool, device=x.device),
+                                   diagonal=startPos + 1)
+            return self.attendFused(queries, keys, values, mask_bool)
+
+        # Rows of the mask are the absolute positions of the queries, columns are every cached key up to them
+        mask_bool = self.mask.bool()[startPos:startPos + num_tokens, :startPos + num_tokens]
+        return self.attend(queries, keys, values, mask_bool)
+
+    def forwardSlidingWindow(self, queries, keys, values, useCache=False):
+        # Local attention: query i sees keys i-sliding_window+1 .. i. Queries are processed in chunks of
+        # sliding_window, each against at most 2*sliding_window keys (+ the cached ones), so memory is O(n*w) not O(n^2)
+        b, _, num_tokens, _ = queries.shape
+        window = self.sliding_window
+        startPos = 0
+        pastKeys = pastValues = None
+        if useCache:
+            if self.cacheK is None or self.cacheK.shape[0] != b:
+                self.allocateCache(b, device=keys.device, dtype=keys.dtype)
+            startPos = self.ptrCurrentPos
+            pastKeys, pastValues, pastPositions = self.cacheK, self.cacheV, self.cachePositions
+
+        queryPositions = torch.arange(startPos, startPos + num_tokens, device=queries.device)
+        outputs = []
+        for chunkStart in range(0, num_tokens, window):
+            chunkEnd = min(chunkStart + window, num_tokens)
+            keyStart = max(0, chunkStart - window + 1)
+            chunkKeys, chunkValues = keys[:, :, keyStart:chunkEnd], values[:, :, keyStart:chunkEnd]
+            keyPositions = queryPositions[keyStart:chunkEnd]
+            if pastKeys is not None and chunkStart == 0:
+                # Only the first chunk can still reach keys cached by earlier calls
+                chunkKeys = torch.cat((pastKeys, chunkKeys), dim=2)
+                chunkValues = torch.cat((pastValues, chunkValues), dim=2)
+                keyPositions = torch.cat((pastPositions, keyPositions))
+
+            # A key is visible if it is not ahead of the query and not older than the window (empty slots are -1)
+            chunkPositions = queryPositions[chunkStart:chunkEnd].unsqueeze(1)
+            mask_bool = (keyPositions > chunkPositions) | (keyPositions <= chunkPositions - window) | (keyPositions < 0)
+            chunkQueries = queries[:, :, chunkStart:chunkEnd]
+            if self.fused_qkv:
+                outputs.append(self.attendFused(chunkQueries, chunkKeys, chunkValues, mask_bool))
+            else:
+                outputs.append(self.attend(chunkQueries, chunkKeys, chunkValues, mask_bool))
+
+        if useCache:
+            # Write the newest keys into the ring buffer, slot = absolute position % sliding_window
+            keep = slice(max(0, num_tokens - self.cacheSize), num_tokens)
+            slots = queryPositions[keep] % self.cacheSize
+            self.cacheK[:, :, slots] = keys[:, :, keep]
+            self.cacheV[:, :, slots] = values[:, :, keep]
+            self.cachePositions[slots] = queryPositions[keep]
+            self.ptrCurrentPos = startPos + num_tokens
+
+        return torch.cat(outputs, dim=1)
+
+    def attendFused(self, queries, keys, values, mask_bool=None, isCausal=False):
+        b, _, num_tokens, _ = queries.shape
+
+        # SDPA picks a fused kernel (softmax, scaling and dropout in one op), its mask means True = may attend
+        attnMask = None if mask_bool is None else ~mask_bool
+        gqaArgs = {}
+        if self.group_size > 1 and SDPA_ENABLE_GQA:
+            gqaArgs["enable_gqa"] = True
+        elif self.group_size > 1:
+            # torch < 2.5: every query head gets its own copy of its group's K/V head
+            keys = keys.repeat_interleave(self.group_size, dim=1)
+            values = values.repeat_interleave(self.group_size, dim=1)
+        context_vec = F.scaled_dot_product_attention(
+            queries, keys, values, attn_mask=attnMask,
+            dropout_p=self.dropout.p if self.training else 0.0, is_causal=isCausal, **gqaArgs
+        )
+
+        # (b, num_heads, num_tokens, head_dim) -> (b, num_tokens, d_out)
+        context_vec = context_vec.transpose(1, 2).contiguous().view(b, num_tokens, self.d_out)
+        return self.out_proj(context_vec)
+
+    def attend(self, queries, keys, values, mask_bool):
+        b, _, num_tokens, _ = queries.shape
+
+        if self.group_size > 1:
+            # GQA: the query heads of a group are stacked along the token axis, so each K/V head is used
+            # by one plain batched matmul: (b, num_heads, num_tokens, head_dim) -> (b, num_kv_heads, group_size*num_tokens, head_dim)
+            queries = queries.reshape(b, self.num_kv_heads, self.group_size * num_tokens, self.head_dim)
+
+        # Compute scaled dot-product attention (aka self-attention) with a causal mask
+        attn_scores = queries @ keys.transpose(2, 3)  # Dot product for each head
+
+        # Use the mask to fill attention scores
+        if self.group_size > 1:
+            attn_scores = attn_scores.view(b, self.num_kv_heads, self.group_size, num_tokens, -1)
+            mask_bool = mask_bool.unsqueeze(2) if mask_bool.dim() == 4 else mask_bool
+        attn_scores.masked_fill_(mask_bool, -torch.inf)
+
+        attn_weights = torch.softmax(attn_scores / keys.shape[-1]**0.5, dim=-1)
+        attn_weights = self.dropout(attn_weights)
+        if self.group_size > 1:
+            attn_weights = attn_weights.view(b, self.num_kv_heads, self.group_size * num_tokens, -1)
+
+        # Shape: (b, num_tokens, num_heads, head_dim)
+        context_vec = (attn_weights @ values).view(b, self.num_heads, num_tokens, self.head_dim).transpose(1, 2)
+
+        # Combine heads, where self.d_out = self.num_heads * self.head_dim
+        context_vec = context_vec.contiguous().view(b, num_tokens, self.d_out)
+        context_vec = self.out_proj(context_vec) # optional projection
+
+        return context_vec
+
+
+'TRANSFORMER BLOCK'
+class TransformerBlock(nn.Module):
+    def __init__(self, cfg):
+        super().__init__()
+        self.attention = MultiHeadAttention(
+            d_in = cfg["emb_dim"],
+            d_out = cfg["emb_dim"],
+            context_length = cfg["context_length"],
+            dropout = cfg["drop_rate"],
+            num_heads = cfg["n_heads"],
+            qkv_bias= cfg["qkv_bias"],
+            fused_qkv = cfg.get("fused_qkv", False),
+            num_kv_heads = cfg.get("n_kv_heads"),
+            sliding_window = cfg.get("sliding_window")
+        )
+        self.feedforwardNN = FeedForward(cfg)
+        self.normalization1 = LayerNorm(cfg["emb_dim"])
+        self.normalization2 = LayerNorm(cfg["emb_dim"])
+        self.drop_shortcut = nn.Dropout(cfg["drop_rate"])
+
+    def forward(self, x, useCache=False, positions=None, slotOffset=0):
+        shortcut = x
+        x = self.normalization1(x)
+        x = self.attention(x, useCache=useCache, positions=positions, slotOffset=slotOffset)  #Shape [batch_size, num_tokens, emb_size]
+        x = self.drop_shortcut(x)
+        x = shortcut + x # Add the original input block
+
+        # Shortcut connection for feed forward block
+        shortcut = x
+        x = self.normalization2(x)
+        x = self.feedforwardNN(x)
+        x = self.drop_shortcut(x)
+        x = shortcut + x
+        return x
+
+
+class GPTModel(nn.Module):
+    def __init__(self, cfg):
+        super().__init__()
+        self.tokenEmbeddings = nn.Embedding(cfg["vocab_size"], cfg["emb_dim"])
+        self.positionalEmbeddings = nn.Embedding(cfg["context_length"], cfg["emb_dim"]) #(1024x768)
+        self.dropuoutEmbeddings = nn.Dropout(cfg["drop_rate"])
+
+        'Transformer Block'
+        self.trf_blocks = nn.Sequential(
+            *[TransformerBlock(cfg) for _ in range(cfg["n_layers"])]
+        )
+        'Layer Normalization'
+        self.finalNormalization = LayerNorm(cfg["emb_dim"])
+        self.out_head = nn.Linear(
+            cfg["emb_dim"],
+            cfg["vocab_size"], bias = False
+        )
+        self.currentPos = 0  # Number of tokens already stored in the KV cache
+        self.slidingWindow = cfg.get("sliding_window")
+        self.checkpointEvery = cfg.get("checkpoint_every")
+        self.checkpointBudgetMb = cfg.get("checkpoint_budget_mb")
+        self.activationCost = None  # (bytes per call, per token, per token²) of one block, measured on first use
+
+    def resetCache(self):
+        for block in self.trf_blocks:
+            block.attention.resetCache()
+        self.currentPos = 0
+
+    def truncateCache(self, numTokens):
+        # Roll the cache back to its first numTokens tokens (e.g. drop rejected draft tokens)
+        for block in self.trf_blocks:
+            block.attention.truncateCache(numTokens)
+        self.currentPos = min(self.currentPos, numTokens)
+
+    def allocateCache(self, batchSize):
+        # One cache row (slot) per sequence, used with `positions` when rows are at different lengths
+        weight = self.tokenEmbeddings.weight  # out_head may be an Int8Linear (no .weight)
+        for block in self.trf_blocks:
+            block.attention.allocateCache(batchSize, device=weight.device, dtype=weight.dtype)
+        self.currentPos = 0
+
+    def readCache(self, numTokens, row=0):
+        if self.slidingWindow is not None:
+            raise NotImplementedError("readCache is not supported with sliding_window (the cache is a ring buffer)")
+        # Keys/values of the first numTokens cached tokens of one row, shape: (n_layers, 2, num_heads, numTokens, head_dim)
+        return torch.stack([
+            torch.stack((block.attention.cacheK[row, :, :numTokens], block.attention.cacheV[row, :, :numTokens]))
+            for block in self.trf_blocks
+        ])
+
+    def loadCache(self, layerCache):
+        # Starts a batch-1 cache from keys/values saved with readCache, the next tokens continue after them
+        numTokens = layerCache.shape[3]
+        self.allocateCache(1)
+        for block, (keys, values) in zip(self.trf_blocks, layerCache):
+            block.attention.cacheK[0, :, :numTokens] = keys
+            block.attention.cacheV[0, :, :numTokens] = values
+            block.attention.ptrCurrentPos = numTokens
+        self.currentPos = numTokens
+
+    def copyCacheSlot(self, src, dst):
+        for block in self.trf_blocks:
+            block.attention.cacheK[dst] = block.attention.cacheK[src]
+            block.attention.cacheV[dst] = block.attention.cacheV[src]
+
+    def measureActivationCost(self):
+        # Bytes one TransformerBlock keeps for backward, as c + a * numTokens + q * numTokens² per row (c: tensors of a fixed
+        # size such as the bool copy of the causal mask, q: attention scores), fitted from three probe forwards that
+        # record every saved tensor (weights and buffers excluded)
+        block = self.trf_blocks[0]
+        weights = {t.untyped_storage().data_ptr() for t in list(block.parameters()) + list(block.buffers())}
+        probeTokens = max(1, min(32, self.positionalEmbeddings.weight.shape[0] // 4))  # All probes fit in the context
+        sizes = []
+        for numTokens in (probeTokens, 2 * probeTokens, 4 * probeTokens):
+            saved = {}
+
+            def pack(tensor):
+                storage = tensor.untyped_storage()
+                if storage.data_ptr() not in weights:
+                    saved[storage.data_ptr()] = storage.nbytes()
+                return tensor
+
+            device = self.tokenEmbeddings.weight.device
+            x = torch.zeros(1, numTokens, self.tokenEmbeddings.weight.shape[1], device=device, requires_grad=True)
+            rngDevices = [device] if device.type == "cuda" else []
+            with torch.random.fork_rng(devices=rngDevices), torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+                block(x)  # Dropout draws from a forked RNG, training randomness is unchanged
+            sizes.append(sum(saved.values()))
+        perTokenSquared = (sizes[2] - 3 * sizes[1] + 2 * sizes[0]) / (6 * probeTokens ** 2)
+        perToken = (sizes[1] - sizes[0] - 3 * perTokenSquared * probeTokens ** 2) / probeTokens
+        self.activationCost = (sizes[0] - perToken * probeTokens - perTokenSquared * probeTokens ** 2, perToken, perTokenSquared)
+
+    def checkpointedBlocks(self, batchSize, numTokens):
+        # Indices of the blocks run under torch.utils.checkpoint for this input shape
+        numBlocks = len(self.trf_blocks)
+        if self.checkpointEvery:
+            return set(range(0, numBlocks, self.checkpointEvery))
+        if not self.checkpointBudgetMb:
+            return set()
+        if self.activationCost is None:
+            self.measureActivationCost()
+        perCall, perToken, perTokenSquared = self.activationCost
+        blockBytes = perCall + batchSize * (perToken * numTokens + perTokenSquared * numTokens ** 2)
+        inputBytes = batchSize * numTokens * self.tokenEmbeddings.weight.shape[1] * self.tokenEmbeddings.weight.element_size()
+        for numCheckpointed in range(numBlocks + 1):
+            # Stored blocks + block inputs kept at checkpoints + one block recomputed at a time in backward
+            needed = (numBlocks - numCheckpointed) * blockBytes + numCheckpointed * inputBytes + (blockBytes if numCheckpointed else 0)
+            if needed <= self.checkpointBudgetMb * 1024**2:
+                break
+        return {int(i * numBlocks / numCheckpointed) for i in range(numCheckpointed)}  # Spread evenly
+
+    def forward(self, inIdx, useCache=False, lastLogitsOnly=False, positions=None, slotOffset=0, logitIndex=None):
+        batchSize, seqLen  = inIdx.shape
+        tokenEmbeddings = self.tokenEmbeddings(inIdx)
+        if positions is not None:
+            # Per-row absolute positions (batch, seqLen) for slot-cached batches of different lengths
+            positionIds = positions
+        elif useCache:
+            # New tokens continue from the last cached position
+            positionIds = torch.arange(self.currentPos, self.currentPos + seqLen, device = inIdx.device)
+            self.currentPos += seqLen
+        else:
+            positionIds = torch.arange(seqLen, device = inIdx.device)
+        if self.slidingWindow is not None and positions is None:
+            # Rolling positions: past context_length the learned positions wrap around, so any length can be embedded
+            positionIds = positionIds % self.positionalEmbeddings.weight.shape[0]
+        positionalEmbeddings = self.positionalEmbeddings(positionIds)
+        x = tokenEmbeddings + positionalEmbeddings
+        x = self.dropuoutEmbeddings(x)
+        training = self.training and torch.is_grad_enabled() and not useCache
+        checkpointed = self.checkpointedBlocks(batchSize, seqLen) if training else set()
+        for blockIdx, block in enumerate(self.trf_blocks):
+            if blockIdx in checkpointed:
+                # Only the block input is stored, the block runs again in backward (same dropout masks)
+                x = checkpoint(block, x, use_reentrant=False)
+            else:
+                x = block(x, useCache=useCache, positions=positions, slotOffset=slotOffset)
+        x = self.finalNormalization(x)
+        if logitIndex is not None:
+            x = x[torch.arange(batchSize, device=x.device), logitIndex].unsqueeze(1)  # Last real token of each padded row
+        elif lastLogitsOnly:
+            # Decoding only needs the next-token logits, skip projecting every position
+            # (an int keeps that many trailing positions, e.g. to verify draft tokens)
+            x = x[:, -int(lastLogitsOnly):, :]
+        logits = self.out_head(x)
+        return logits
+
+
+def assign(left, right):
+    if left.shape != right.shape:
+        raise ValueError(f"Shape mismatch, Left: {left.shape}, Right: {right.shape}")
+    return torch.nn.Parameter(torch.tensor(right))
+
+
+'LINKING GPT MODEL WITH PRETRAINED WEIGHTS'
+def loadWeights(gpt, params):
+    gpt.positionalEmbeddings.weight = assign(gpt.positionalEmbeddings.weight, params["wpe"])
+    gpt.tokenEmbeddings.weight = assign(gpt.tokenEmbeddings.weight, params["wte"])
+
+    for b in range(len(params["blocks"])):
+        if gpt.trf_blocks[b].attention.fused_qkv:
+            # Fused attention takes c_attn as it is, no split needed
+            gpt.trf_blocks[b].attention.W_qkv.weight = assign(
+                gpt.trf_blocks[b].attention.W_qkv.weight, params["blocks"][b]["attn"]["c_attn"]["w"].T
+            )
+            gpt.trf_blocks[b].attention.W_qkv.bias = assign(
+                gpt.trf_blocks[b].attention.W_qkv.bias, params["blocks"][b]["attn"]["c_attn"]["b"]
+            )
+        else:
+            # Split Q, K, V weights
+            q_w, k_w, v_w = np.split(
+                params["blocks"][b]["attn"]["c_attn"]["w"], 3, axis=-1
+            )
+            gpt.trf_blocks[b].attention.W_query.weight = assign(
+                gpt.trf_blocks[b].attention.W_query.weight, q_w.T
+            )
+            gpt.trf_blocks[b].attention.W_key.weight = assign(
+                gpt.trf_blocks[b].attention.W_key.weight, k_w.T
+            )
+            gpt.trf_blocks[b].attention.W_value.weight = assign(
+                gpt.trf_blocks[b].attention.W_value.weight, v_w.T
+            )
+
+            # Biases
+            q_b, k_b, v_b = np.split(
+                params["blocks"][b]["attn"]["c_attn"]["b"], 3, axis=-1
+            )
+            gpt.trf_blocks[b].attention.W_query.bias = assign(
+                gpt.trf_blocks[b].attention.W_query.bias, q_b
+            )
+            gpt.trf_blocks[b].attention.W_key.bias = assign(
+                gpt.trf_blocks[b].attention.W_key.bias, k_b
+            )
+            gpt.trf_blocks[b].attention.W_value.bias = assign(
+                gpt.trf_blocks[b].attention.W_value.bias, v_b
+            )
+
+        # Output projection
+        gpt.trf_blocks[b].attention.out_proj.weight = assign(
+            gpt.trf_blocks[b].attention.out_proj.weight,
+            params["blocks"][b]["attn"]["c_proj"]["w"].T
+        )
+        gpt.trf_blocks[b].attention.out_proj.bias = assign(
+            gpt.trf_blocks[b].attention.out_proj.bias,
+            params["blocks"][b]["attn"]["c_proj"]["b"]
+        )
+
+        # FeedForward
+        gpt.trf_blocks[b].feedforwardNN.layers[0].weight = assign(
+            gpt.trf_blocks[b].feedforwardNN.layers[0].weight,
+            params["blocks"][b]["mlp"]["c_fc"]["w"].T
+        )
+        gpt.trf_blocks[b].feedforwardNN.layers[0].bias = assign(
+            gpt.trf_blocks[b].feedforwardNN.layers[0].bias,
+            params["blocks"][b]["mlp"]["c_fc"]["b"]
+        )
+        gpt.trf_blocks[b].feedforwardNN.layers[2].weight = assign(
+            gpt.trf_blocks[b].feedforwardNN.layers[2].weight,
+            params["blocks"][b]["mlp"]["c_proj"]["w"].T
+        )
+        gpt.trf_blocks[b].feedforwardNN.layers[2].bias = assign(
+            gpt.trf_blocks[b].feedforwardNN.layers[2].bias,
+            params["blocks"][b]["mlp"]["c_proj"]["b"]
+        )
+
+        # LayerNorms
+        gpt.trf_blocks[b].normalization1.scale = assign(
+            gpt.trf_blocks[b].normalization1.scale,
+            params["blocks"][b]["ln_1"]["g"]
+        )
+        gpt.trf_blocks[b].normalization1.shift = assign(
+            gpt.trf_blocks[b].normalization1.shift,
+            params["blocks"][b]["ln_1"]["b"]
+        )
+        gpt.trf_blocks[b].normalization2.scale = assign(
+            gpt.trf_blocks[b].normalization2.scale,
+            params["blocks"][b]["ln_2"]["g"]
+        )
+        gpt.trf_blocks[b].normalization2.shift = assign(
+            gpt.trf_blocks[b].normalization2.shift,
+            params["blocks"][b]["ln_2"]["b"]
+        )
+
+    # Final LayerNorm and output head
+    gpt.finalNormalization.scale = assign(gpt.finalNormalization.scale, params["g"])
+    gpt.finalNormalization.shift = assign(gpt.finalNormalization.shift, params["b"])
+    gpt.out_head.weight = assign(gpt.out_head.weight, params["wte"])
+
+
+def textToTokenId(text, tokenizer):
+    encoded = tokenizer.encode(text, allowed_special={'<|endoftext|>'})
+    encodedTensor = torch.tensor(encoded).unsqueeze(0) # Adding batch dimension
+    return encodedTensor
+
+def tokenIdtoText(tokenId, tokenizer):
+    flat = tokenId.squeeze(0) # Removing Batch dimension
+    return tokenizer.decode(flat.tolist())
+
+
+def nextTokenLogits(model, idx, contextSize, useCache=False):
+    # Logits of the token that follows idx, shape: (batch, vocabSize)
+    if model.slidingWindow is not None:
+        # Sliding-window attention has no hard length limit: nothing is cropped and the cache never needs a rebuild
+        if not useCache:
+            return model(idx)[:, -1, :]
+        if model.currentPos == 0:
+            return model(idx, useCache=True, lastLogitsOnly=True)[:, -1, :]
+        return model(idx[:, -1:], useCache=True, lastLogitsOnly=True)[:, -1, :]
+
+    if not useCache:
+        return model(idx[:, -contextSize:])[:, -1, :]
+
+    # Empty cache (first step) or full window: positional embeddings are absolute, so once the
+    # window slides every cached key sits at a stale position and the cropped window is prefilled again
+    if model.currentPos == 0 or model.currentPos >= contextSize:
+        model.resetCache()
+        return model(idx[:, -contextSize:], useCache=True, lastLogitsOnly=True)[:, -1, :]
+
+    # Decode step: only the newest token goes through the model
+    return model(idx[:, -1:], useCache=True, lastLogitsOnly=True)[:, -1, :]
+
+
+def generateText(model, idx, maxNewTokens, contextSize, useCache=False):
+    # idx is (batch, numTokens) array of indices in the current context
+    model.resetCache()
+    for _ in range(maxNewTokens):
+        # Predictions (context is cropped to contextSize inside)
+        with torch.no_grad():
+            logits = nextTokenLogits(model, idx, contextSize, useCache)  # (batch, vocabSize)
+
+        # S1) Apply softmax to get probabilities
+        probs = torch.softmax(logits, dim=-1)
+
+        # S2) Choose the highest probability
+        idxNext = torch.argmax(probs, dim=-1, keepdim=True)  # (batch, 1)
+
+        # S3) Append the new token to the sequence
+        idx = torch.cat((idx, idxNext), dim=1)  # (batch, numTokens+1)
+
+    model.resetCache()
+    return idx
+
+
+def nextTokenProbs(logits, temperature=1.0, topK=None):
+    # logits: (batch, vocabSize) → probabilities the next token is drawn from (one-hot at the argmax when greedy)
+    # Apply temperature scaling
+    if temperature > 0.0:
+        logits = logits / temperature
+
+    # Top-K filtering
+    if topK is not None:
+        topLogits, _ = torch.topk(logits, topK)
+        minValue = topLogits[:, -1:]  # threshold per row
+        logits = torch.where(logits < minValue, torch.tensor(float("-inf"), device=logits.device), logits)
+
+    # Convert logits → probabilities
+    probs = F.softmax(logits, dim=-1)
+    if temperature == 0.0:
+        return F.one_hot(torch.argmax(probs, dim=-1), probs.shape[-1]).to(probs.dtype)
+    return probs
+
+
+def sampleNextToken(logits, temperature=1.0, topK=None):
+    # logits: (batch, vocabSize) → next token ids: (batch, 1)
+    probs = nextTokenProbs(logits, temperature, topK)
+
+    # Sample next token
+    if temperature == 0.0:
+        return torch.argmax(probs, dim=-1, keepdim=True)
+    return torch.multinomial(probs, num_samples=1)
+
+
+@torch.no_grad()
+def generate(model, idx, maxNewTokens, contextSize, temperature=1.0, topK=None, eosId=None, useCache=False):
+    """
+    Generate tokens using a model with temperature, top-k filtering, and EOS handling.
+
+    Args:
+        model: the language model (must return logits)
+        idx: tensor of shape (1, seq_len) with starting token IDs
+        maxNewTokens: number of tokens to generate
+        contextSize: model context window
+        temperature: sampling temperature (default=1.0, lower → deterministic, 0 = greedy)
+        topK: if set, sample only from top-K tokens
+        eosId: optional end-of-sequence token ID
+        useCache: reuse keys/values of earlier tokens so each step only runs the newest token
+    """
+    model.resetCache()
+    for _ in range(maxNewTokens):
+        # Forward pass on the last `contextSize` tokens → logits
+        logits = nextTokenLogits(model, idx, contextSize, useCache)  # shape: (1, vocab_size)
+
+        # Temperature scaling → top-k filtering → softmax → sample
+        nextId = sampleNextToken(logits, temperature, topK)
+
+        # Append sampled token
+        idx = torch.cat((idx, nextId), dim=1)
+
+        # Stop if EOS generated
+        if eosId is not None and nextId.item() == eosId:
+            break
+
+    model.resetCache()
+    return idx
+
+
+if __name__ == "__main__":
+    # Parity check + tokens/sec with and without the KV cache (random weights, speed does not depend on them)
+    BASE_CONFIG = {"vocab_size": 50257, "context_length": 1024, "drop_rate": 0.0, "qkv_bias": True}
+    promptLen, numNewTokens = 32, 64
+
+    for modelName in ["gpt2-small (124M)", "gpt2-medium (355M)"]:
+        cfg = {**BASE_CONFIG, **modelConfigs[modelName]}
+        torch.manual_seed(123)
+        model = GPTModel(cfg).eval()
+        prompt = torch.randint(0, cfg["vocab_size"], (1, promptLen))
+
+        results = {}
+        for useCache in [False, True]:
+            startTime = time.time()
+            results[useCache] = generateText(model, prompt, numNewTokens, cfg["context_length"], useCache=useCache)
+            tokensPerSec = numNewTokens / (time.time() - startTime)
+            print(f"{modelName} useCache={useCache}: {tokensPerSec:.2f} tokens/sec")
+        print("Same tokens with and without cache:", torch.equal(results[False], results[True]))
+
+    # Rolling past the context window: a tiny context forces the cache to be rebuilt many times
+    tinyConfig = {**BASE_CONFIG, "context_length": 16, "emb_dim": 64, "n_layers": 2, "n_heads": 4}
+    torch.manual_seed(123)
+    tinyModel = GPTModel(tinyConfig).eval()
+    prompt = torch.randint(0, tinyConfig["vocab_size"], (1, 10))
+    uncached = generateText(tinyModel, prompt, 40, tinyConfig["context_length"], useCache=False)
+    cached = generateText(tinyModel, prompt, 40, tinyConfig["context_length"], useCache=True)
+    print("Same tokens past context_length:", torch.equal(uncached, cached))
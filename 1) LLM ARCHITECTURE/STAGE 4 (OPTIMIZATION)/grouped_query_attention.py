@@ -0,0 +1,80 @@
+import time
+import torch
+import torch.nn.functional as F
+
+from gpt_model import GPTModel, modelConfigs, generate
+
+
+def meanPoolHeads(tensor, numHeads, numKvHeads):
+    # (numHeads*head_dim, ...) -> (numKvHeads*head_dim, ...), consecutive heads are averaged into one group
+    headDim = tensor.shape[0] // numHeads
+    grouped = tensor.reshape(numKvHeads, numHeads // numKvHeads, headDim, *tensor.shape[1:])
+    return grouped.mean(dim=1).reshape(numKvHeads * headDim, *tensor.shape[1:])
+
+
+def convertToGroupedQuery(model, cfg, numKvHeads):
+    """
+    Builds a copy of a multi-head GPTModel whose K/V projections are mean-pooled into numKvHeads heads.
+    Query heads h*g .. h*g+g-1 share K/V head h, the same grouping MultiHeadAttention uses.
+    The pooled model is close to the original but should be briefly trained again (trainModel) to recover quality.
+    """
+    numHeads = cfg["n_heads"]
+    stateDict = model.state_dict()
+    for b, block in enumerate(model.trf_blocks):
+        prefix = f"trf_blocks.{b}.attention."
+        if block.attention.fused_qkv:
+            for name in ["W_qkv.weight", "W_qkv.bias"]:
+                if prefix + name not in stateDict:
+                    continue
+                queries, keys, values = stateDict[prefix + name].split(cfg["emb_dim"], dim=0)
+                stateDict[prefix + name] = torch.cat((queries, meanPoolHeads(keys, numHeads, numKvHeads),
+                                                      meanPoolHeads(values, numHeads, numKvHeads)))
+        else:
+            for name in ["W_key.weight", "W_key.bias", "W_value.weight", "W_value.bias"]:
+                if prefix + name in stateDict:
+                    stateDict[prefix + name] = meanPoolHeads(stateDict[prefix + name], numHeads, numKvHeads)
+
+    groupedModel = GPTModel({**cfg, "n_kv_heads": numKvHeads})
+    groupedModel.load_state_dict(stateDict)
+    return groupedModel.to(model.tokenEmbeddings.weight.device).train(model.training)
+
+
+def kvCacheMegabytes(cfg, batchSize, numTokens, bytesPerValue=4):
+    # Keys + values of every layer: 2 x n_layers x batch x n_kv_heads x tokens x head_dim
+    headDim = cfg["emb_dim"] // cfg["n_heads"]
+    numKvHeads = cfg.get("n_kv_heads") or cfg["n_heads"]
+    return 2 * cfg["n_layers"] * batchSize * numKvHeads * numTokens * headDim * bytesPerValue / 1024**2
+
+
+if __name__ == "__main__":
+    # KV cache memory and batched decode speed (long prompt) of MHA vs GQA/MQA (converted from the same MHA weights)
+    BASE_CONFIG = {"vocab_size": 50257, "context_length": 1024, "drop_rate": 0.0, "qkv_bias": True}
+    batchSize, promptLen, numNewTokens = 8, 768, 32
+
+    for modelName in ["gpt2-small (124M)", "gpt2-medium (355M)"]:
+        cfg = {**BASE_CONFIG, **modelConfigs[modelName]}
+        torch.manual_seed(123)
+        model = GPTModel(cfg).eval()
+        prompt = torch.randint(0, cfg["vocab_size"], (batchSize, promptLen))
+        with torch.no_grad():
+            referenceLogProbs = F.log_softmax(model(prompt[:1, :128]), dim=-1)
+
+        for numKvHeads in [cfg["n_heads"], cfg["n_heads"] // 4, 1]:
+            groupedModel = model if numKvHeads == cfg["n_heads"] else convertToGroupedQuery(model, cfg, numKvHeads).eval()
+            groupedCfg = {**cfg, "n_kv_heads": numKvHeads}
+            with torch.no_grad():
+                logProbs = F.log_softmax(groupedModel(prompt[:1, :128]), dim=-1)
+            klDivergence = (referenceLogProbs.exp() * (referenceLogProbs - logProbs)).sum(dim=-1).mean().item()
+
+            # Decode speed only: time of the first token (prefill) is subtracted
+            stepTimes = []
+            for maxNewTokens in [1, numNewTokens + 1]:
+                startTime = time.time()
+                generate(groupedModel, prompt, maxNewTokens, cfg["context_length"], temperature=0.0, useCache=True)
+                stepTimes.append(time.time() - startTime)
+            tokensPerSec = batchSize * numNewTokens / (stepTimes[1] - stepTimes[0])
+            print(f"{modelName} n_kv_heads={numKvHeads:>2}: KV cache (batch {batchSize}, 1024 tokens) "
+                  f"{kvCacheMegabytes(groupedCfg, batchSize, cfg['context_length']):.0f} MB, "
+                  f"{tokensPerSec:.2f} tokens/sec, KL to MHA after mean-pooling {klDivergence:.2e}")
+            del groupedModel
+        del model
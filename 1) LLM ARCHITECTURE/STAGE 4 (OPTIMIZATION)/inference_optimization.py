@@ -0,0 +1,119 @@
+import copy
+import time
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from gpt_model import LayerNorm, GPTModel, modelConfigs, generate
+
+
+'Fused Layer Normalization'
+class FusedLayerNorm(nn.Module):
+    # Same scale/shift parameters and eps as gpt_model.LayerNorm, but one F.layer_norm kernel
+    # instead of separate mean/var/sqrt/div ops (state_dict keys are unchanged)
+    def __init__(self, layerNorm):
+        super().__init__()
+        self.eps = layerNorm.eps
+        self.scale = layerNorm.scale
+        self.shift = layerNorm.shift
+
+    def forward(self, x):
+        return F.layer_norm(x, self.scale.shape, self.scale, self.shift, self.eps)
+
+
+def fuseQkv(attention):
+    # W_query/W_key/W_value → one W_qkv (rows stacked like GPT-2's c_attn), the forward then takes the SDPA path
+    if attention.fused_qkv:
+        return
+    linears = [attention.W_query, attention.W_key, attention.W_value]
+    hasBias = attention.W_query.bias is not None
+    weight = attention.W_query.weight
+    W_qkv = nn.Linear(weight.shape[1], sum(linear.out_features for linear in linears), bias=hasBias,
+                      device=weight.device, dtype=weight.dtype)
+    with torch.no_grad():
+        W_qkv.weight.copy_(torch.cat([linear.weight for linear in linears]))
+        if hasBias:
+            W_qkv.bias.copy_(torch.cat([linear.bias for linear in linears]))
+
+    attention.W_qkv = W_qkv
+    del attention.W_query, attention.W_key, attention.W_value, attention.mask
+    attention.fused_qkv = True
+
+
+def optimizeForInference(model, dtype=None, compile=True):
+    """
+    Turns an (educational) GPTModel into an inference build, in place:
+    LayerNorm → FusedLayerNorm, unfused Q/K/V → W_qkv + SDPA (FeedForward already uses the one-kernel nn.GELU),
+    gradients off, forward under torch.inference_mode, optional dtype cast (torch.bfloat16 on CPU)
+    and torch.compile of the cache-free parts of every block (norms and feed forward).
+    Parameters are reused, so loadWeights/state_dict checkpoints still apply before the call.
+    """
+    # S1) Fused equivalents with the same parameters
+    model.eval().requires_grad_(False)
+    for parent in list(model.modules()):
+        for name, child in parent.named_children():
+            if isinstance(child, LayerNorm):
+                setattr(parent, name, FusedLayerNorm(child))
+    for block in model.trf_blocks:
+        fuseQkv(block.attention)
+
+    # S2) Lower precision (the KV cache follows the weights' dtype)
+    if dtype is not None:
+        model.to(dtype)
+
+    # S3) Compile the stateless modules: attention keeps eager Python for its cache pointers,
+    # compiling it would recompile for every new cache length
+    if compile:
+        for block in model.trf_blocks:
+            block.normalization1 = torch.compile(block.normalization1, dynamic=True)
+            block.normalization2 = torch.compile(block.normalization2, dynamic=True)
+            block.feedforwardNN = torch.compile(block.feedforwardNN, dynamic=True)
+        model.finalNormalization = torch.compile(model.finalNormalization, dynamic=True)
+
+    # S4) Inference mode: no autograd bookkeeping at all (stronger than no_grad)
+    model.forward = torch.inference_mode()(model.forward)
+    return model
+
+
+def decodeTokensPerSec(model, prompt, numNewTokens, contextSize):
+    # Decode speed only: time of the first token (prefill) is subtracted
+    stepTimes = []
+    for maxNewTokens in [1, numNewTokens + 1]:
+        startTime = time.time()
+        tokenIds = generate(model, prompt, maxNewTokens, contextSize, temperature=0.0, useCache=True)
+        stepTimes.append(time.time() - startTime)
+    return numNewTokens / (stepTimes[1] - stepTimes[0]), tokenIds
+
+
+if __name__ == "__main__":
+    # Parity with the educational modules and decode / prefill speed of each inference build
+    BASE_CONFIG = {"vocab_size": 50257, "context_length": 1024, "drop_rate": 0.0, "qkv_bias": True}
+    cfg = {**BASE_CONFIG, **modelConfigs["gpt2-small (124M)"]}
+    promptLen, numNewTokens = 64, 32
+
+    torch.manual_seed(123)
+    model = GPTModel(cfg).eval()
+    prompt = torch.randint(0, cfg["vocab_size"], (1, promptLen))
+    longPrompt = torch.randint(0, cfg["vocab_size"], (4, 512))
+    with torch.no_grad():
+        referenceLogits = model(prompt)
+
+    builds = {"educational": None, "fused": {"compile": False}, "fused + compile": {"compile": True},
+              "fused + compile + bf16": {"compile": True, "dtype": torch.bfloat16}}
+    for buildName, options in builds.items():
+        optimized = model if options is None else optimizeForInference(copy.deepcopy(model), **options)
+        decodeTokensPerSec(optimized, prompt, 2, cfg["context_length"])  # Warmup (compilation)
+        tokensPerSec, tokenIds = decodeTokensPerSec(optimized, prompt, numNewTokens, cfg["context_length"])
+        with torch.no_grad():
+            maxDiff = (optimized(prompt).float() - referenceLogits).abs().max().item()
+            optimized(longPrompt)
+            startTime = time.time()
+            optimized(longPrompt)
+            prefillMs = (time.time() - startTime) * 1000
+        if options is None:
+            referenceIds = tokenIds
+        agreement = (tokenIds[0, promptLen:] == referenceIds[0, promptLen:]).float().mean().item()
+        print(f"{buildName:>22}: {tokensPerSec:.2f} tokens/sec, prefill 4x512 {prefillMs:.0f} ms, "
+              f"max logit diff {maxDiff:.2e}, greedy tokens matching {agreement:.0%}")
+        if options is not None:
+            del optimized
@@ -0,0 +1,71 @@
+import json
+import os
+import torch
+from torch.utils.data import Dataset
+
+
+def formatInput(entry):
+    instructionText = (
+        f"Below is an instruction that describes a task. "
+        f"Write a response that appropriately completes the request.\n\n"
+        f"\n\n### Instruction: \n{entry['instruction']}"
+    )
+    inputText = f"\n\n### Input: \n{entry['input']}" if entry["input"] else ""
+
+    return instructionText + inputText
+
+
+class InstructionDataset(Dataset):
+    def __init__(self, data, tokenizer):
+        self.data = data
+
+        self.encodedTexts = []
+        for entry in data:
+            intructionAndInput = formatInput(entry)
+            responseText = f"\n\n### Response:\n{entry['output']}"
+            fullText = intructionAndInput + responseText
+            self.encodedTexts.append(tokenizer.encode(fullText))
+
+    def __getitem__(self, index):
+        return self.encodedTexts[index]
+
+    def __len__(self):
+        return len(self.data)
+
+
+def finalCollate(batch, padTokenId=50256, ignore_index=-100, allowed_max_length=None, device="cpu"):
+    maxLenInBatch = max(len(item) + 1 for item in batch)
+    inputList, targetList = [], []
+    for item in batch:
+        newItem = item.copy()
+        newItem += [padTokenId]
+        padded = newItem + [padTokenId] * (maxLenInBatch - len(newItem))
+
+        inputs = torch.tensor(padded[:-1])
+        targets = torch.tensor(padded[1:])
+
+        mask = targets == padTokenId  # Mask all 50256 tokens
+        indices = torch.nonzero(mask).squeeze()
+        if indices.numel() > 1:
+            targets[indices[1:]] = ignore_index  # Keep first paded token and replace all other
+
+        if allowed_max_length is not None:
+            inputs = inputs[:allowed_max_length]
+            targets = targets[:allowed_max_length]
+
+        inputList.append(inputs)
+        targetList.append(targets)
+
+    inputsTensor = torch.stack(inputList).to(device)
+    targetsTensor = torch.stack(targetList).to(device)
+    return inputsTensor, targetsTensor
+
+
+def loadInstructionData(trainRatio=0.85, testRatio=0.10):
+    # datatset.json of STAGE 3 INSTRUCTION FINETUNING, same 85/10/5 split as the notebook
+    filePath = os.path.join(os.path.dirname(__file__), "..", "STAGE 3 (FINETUNING)", "INSTRUCTION FINETUNING", "datatset.json")
+    with open(filePath, "r", encoding="utf-8") as file:
+        data = json.load(file)
+    trainPortion = int(len(data) * trainRatio)
+    testPortion = int(len(data) * testRatio)
+    return data[:trainPortion], data[trainPortion + testPortion:], data[trainPortion:trainPortion + testPortion]
@@ -0,0 +1,282 @@
+import base64
+import hashlib
+import http.server
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+GPT2_BASE_URL = "https://openaipublic.blob.core.windows.net/gpt-2/models"
+GPT2_FILES = ["checkpoint", "encoder.json", "hparams.json", "model.ckpt.data-00000-of-00001",
+              "model.ckpt.index", "model.ckpt.meta", "vocab.bpe"]
+BUFFER_SIZE = 1024 * 1024  # 1 MB reads and writes (download_file used 1 KB blocks)
+
+
+def fileSha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(BUFFER_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fileMd5(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(BUFFER_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def loadManifest(path):
+    # {fileName: {"size": bytes, "sha256": hex digest}}
+    with open(path) as file:
+        return json.load(file)
+
+
+def writeManifest(directory, fileNames, path):
+    # Records size + sha256 of already verified files, to pin later downloads to exactly these bytes
+    manifest = {name: {"size": os.path.getsize(os.path.join(directory, name)),
+                       "sha256": fileSha256(os.path.join(directory, name))} for name in fileNames}
+    with open(path, "w") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def remoteInfo(session, url):
+    # HEAD only: size, whether byte ranges are served, and the MD5 the server reports (Azure blobs send Content-MD5)
+    response = session.head(url, allow_redirects=True, timeout=30)
+    response.raise_for_status()
+    md5 = response.headers.get("Content-MD5")
+    return {"size": int(response.headers.get("Content-Length", -1)),
+            "ranges": response.headers.get("Accept-Ranges") == "bytes",
+            "md5": base64.b64decode(md5).hex() if md5 else None}
+
+
+def verifyFile(path, expected, info):
+    # Manifest entry first, the server's size/MD5 otherwise. Returns an error message, or None if the file is good
+    size = os.path.getsize(path)
+    expectedSize = expected["size"] if expected else info["size"]
+    if expectedSize >= 0 and size != expectedSize:
+        return f"size {size} != expected {expectedSize}"
+    if expected and fileSha256(path) != expected["sha256"]:
+        return "sha256 does not match the manifest"
+    if not expected and info["md5"] and fileMd5(path) != info["md5"]:
+        return "md5 does not match Content-MD5"
+    return None
+
+
+def downloadFile(session, url, destination, expected=None):
+    """
+    Downloads url to destination through destination + ".part", which is renamed only after the size and
+    checksum match, so destination is either complete or absent. A .part left by an interrupted run is
+    resumed with a Range request; it is deleted only when it is too large or its checksum is wrong.
+    Returns the number of bytes transferred.
+    """
+    info = remoteInfo(session, url)
+    if os.path.exists(destination) and verifyFile(destination, expected, info) is None:
+        return 0
+
+    partPath = destination + ".part"
+    startByte = os.path.getsize(partPath) if os.path.exists(partPath) else 0
+    if not info["ranges"] or info["size"] < 0 or startByte > info["size"]:
+        startByte = 0  # No Range header is sent, the whole file is written from the start
+    headers = {"Range": f"bytes={startByte}-"} if 0 < startByte < info["size"] else {}
+
+    transferred = 0
+    if startByte != info["size"] or not os.path.exists(partPath):
+        with session.get(url, headers=headers, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            if headers and response.status_code != 206:
+                startByte = 0  # Range ignored, the whole file is coming
+            with open(partPath, "ab" if startByte else "wb", buffering=BUFFER_SIZE) as file:
+                for chunk in response.iter_content(BUFFER_SIZE):
+                    file.write(chunk)
+                    transferred += len(chunk)
+
+    expectedSize = expected["size"] if expected else info["size"]
+    if os.path.getsize(partPath) < expectedSize:
+        # Transfer ended early without an error (dropped connection): the .part is kept and resumed next run
+        raise ValueError(f"{url}: incomplete, {os.path.getsize(partPath)} of {expectedSize} bytes")
+    error = verifyFile(partPath, expected, info)
+    if error is not None:
+        os.remove(partPath)  # Too large or a wrong checksum: resuming would only produce another corrupt file
+        raise ValueError(f"{url}: {error}")
+    os.replace(partPath, destination)
+    return transferred
+
+
+def downloadFiles(baseUrl, fileNames, directory, manifest=None, maxWorkers=8):
+    """
+    Downloads baseUrl/<name> → directory/<name> for every name, maxWorkers at a time (one HTTP session per
+    thread, TLS verified). Every file is attempted; if any failed, raises after the others have finished.
+    Returns {name: bytes transferred}.
+    """
+    os.makedirs(directory, exist_ok=True)
+    local = threading.local()
+
+    def fetch(name):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return downloadFile(local.session, f"{baseUrl}/{name}", os.path.join(directory, name),
+                            (manifest or {}).get(name))
+
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        futures = {name: executor.submit(fetch, name) for name in fileNames}
+    errors = {name: future.exception() for name, future in futures.items() if future.exception() is not None}
+    if errors:
+        raise RuntimeError("Download failed: " + "; ".join(f"{name}: {error}" for name, error in errors.items()))
+    return {name: future.result() for name, future in futures.items()}
+
+
+def downloadGpt2(modelSize, modelsDir, manifestPath=None, maxWorkers=8):
+    # Same files and layout as download_and_load_gpt2, returns the model directory
+    allowedSizes = ("124M", "355M", "774M", "1558M")
+    if modelSize not in allowedSizes:
+        raise ValueError(f"Model size not in {allowedSizes}")
+    modelDir = os.path.join(modelsDir, modelSize)
+    manifest = loadManifest(manifestPath) if manifestPath else None
+    downloadFiles(f"{GPT2_BASE_URL}/{modelSize}", GPT2_FILES, modelDir, manifest, maxWorkers)
+    return modelDir
+
+
+'Local HTTP Stand-In Server'
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serves a directory like blob storage does: HEAD with Content-Length / Accept-Ranges / Content-MD5,
+    and GET with "Range: bytes=start-". failAfter[name] = n cuts that file's next response after n bytes.
+    maxActive is the largest number of GET responses sent at the same time.
+    """
+    failAfter = {}
+    bytesServed = 0
+    active, maxActive = 0, 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def sendHead(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None, 0, 0
+        size = os.path.getsize(path)
+        start = 0
+        rangeHeader = self.headers.get("Range")
+        if rangeHeader and rangeHeader.startswith("bytes="):
+            start = int(rangeHeader[len("bytes="):].split("-")[0])
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(size - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-MD5", base64.b64encode(bytes.fromhex(fileMd5(path))).decode())
+        self.end_headers()
+        return path, start, size
+
+    def do_HEAD(self):
+        self.sendHead()
+
+    def do_GET(self):
+        with self.lock:
+            RangeRequestHandler.active += 1
+            RangeRequestHandler.maxActive = max(RangeRequestHandler.maxActive, RangeRequestHandler.active)
+        try:
+            self.sendFile()
+        finally:
+            with self.lock:
+                RangeRequestHandler.active -= 1
+
+    def sendFile(self):
+        path, start, size = self.sendHead()
+        if path is None:
+            return
+        limit = self.failAfter.pop(os.path.basename(path), size - start)
+        with open(path, "rb") as file:
+            file.seek(start)
+            remaining = limit
+            while remaining > 0:
+                chunk = file.read(min(BUFFER_SIZE, remaining))
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+        with self.lock:
+            RangeRequestHandler.bytesServed += limit
+        if limit < size - start:
+            self.close_connection = True  # Connection drops mid-transfer
+
+
+def startStandInServer(directory, handlerClass=RangeRequestHandler):
+    handler = lambda *args, **kwargs: handlerClass(*args, directory=directory, **kwargs)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    # Checks + timing against a local stand-in for the blob storage, serving files of the 124M sizes
+    fileSizes = {"checkpoint": 77, "encoder.json": 1042301, "hparams.json": 90, "model.ckpt.data-00000-of-00001": 497759232,
+                 "model.ckpt.index": 5215, "model.ckpt.meta": 471155, "vocab.bpe": 456318}
+    serverDir, clientDir = tempfile.mkdtemp(), tempfile.mkdtemp()
+    for name, size in fileSizes.items():
+        with open(os.path.join(serverDir, name), "wb") as file:
+            file.write(os.urandom(size))
+    server, baseUrl = startStandInServer(serverDir)
+    manifestPath = os.path.join(serverDir, "manifest.json")
+    manifest = writeManifest(serverDir, GPT2_FILES, manifestPath)
+
+    def served():
+        served, RangeRequestHandler.bytesServed = RangeRequestHandler.bytesServed, 0
+        return served
+
+    def allMatch(directory):
+        return all(fileSha256(os.path.join(directory, name)) == manifest[name]["sha256"] for name in GPT2_FILES)
+
+    # 1) Old sequential download_file (1 KB blocks) vs concurrent 1 MB buffered downloads
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "STAGE 2", "MODEL WEIGHTS"))
+    try:
+        from gpt_download3 import download_file
+        oldDir = tempfile.mkdtemp()
+        startTime = time.time()
+        for name in GPT2_FILES:
+            download_file(f"{baseUrl}/{name}", os.path.join(oldDir, name))
+        print(f"download_file (sequential, 1 KB blocks): {time.time() - startTime:.2f} s")
+        served()
+    except ImportError as error:
+        print(f"download_file skipped ({error})")
+
+    startTime = time.time()
+    downloadFiles(baseUrl, GPT2_FILES, clientDir, manifest)
+    print(f"downloadFiles (parallel, 1 MB buffers): {time.time() - startTime:.2f} s, all checksums match: {allMatch(clientDir)}")
+    served()
+
+    # 2) Re-run: only HEAD requests, nothing transferred
+    transferred = downloadFiles(baseUrl, GPT2_FILES, clientDir, manifest)
+    print(f"Re-run transferred {sum(transferred.values())} bytes, server sent {served()} bytes")
+
+    # 3) Connection drops halfway: no file under the real name, the rerun fetches only the missing half
+    dataName = "model.ckpt.data-00000-of-00001"
+    os.remove(os.path.join(clientDir, dataName))
+    RangeRequestHandler.failAfter[dataName] = fileSizes[dataName] // 2
+    try:
+        downloadFiles(baseUrl, GPT2_FILES, clientDir, manifest)
+    except RuntimeError as error:
+        print(f"Interrupted: {error.__class__.__name__}, final file present: {os.path.exists(os.path.join(clientDir, dataName))}, "
+              f".part has {os.path.getsize(os.path.join(clientDir, dataName + '.part'))} bytes")
+    served()
+    downloadFiles(baseUrl, GPT2_FILES, clientDir, manifest)
+    print(f"Resumed: server sent {served()} of {fileSizes[dataName]} bytes, all checksums match: {allMatch(clientDir)}")
+
+    # 4) Wrong manifest: the download is rejected and nothing is left behind
+    badManifest = {**manifest, "hparams.json": {**manifest["hparams.json"], "sha256": "0" * 64}}
+    os.remove(os.path.join(clientDir, "hparams.json"))
+    try:
+        downloadFiles(baseUrl, GPT2_FILES, clientDir, badManifest)
+    except RuntimeError as error:
+        print(f"Bad checksum rejected: {error}, files left: "
+              f"{[name for name in os.listdir(clientDir) if name.startswith('hparams.json')]}")
+    server.shutdown()
@@ -0,0 +1,294 @@
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+import numpy as np
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def documentUnits(path, textKey="text"):
+    # Deduplication units of a file, streamed: a .jsonl line ({textKey: ...}, e.g. the {"text": chunk} records built from
+    # ChunkDataset in Instructional_Finetuning1), or a paragraph of a .txt file (split on blank lines like ChunkDataset)
+    with open(path, "r", encoding="utf-8") as file:
+        if path.endswith(".jsonl"):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)[textKey]
+            return
+        for paragraph in re.split(r"\n\s*\n", file.read()):
+            if paragraph.strip():
+                yield paragraph
+
+
+def shingleHashes(text, shingleSize=5):
+    # 32-bit hashes of the word shingleSize-grams (lowercased, punctuation dropped), combined in NumPy from per-word crc32s
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return np.zeros(0, dtype=np.uint64)
+    wordHashes = np.array([zlib.crc32(word.encode()) for word in words], dtype=np.uint64)
+    if len(wordHashes) < shingleSize:
+        shingleSize = len(wordHashes)  # Short text: one shingle with all its words
+    hashes = np.zeros(len(wordHashes) - shingleSize + 1, dtype=np.uint64)
+    for offset in range(shingleSize):
+        hashes = hashes * np.uint64(1000003) + wordHashes[offset:offset + len(hashes)]  # Wraps mod 2**64
+    return np.unique(hashes & np.uint64(MAX_HASH))
+
+
+def permutations(numPerm, seed=1):
+    # (a, b) of the numPerm hash functions (a * x + b) mod MERSENNE_PRIME, shared by every worker
+    generator = np.random.RandomState(seed)
+    return (generator.randint(1, MAX_HASH, numPerm, dtype=np.uint64),
+            generator.randint(0, MAX_HASH, numPerm, dtype=np.uint64))
+
+
+def minhashSignature(hashes, a, b):
+    # numPerm uint32 minima; a, x < 2**32, so a * x + b stays below 2**64
+    if len(hashes) == 0:
+        return np.full(len(a), MAX_HASH, dtype=np.uint32)
+    values = (a[:, None] * hashes[None, :] + b[:, None]) % np.uint64(MERSENNE_PRIME)
+    return (values & np.uint64(MAX_HASH)).min(axis=1).astype(np.uint32)
+
+
+def bandHashes(signature, bands):
+    # One key per band of rows = numPerm / bands signature values, two units are candidates if a whole band is equal
+    # (32-bit keys collide by chance too, every candidate is checked against the full signature)
+    rows = len(signature) // bands
+    return np.array([zlib.crc32(signature[i * rows:(i + 1) * rows].tobytes()) for i in range(bands)], dtype=np.uint32)
+
+
+def signFile(task):
+    # Pool worker: MinHash signatures + LSH band keys of every unit of one file
+    path, textKey, numPerm, bands, shingleSize = task
+    a, b = permutations(numPerm)
+    signatures, keys, sizes = [], [], []
+    for text in documentUnits(path, textKey):
+        signature = minhashSignature(shingleHashes(text, shingleSize), a, b)
+        signatures.append(signature)
+        keys.append(bandHashes(signature, bands))
+        sizes.append(len(text.encode("utf-8")))
+    return (np.array(signatures, dtype=np.uint32).reshape(-1, numPerm), np.array(keys, dtype=np.uint32).reshape(-1, bands),
+            np.array(sizes, dtype=np.int64))
+
+
+def findRoot(parent, idx):
+    while parent[idx] != idx:
+        parent[idx] = parent[parent[idx]]  # Path halving
+        idx = parent[idx]
+    return idx
+
+
+def joinBucket(parent, signatures, bucket, threshold):
+    # Units of one LSH bucket (in unit order) → union-find joins. The earliest unit no representative is close to
+    # becomes the next representative and is compared with every unit of the bucket at once, until every unit is
+    # close to one. Two units close to each other but not to the bucket's first unit still end up together, and
+    # a unit close to two representatives merges their clusters. Returns the number of compared pairs
+    bucketSignatures = np.asarray(signatures[bucket])
+    covered = np.zeros(len(bucket), dtype=bool)
+    numPairs = 0
+    while not covered.all():
+        representative = np.argmin(covered)  # First uncovered unit
+        close = (bucketSignatures == bucketSignatures[representative]).mean(axis=1) >= threshold
+        close[representative] = False
+        numPairs += len(bucket) - 1
+        covered[representative] = True
+        covered |= close
+        for member in bucket[close]:
+            rootRepresentative, rootMember = findRoot(parent, bucket[representative]), findRoot(parent, member)
+            if rootRepresentative != rootMember:
+                parent[max(rootRepresentative, rootMember)] = min(rootRepresentative, rootMember)  # Root = earliest unit
+    return numPairs
+
+
+def deduplicateCorpus(inputDir, outputDir, numWorkers=None, numPerm=128, bands=16, threshold=0.8, shingleSize=5,
+                      textKey="text", workDir=None):
+    """
+    Writes inputDir's .txt / .jsonl files to outputDir without near-duplicate units (estimated Jaccard >= threshold
+    of the word shingles); the first unit of every duplicate cluster is kept. Signatures and band keys go to
+    np.memmap files in workDir and the buckets are built one band at a time, so RAM does not grow with the corpus
+    beyond one int64 parent per unit. Returns the statistics also saved as outputDir/dedup_stats.json.
+    """
+    paths = sorted(os.path.relpath(os.path.join(root, name), inputDir) for root, _, names in os.walk(inputDir)
+                   for name in names if name.endswith((".txt", ".jsonl")))
+    ownWorkDir = workDir is None
+    workDir = workDir or tempfile.mkdtemp()
+    os.makedirs(workDir, exist_ok=True)
+    startTime = time.time()
+
+    # S1) MinHash + band keys, one pool task per file, appended to flat files in file order
+    fileUnits, sizes = [], []
+    with open(os.path.join(workDir, "signatures.bin"), "wb") as signatureFile, open(os.path.join(workDir, "keys.bin"), "wb") as keyFile:
+        with multiprocessing.Pool(numWorkers) as pool:
+            tasks = ((os.path.join(inputDir, path), textKey, numPerm, bands, shingleSize) for path in paths)
+            for signatures, keys, unitSizes in pool.imap(signFile, tasks):
+                signatures.tofile(signatureFile)
+                keys.tofile(keyFile)
+                fileUnits.append(len(unitSizes))
+                sizes.append(unitSizes)
+    numUnits, sizes = sum(fileUnits), np.concatenate(sizes) if sizes else np.zeros(0, dtype=np.int64)
+    signTime = time.time() - startTime
+    if numUnits == 0:
+        signatures = keys = np.zeros((0, 0))
+    else:
+        signatures = np.memmap(os.path.join(workDir, "signatures.bin"), dtype=np.uint32, mode="r", shape=(numUnits, numPerm))
+        keys = np.memmap(os.path.join(workDir, "keys.bin"), dtype=np.uint32, mode="r", shape=(numUnits, bands))
+
+    # S2) LSH: per band, sort the keys, units with an equal key are candidates. A candidate joins a cluster of its
+    # bucket if its signature agrees with the cluster's representative on >= threshold of the permutations
+    startTime = time.time()
+    parent = np.arange(numUnits, dtype=np.int64)
+    candidatePairs = 0
+    for band in range(bands if numUnits else 0):
+        column = np.array(keys[:, band])
+        order = np.argsort(column, kind="stable")
+        sortedKeys = column[order]
+        bucketStarts = np.flatnonzero(np.r_[True, sortedKeys[1:] != sortedKeys[:-1]])
+        bucketSizes = np.diff(np.r_[bucketStarts, len(order)])
+        for start, size in zip(bucketStarts[bucketSizes > 1], bucketSizes[bucketSizes > 1]):
+            candidatePairs += joinBucket(parent, signatures, order[start:start + size], threshold)
+    roots = parent
+    while not np.array_equal(roots[roots], roots):  # Pointer jumping, vectorized
+        roots = roots[roots]
+    keep = roots == np.arange(numUnits)
+    lshTime = time.time() - startTime
+
+    # S3) Second pass over the files, only kept units are written
+    startTime = time.time()
+    unitIdx = 0
+    for path, numFileUnits in zip(paths, fileUnits):
+        os.makedirs(os.path.dirname(os.path.join(outputDir, path)), exist_ok=True)
+        if path.endswith(".jsonl"):  # Kept records are copied unchanged, other fields included
+            with open(os.path.join(inputDir, path), "r", encoding="utf-8") as file:
+                keptUnits = [line for line in file if line.strip()]
+        else:
+            keptUnits = [paragraph + "\n\n" for paragraph in documentUnits(os.path.join(inputDir, path), textKey)]
+        with open(os.path.join(outputDir, path), "w", encoding="utf-8") as file:
+            file.writelines(unit for offset, unit in enumerate(keptUnits) if keep[unitIdx + offset])
+        unitIdx += numFileUnits
+    writeTime = time.time() - startTime
+
+    del signatures, keys
+    if ownWorkDir:
+        shutil.rmtree(workDir)
+
+    clusterSizes = np.bincount(roots, minlength=numUnits)  # Units per cluster, indexed by the kept (root) unit
+    duplicateSizes = clusterSizes[keep & (clusterSizes > 1)]
+    stats = {"units": int(numUnits), "kept_units": int(keep.sum()), "removed_units": int(numUnits - keep.sum()),
+             "removed_bytes": int(sizes[~keep].sum()), "total_bytes": int(sizes.sum()),
+             "duplicate_clusters": len(duplicateSizes), "candidate_pairs": int(candidatePairs),
+             "cluster_size_histogram": {int(size): int(count) for size, count in zip(*np.unique(duplicateSizes, return_counts=True))},
+             "largest_clusters": [{"unit": int(idx), "size": int(clusterSizes[idx])} for idx in np.argsort(-clusterSizes, kind="stable")[:5]
+                                  if clusterSizes[idx] > 1],
+             "sign_seconds": signTime, "lsh_seconds": lshTime, "write_seconds": writeTime}
+    with open(os.path.join(outputDir, "dedup_stats.json"), "w") as file:
+        json.dump(stats, file, indent=2)
+    return stats
+
+
+def anonMegabytes():
+    # Private memory only: the memory-mapped signature / key files are page cache, which the OS can evict
+    with open("/proc/self/status") as status:
+        return next(int(line.split()[1]) for line in status if line.startswith("RssAnon")) / 1024
+
+
+def scalingWorker(numFiles, unitsPerFile, queue):
+    # Fresh process: time and peak private memory of one deduplicateCorpus run over numFiles x unitsPerFile units
+    inputDir, outputDir = tempfile.mkdtemp(), tempfile.mkdtemp()
+    writeBenchmarkCorpus(inputDir, numFiles, unitsPerFile)
+    baseline, peak, done = anonMegabytes(), [0.0], threading.Event()
+
+    def sample():
+        while not done.wait(0.01):
+            peak[0] = max(peak[0], anonMegabytes())
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    startTime = time.time()
+    stats = deduplicateCorpus(inputDir, outputDir)
+    elapsed = time.time() - startTime
+    done.set()
+    sampler.join()
+    queue.put((stats, elapsed, peak[0] - baseline))
+    shutil.rmtree(inputDir)
+    shutil.rmtree(outputDir)
+
+
+def writeBenchmarkCorpus(directory, numFiles, unitsPerFile, seed=123):
+    # Scraped-page stand-in: every .jsonl file mixes unique paragraphs (random word sequences) with boilerplate
+    # copied from 20 templates, each copy with a page number and sometimes one changed word. Returns the template of
+    # every unit (-1 = unique), the ground truth for the benchmark
+    generator = np.random.RandomState(seed)
+    # 5,000 pseudo-words with Zipf-like frequencies (repeats in the list), fixed by the seed
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    words = ["".join(generator.choice(letters, generator.randint(2, 10))) for _ in range(5000)]
+    vocabulary = [word for rank, word in enumerate(words) for _ in range(max(1, 200 // (rank + 1)))]
+    templates = [" ".join(generator.choice(vocabulary, 40)) for _ in range(20)]
+    labels = []
+    for fileIdx in range(numFiles):
+        with open(os.path.join(directory, f"shard-{fileIdx:04d}.jsonl"), "w", encoding="utf-8") as file:
+            for unit in range(unitsPerFile):
+                if generator.rand() < 0.3:
+                    template = generator.randint(len(templates))
+                    words = templates[template].split()
+                    if generator.rand() < 0.5:
+                        words[generator.randint(len(words))] = "changed"
+                    text = " ".join(words) + f" page {fileIdx * unitsPerFile + unit}"
+                else:
+                    template, text = -1, " ".join(generator.choice(vocabulary, generator.randint(20, 80)))
+                labels.append(template)
+                file.write(json.dumps({"text": text}) + "\n")
+    return labels
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove near-duplicate documents / paragraphs (MinHash + LSH) from a corpus")
+    parser.add_argument("input_dir", nargs="?")
+    parser.add_argument("output_dir", nargs="?")
+    parser.add_argument("--workers", type=int, default=None, help="signing processes (default: all cores)")
+    parser.add_argument("--threshold", type=float, default=0.8, help="estimated Jaccard similarity counted as duplicate")
+    parser.add_argument("--num_perm", type=int, default=128)
+    parser.add_argument("--bands", type=int, default=16)
+    parser.add_argument("--text_key", default="text", help="field holding the text in .jsonl lines")
+    parser.add_argument("--benchmark", action="store_true", help="accuracy vs exact Jaccard + memory/time scaling")
+    args = parser.parse_args()
+
+    if not args.benchmark:
+        stats = deduplicateCorpus(args.input_dir, args.output_dir, args.workers, args.num_perm, args.bands, args.threshold,
+                                  textKey=args.text_key)
+        print(json.dumps(stats, indent=2))
+    else:
+        # Accuracy: removed units vs exact Jaccard over all pairs (a unit is a true duplicate if an earlier one is >= 0.8)
+        inputDir, outputDir = tempfile.mkdtemp(), tempfile.mkdtemp()
+        labels = writeBenchmarkCorpus(inputDir, 4, 500)
+        texts = [text for name in sorted(os.listdir(inputDir)) for text in documentUnits(os.path.join(inputDir, name))]
+        shingles = [set(shingleHashes(text).tolist()) for text in texts]
+        truth = np.array([any(len(shingles[i] & shingles[j]) / len(shingles[i] | shingles[j]) >= 0.8 for j in range(i))
+                          for i in range(len(texts))])
+        stats = deduplicateCorpus(inputDir, outputDir)
+        keptTexts = {text for name in sorted(os.listdir(outputDir)) if name.endswith(".jsonl")
+                     for text in documentUnits(os.path.join(outputDir, name))}
+        removed = np.array([text not in keptTexts for text in texts])
+        print(f"{stats['units']} units, {stats['removed_units']} removed ({stats['removed_bytes'] / stats['total_bytes']:.0%} of the bytes), "
+              f"{stats['duplicate_clusters']} clusters (20 boilerplate templates), {stats['candidate_pairs']} candidate pairs")
+        print(f"vs exact Jaccard >= 0.8: {truth.sum()} true duplicates, precision {(removed & truth).sum() / max(1, removed.sum()):.3f}, "
+              f"recall {(removed & truth).sum() / max(1, truth.sum()):.3f}")
+        print(f"Cluster sizes (size: count): {stats['cluster_size_histogram']}")
+
+        # Scaling: time and peak private memory (above the imports) per corpus size, each in a fresh process
+        context = multiprocessing.get_context("spawn")
+        queue = context.Queue()
+        for numFiles in [10, 100, 400]:
+            process = context.Process(target=scalingWorker, args=(numFiles, 1000, queue))
+            process.start()
+            stats, elapsed, memory = queue.get()
+            process.join()
+            print(f"{stats['units']} units: {stats['units'] / elapsed:,.0f} units/sec (sign {stats['sign_seconds']:.1f} s, "
+                  f"LSH {stats['lsh_seconds']:.1f} s, write {stats['write_seconds']:.1f} s), peak private memory +{memory:.0f} MB, "
+                  f"{stats['removed_units']} removed")
@@ -0,0 +1,268 @@
+import os
+import queue as queueModule
+import tempfile
+import time
+import torch
+import torch.multiprocessing as mp
+import torch.nn as nn
+
+from gpt_model import GPTModel, LayerNorm, TransformerBlock, modelConfigs, loadWeights, generate, nextTokenProbs
+
+POLL_SECONDS = 1.0  # How often PipelineGPT checks that its stage processes are still alive while it waits
+
+
+def partitionLayers(numLayers, numStages):
+    # Contiguous, as equal as possible ranges of TransformerBlocks: [(start, end), ...]
+    bounds = [round(stage * numLayers / numStages) for stage in range(numStages + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def peakRssMegabytes():
+    # VmHWM (Linux) starts fresh in every exec'd process, unlike ru_maxrss which spawned children inherit
+    with open("/proc/self/status") as status:
+        return next(int(line.split()[1]) for line in status if line.startswith("VmHWM")) / 1024
+
+
+def saveCheckpoint(model, path):
+    # Parameters only (the causal masks are rebuilt by every stage), readable with torch.load(mmap=True)
+    torch.save({name: tensor for name, tensor in model.state_dict().items() if not name.endswith(".mask")}, path)
+
+
+def paramsToCheckpoint(params, cfg, path):
+    # GPT-2 params from download_and_load_gpt2 → checkpoint, without ever allocating a randomly initialised model
+    with torch.device("meta"):
+        model = GPTModel(cfg)
+    loadWeights(model, params)
+    saveCheckpoint(model, path)
+
+
+'Pipeline Stage'
+class PipelineStage(nn.Module):
+    """
+    A contiguous range of TransformerBlocks of GPTModel, plus the embeddings on the first stage and the final
+    LayerNorm + out_head on the last one. Parameter names match GPTModel's state_dict, so a stage loads its
+    slice of a full checkpoint directly.
+    """
+    def __init__(self, cfg, start, end, isFirst, isLast):
+        super().__init__()
+        self.isFirst, self.isLast = isFirst, isLast
+        if isFirst:
+            self.tokenEmbeddings = nn.Embedding(cfg["vocab_size"], cfg["emb_dim"])
+            self.positionalEmbeddings = nn.Embedding(cfg["context_length"], cfg["emb_dim"])
+            self.dropuoutEmbeddings = nn.Dropout(cfg["drop_rate"])
+        self.trf_blocks = nn.ModuleDict({str(i): TransformerBlock(cfg) for i in range(start, end)})
+        if isLast:
+            self.finalNormalization = LayerNorm(cfg["emb_dim"])
+            self.out_head = nn.Linear(cfg["emb_dim"], cfg["vocab_size"], bias=False)
+        self.caches = {}  # microbatchId -> (position, [(cacheK, cacheV, cachePositions, ptrCurrentPos) per block])
+
+    def loadCheckpoint(self, path):
+        # mmap: only the tensors of this stage are ever read from disk into memory
+        stateDict = torch.load(path, mmap=True, map_location="cpu")
+        ownNames = set(self.state_dict())
+        missing = [name for name in ownNames if name not in stateDict and not name.endswith(".mask")]
+        if missing:
+            raise KeyError(f"Checkpoint is missing {len(missing)} tensor(s) of this stage, e.g. {missing[:3]}")
+        self.load_state_dict({name: tensor for name, tensor in stateDict.items() if name in ownNames},
+                             strict=False, assign=True)
+
+    def swapCache(self, microbatchId):
+        # Every microbatch keeps its own KV cache: load it into the blocks, return its start position
+        position, blockCaches = self.caches.get(microbatchId, (0, None))
+        for i, block in enumerate(self.trf_blocks.values()):
+            attention = block.attention
+            attention.cacheK, attention.cacheV, attention.cachePositions, attention.ptrCurrentPos = \
+                blockCaches[i] if blockCaches else (None, None, None, 0)
+        return position
+
+    def saveCache(self, microbatchId, position):
+        self.caches[microbatchId] = (position, [
+            (block.attention.cacheK, block.attention.cacheV, getattr(block.attention, "cachePositions", None),
+             block.attention.ptrCurrentPos) for block in self.trf_blocks.values()
+        ])
+
+    def forward(self, x, microbatchId=0, useCache=False, lastLogitsOnly=False):
+        position = self.swapCache(microbatchId) if useCache else 0
+        if self.isFirst:
+            # x: token ids (batch, seqLen)
+            positionIds = torch.arange(position, position + x.shape[1], device=x.device)
+            x = self.dropuoutEmbeddings(self.tokenEmbeddings(x) + self.positionalEmbeddings(positionIds))
+        numTokens = x.shape[1]
+        for block in self.trf_blocks.values():
+            x = block(x, useCache=useCache)
+        if useCache:
+            self.saveCache(microbatchId, position + numTokens)
+        if self.isLast:
+            x = self.finalNormalization(x)
+            if lastLogitsOnly:
+                x = x[:, -1:, :]
+            x = self.out_head(x)
+        return x
+
+
+def stageWorker(cfg, checkpointPath, start, end, isFirst, isLast, inQueue, outQueue, numThreads):
+    # One process per stage: messages are ("forward", microbatchId, tensor, useCache, lastLogitsOnly),
+    # ("reset",) or ("stop",), and are passed on to the next stage in order. Tensors sent through
+    # torch.multiprocessing queues are moved to shared memory, so activations are not copied through a pipe
+    torch.set_num_threads(numThreads)
+    with torch.device("meta"):
+        stage = PipelineStage(cfg, start, end, isFirst, isLast)
+    stage.to_empty(device="cpu")  # Storage for the masks only, parameters come from the mmapped checkpoint
+    for block in stage.trf_blocks.values():
+        if hasattr(block.attention, "mask"):
+            block.attention.mask.copy_(torch.triu(torch.ones(cfg["context_length"], cfg["context_length"]), diagonal=1))
+    stage.loadCheckpoint(checkpointPath)
+    stage.eval()
+    if not isFirst:
+        inQueue.get()  # "ready" of the previous stage
+    outQueue.put(("ready",))
+
+    with torch.no_grad():
+        while True:
+            message = inQueue.get()
+            if message[0] == "forward":
+                _, microbatchId, x, useCache, lastLogitsOnly = message
+                x = stage(x, microbatchId, useCache, lastLogitsOnly)
+                outQueue.put(("forward", microbatchId, x, useCache, lastLogitsOnly))
+            elif message[0] == "reset":
+                stage.caches = {}
+                outQueue.put(message)
+            else:
+                outQueue.put(message + ((start, end, peakRssMegabytes()),))
+                return
+
+
+'Pipeline-Parallel GPT'
+class PipelineGPT:
+    """
+    GPTModel split across numStages local worker processes, each holding a contiguous range of TransformerBlocks
+    (loaded from a checkpoint written by saveCheckpoint / paramsToCheckpoint). A batch is cut into microbatches
+    that flow through the stages one after another, so stage k works on microbatch m while stage k+1 works on m-1.
+    """
+    def __init__(self, cfg, checkpointPath, numStages, numThreads=None):
+        self.cfg = cfg
+        context = mp.get_context("spawn")
+        self.queues = [context.Queue() for _ in range(numStages + 1)]
+        numThreads = numThreads or max(1, (os.cpu_count() or 1) // numStages)
+        self.stageRanges = partitionLayers(cfg["n_layers"], numStages)
+        self.processes = []
+        for stage, (start, end) in enumerate(self.stageRanges):
+            process = context.Process(target=stageWorker, args=(
+                cfg, checkpointPath, start, end, stage == 0, stage == numStages - 1,
+                self.queues[stage], self.queues[stage + 1], numThreads))
+            process.start()
+            self.processes.append(process)
+        self.stagePeaks = None
+        self.receive()  # "ready" passes through every stage once it has loaded its weights
+
+    def receive(self, stopping=False):
+        # Next message from the last stage. Waits in short polls and checks the stage processes in between,
+        # so a stage that died (OOM, bad checkpoint, ...) raises here instead of blocking forever
+        while True:
+            try:
+                return self.queues[-1].get(timeout=POLL_SECONDS)
+            except queueModule.Empty:
+                pass
+            for stage, process in enumerate(self.processes):
+                # Stages only exit on their own (code 0) after passing "stop" on
+                if process.exitcode is not None and not (stopping and process.exitcode == 0):
+                    for other in self.processes:
+                        other.terminate()
+                    start, end = self.stageRanges[stage]
+                    raise RuntimeError(f"Pipeline stage {stage} (blocks {start}-{end - 1}) "
+                                       f"exited with code {process.exitcode}")
+
+    def forward(self, idx, numMicrobatches=1, useCache=False, lastLogitsOnly=False):
+        microbatches = idx.chunk(numMicrobatches)
+        for microbatchId, microbatch in enumerate(microbatches):
+            self.queues[0].put(("forward", microbatchId, microbatch, useCache, lastLogitsOnly))
+        results = {}
+        while len(results) < len(microbatches):
+            _, microbatchId, logits, _, _ = self.receive()
+            results[microbatchId] = logits.clone()  # Own the memory before the shared block is released
+        return torch.cat([results[m] for m in range(len(microbatches))])
+
+    __call__ = forward
+
+    def resetCache(self):
+        self.queues[0].put(("reset",))
+        self.receive()
+
+    def generate(self, idx, maxNewTokens, numMicrobatches=1, temperature=0.0, topK=None):
+        # KV-cached generation, every microbatch decodes while the others are in other stages
+        if idx.shape[1] + maxNewTokens > self.cfg["context_length"]:
+            raise ValueError("Pipeline generation does not roll past context_length")
+        self.resetCache()
+        logits = self.forward(idx, numMicrobatches, useCache=True, lastLogitsOnly=True)
+        for step in range(maxNewTokens):
+            probs = nextTokenProbs(logits[:, -1, :], temperature, topK)
+            nextId = torch.argmax(probs, dim=-1, keepdim=True) if temperature == 0.0 else torch.multinomial(probs, 1)
+            idx = torch.cat((idx, nextId), dim=1)
+            if step < maxNewTokens - 1:
+                logits = self.forward(nextId, numMicrobatches, useCache=True, lastLogitsOnly=True)
+        self.resetCache()
+        return idx
+
+    def close(self):
+        # Stops the workers and collects each stage's (start, end, peak RSS in MB)
+        self.queues[0].put(("stop",))
+        self.stagePeaks = self.receive(stopping=True)[1:]
+        for process in self.processes:
+            process.join()
+        return self.stagePeaks
+
+
+def singleProcessRun(cfg, checkpointPath, idx, maxNewTokens, queue):
+    # Baseline in a fresh process (same mmap loading), so its peak RSS is comparable to one stage's
+    with torch.device("meta"):
+        model = GPTModel(cfg)
+    model.to_empty(device="cpu")
+    for block in model.trf_blocks:
+        block.attention.mask.copy_(torch.triu(torch.ones(cfg["context_length"], cfg["context_length"]), diagonal=1))
+    model.load_state_dict(torch.load(checkpointPath, mmap=True, map_location="cpu"), strict=False, assign=True)
+    model.eval()
+    with torch.no_grad():
+        startTime = time.time()
+        logits = model(idx)
+        prefillTime = time.time() - startTime
+    startTime = time.time()
+    tokenIds = generate(model, idx, maxNewTokens, cfg["context_length"], temperature=0.0, useCache=True)
+    generateTime = time.time() - startTime
+    queue.put((logits, tokenIds, prefillTime, generateTime, peakRssMegabytes()))
+
+
+if __name__ == "__main__":
+    # Throughput and per-process memory of 1 process vs 2 / 4 pipeline stages (random weights)
+    BASE_CONFIG = {"vocab_size": 50257, "context_length": 1024, "drop_rate": 0.0, "qkv_bias": True}
+    cfg = {**BASE_CONFIG, **modelConfigs["gpt2-medium (355M)"]}
+    batchSize, promptLen, numNewTokens = 8, 128, 16
+
+    checkpointPath = os.path.join(tempfile.mkdtemp(), "gpt2-medium.pt")
+    torch.manual_seed(123)
+    saveCheckpoint(GPTModel(cfg), checkpointPath)
+    idx = torch.randint(0, cfg["vocab_size"], (batchSize, promptLen))
+
+    context = mp.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=singleProcessRun, args=(cfg, checkpointPath, idx, numNewTokens, queue))
+    process.start()
+    referenceLogits, referenceIds, prefillTime, generateTime, peakMegabytes = queue.get()
+    process.join()
+    print(f"1 process: prefill {batchSize * promptLen / prefillTime:.0f} tokens/sec, "
+          f"generate {batchSize * numNewTokens / generateTime:.2f} tokens/sec, peak RSS {peakMegabytes:.0f} MB")
+
+    for numStages, numMicrobatches in [(2, 1), (2, 4), (4, 4)]:
+        pipeline = PipelineGPT(cfg, checkpointPath, numStages)
+        startTime = time.time()
+        logits = pipeline(idx, numMicrobatches)
+        prefillTime = time.time() - startTime
+        startTime = time.time()
+        tokenIds = pipeline.generate(idx, numNewTokens, numMicrobatches)
+        generateTime = time.time() - startTime
+        stagePeaks = pipeline.close()
+        print(f"{numStages} stages, {numMicrobatches} microbatches: prefill {batchSize * promptLen / prefillTime:.0f} tokens/sec, "
+              f"generate {batchSize * numNewTokens / generateTime:.2f} tokens/sec, "
+              f"peak RSS per stage {' / '.join(f'{peak:.0f}' for _, _, peak in stagePeaks)} MB, "
+              f"max logit diff {(logits - referenceLogits).abs().max().item():.1e}, "
+              f"same tokens: {torch.equal(tokenIds, referenceIds)}")
+    os.remove(checkpointPath)
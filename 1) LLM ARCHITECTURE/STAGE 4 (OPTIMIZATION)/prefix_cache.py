@@ -0,0 +1,160 @@
+import time
+from collections import OrderedDict
+import torch
+
+from gpt_model import GPTModel, modelConfigs, generate, nextTokenLogits, sampleNextToken
+
+
+class TrieNode:
+    def __init__(self):
+        self.children = {}  # tokenId -> TrieNode
+        self.entries = set()  # ids of the stored entries whose tokens pass through this node
+
+
+'Shared Prompt-Prefix KV Cache'
+class PrefixCache:
+    """
+    Keeps the per-layer keys/values of earlier prompts, indexed by a token-id trie.
+    Any prefix of a stored prompt can be served by slicing its entry, so a new request
+    only prefills the tokens after its longest cached prefix.
+    Entries are evicted least recently used first once maxBytes is exceeded, a prompt larger than maxBytes is not stored.
+    """
+    def __init__(self, maxBytes=512 * 1024**2):
+        self.maxBytes = maxBytes
+        self.numBytes = 0
+        self.root = TrieNode()
+        self.entries = OrderedDict()  # entryId -> (tokenIds, layerCache), oldest first
+        self.nextEntryId = 0
+        self.stats = {"requests": 0, "hits": 0, "promptTokens": 0, "reusedTokens": 0, "timeToFirstToken": []}
+
+    def lookup(self, tokenIds):
+        # Longest cached prefix of tokenIds → (matchLen, layerCache sliced to matchLen)
+        node, matchLen = self.root, 0
+        for tokenId in tokenIds:
+            if tokenId not in node.children:
+                break
+            node = node.children[tokenId]
+            matchLen += 1
+        if matchLen == 0:
+            return 0, None
+        entryId = next(iter(node.entries))
+        self.entries.move_to_end(entryId)
+        return matchLen, self.entries[entryId][1][:, :, :, :matchLen]
+
+    def insert(self, tokenIds, layerCache):
+        entryBytes = layerCache.numel() * layerCache.element_size()
+        if entryBytes > self.maxBytes:
+            return  # Would not fit even in an empty cache
+        node = self.root
+        for tokenId in tokenIds:
+            node = node.children.setdefault(tokenId, TrieNode())
+        if node.entries:
+            # Same tokens (or a longer prompt through them) already stored, slicing serves this prefix
+            self.entries.move_to_end(next(iter(node.entries)))
+            return
+
+        entryId = self.nextEntryId
+        self.nextEntryId += 1
+        node = self.root
+        for tokenId in tokenIds:
+            node = node.children[tokenId]
+            node.entries.add(entryId)
+        self.entries[entryId] = (list(tokenIds), layerCache)
+        self.numBytes += entryBytes
+
+        # Evict least recently used entries until the budget fits (the one just added fits on its own, so it stays)
+        while self.numBytes > self.maxBytes:
+            self.evict(next(iter(self.entries)))
+
+    def evict(self, entryId):
+        tokenIds, layerCache = self.entries.pop(entryId)
+        self.numBytes -= layerCache.numel() * layerCache.element_size()
+        node = self.root
+        for tokenId in tokenIds:
+            child = node.children[tokenId]
+            child.entries.discard(entryId)
+            if not child.entries:
+                del node.children[tokenId]  # No entry passes through here anymore, drop the whole branch
+                return
+            node = child
+
+    def hitRate(self):
+        # Fraction of prompt tokens served from the cache instead of being prefilled
+        return self.stats["reusedTokens"] / max(self.stats["promptTokens"], 1)
+
+
+def prefillWithPrefixCache(model, idx, prefixCache):
+    # Logits after idx (batch 1). The longest cached prefix is loaded into the model's KV cache
+    # and only the remaining tokens are prefilled, then the whole prompt is stored for later requests
+    tokenIds = idx[0].tolist()
+    matchLen, layerCache = prefixCache.lookup(tokenIds)
+    matchLen = min(matchLen, len(tokenIds) - 1)  # At least one token must run to produce logits
+
+    prefixCache.stats["requests"] += 1
+    prefixCache.stats["promptTokens"] += len(tokenIds)
+    if matchLen > 0:
+        prefixCache.stats["hits"] += 1
+        prefixCache.stats["reusedTokens"] += matchLen
+        model.loadCache(layerCache[:, :, :, :matchLen])
+    else:
+        model.resetCache()
+
+    logits = model(idx[:, matchLen:], useCache=True, lastLogitsOnly=True)[:, -1, :]
+    prefixCache.insert(tokenIds, model.readCache(len(tokenIds)))
+    return logits
+
+
+@torch.no_grad()
+def generateWithPrefixCache(model, idx, maxNewTokens, contextSize, prefixCache, temperature=1.0, topK=None, eosId=None):
+    """
+    Same as generate(..., useCache=True) for a batch of 1, but the prompt reuses the keys/values
+    of the longest prefix already in prefixCache. Time to first token is recorded in prefixCache.stats.
+    """
+    startTime = time.time()
+    idx = idx[:, -contextSize:]
+    for step in range(maxNewTokens):
+        if step == 0:
+            logits = prefillWithPrefixCache(model, idx, prefixCache)
+        else:
+            logits = nextTokenLogits(model, idx, contextSize, useCache=True)
+
+        nextId = sampleNextToken(logits, temperature, topK)
+        idx = torch.cat((idx, nextId), dim=1)
+        if step == 0:
+            prefixCache.stats["timeToFirstToken"].append(time.time() - startTime)
+
+        if eosId is not None and nextId.item() == eosId:
+            break
+
+    model.resetCache()
+    return idx
+
+
+if __name__ == "__main__":
+    # Requests sharing a long fixed template (like the formatInput preamble or a RAG system prompt)
+    BASE_CONFIG = {"vocab_size": 50257, "context_length": 1024, "drop_rate": 0.0, "qkv_bias": True}
+    cfg = {**BASE_CONFIG, **modelConfigs["gpt2-small (124M)"]}
+    torch.manual_seed(123)
+    model = GPTModel(cfg).eval()
+
+    numRequests, numNewTokens = 16, 8
+    templates = [torch.randint(0, cfg["vocab_size"], (1, 256)) for _ in range(2)]
+    requests = [torch.cat((templates[i % 2], torch.randint(0, cfg["vocab_size"], (1, 24))), dim=1) for i in range(numRequests)]
+
+    timeToFirstToken = []
+    for prompt in requests:
+        startTime = time.time()
+        generate(model, prompt, 1, cfg["context_length"], temperature=0.0, useCache=True)
+        timeToFirstToken.append(time.time() - startTime)
+    print(f"generate(): mean time to first token {sum(timeToFirstToken) / numRequests * 1000:.1f} ms")
+
+    prefixCache = PrefixCache(maxBytes=256 * 1024**2)
+    sameTokens = True
+    for prompt in requests:
+        tokenIds = generateWithPrefixCache(model, prompt, numNewTokens, cfg["context_length"], prefixCache, temperature=0.0)
+        sameTokens &= torch.equal(tokenIds, generate(model, prompt, numNewTokens, cfg["context_length"], temperature=0.0, useCache=True))
+    stats = prefixCache.stats
+    print(f"Prefix cache: mean time to first token {sum(stats['timeToFirstToken']) / numRequests * 1000:.1f} ms, "
+          f"request hit rate {stats['hits'] / stats['requests']:.0%}, token hit rate {prefixCache.hitRate():.0%}, "
+          f"{len(prefixCache.entries)} entries / {prefixCache.numBytes / 1024**2:.0f} MB")
+    print("Same greedy tokens as generate():", sameTokens)
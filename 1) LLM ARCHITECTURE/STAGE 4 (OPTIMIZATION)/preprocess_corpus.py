@@ -0,0 +1,298 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+from collections import deque
+import tempfile
+import time
+import numpy as np
+import tiktoken
+
+from model_downloader import fileSha256
+
+MANIFEST_NAME = "manifest.json"
+CHUNK_CHARS = 1024 * 1024  # Text per pool task (~250k tokens)
+# \s of the GPT-2 pre-tokenizer (Unicode White_Space). str.isspace() also counts \x1c-\x1f, which the regex does not
+WHITESPACE = "\t\n\x0b\x0c\r \x85\xa0\u1680" + "".join(map(chr, range(0x2000, 0x200b))) + "\u2028\u2029\u202f\u205f\u3000"
+_tokenizer = None
+
+
+def initWorker():
+    # Every pool process loads the tokenizer once
+    global _tokenizer
+    _tokenizer = tiktoken.get_encoding("gpt2")
+
+
+def encodeChunk(task):
+    # (fileIdx, [(text, endsDocument)]) -> (fileIdx, one uint16 array), <|endoftext|> after every finished document
+    fileIdx, chunk = task
+    texts = [text for text, _ in chunk]
+    eotToken = _tokenizer.eot_token
+    encoded = _tokenizer.encode_ordinary_batch(texts, num_threads=1)  # Parallelism comes from the process pool
+    tokenIds = []
+    for ids, (_, endsDocument) in zip(encoded, chunk):
+        tokenIds.extend(ids)
+        if endsDocument:
+            tokenIds.append(eotToken)
+    return fileIdx, np.array(tokenIds, dtype=np.uint16)
+
+
+def iterDocumentParts(path, textKey="text"):
+    # (text, endsDocument) pieces of a file, streamed: a .jsonl line is one document ({textKey: ...}),
+    # a .txt file is one document, cut into ~CHUNK_CHARS pieces at line starts. The whitespace in front of a cut
+    # moves into the next piece, so every piece ends in a non-space and the next one starts with whitespace:
+    # no GPT-2 pre-token spans such a boundary (each is all whitespace, or whitespace only as one leading space),
+    # so the tokens are unchanged
+    with open(path, "r", encoding="utf-8") as file:
+        if path.endswith(".jsonl"):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)[textKey], True
+            return
+        buffer, size = [], 0
+        for line in file:
+            if size >= CHUNK_CHARS:
+                text = "".join(buffer)
+                head = text.rstrip(WHITESPACE)
+                if head:
+                    yield head, False
+                buffer, size = [text[len(head):]], len(text) - len(head)
+            buffer.append(line)
+            size += len(line)
+        yield "".join(buffer), True
+
+
+def iterChunks(paths, textKey="text"):
+    # (fileIdx, chunk) pool tasks of ~CHUNK_CHARS characters each, files in order
+    for fileIdx, path in enumerate(paths):
+        chunk, size = [], 0
+        for text, endsDocument in iterDocumentParts(path, textKey):
+            chunk.append((text, endsDocument))
+            size += len(text)
+            if size >= CHUNK_CHARS:
+                yield fileIdx, chunk
+                chunk, size = [], 0
+        yield fileIdx, chunk
+
+
+class ShardWriter:
+    # Streams uint16 tokens into prefix-00000.bin, prefix-00001.bin, ... of exactly shardTokens tokens (the last one
+    # shorter), appended after the already complete shards passed in. Each shard is written as .part and renamed once complete
+    def __init__(self, directory, prefix, shardTokens, shards=()):
+        self.directory, self.prefix, self.shardTokens = directory, prefix, shardTokens
+        self.shards = list(shards)
+        self.numTokens = sum(shard["tokens"] for shard in self.shards)
+        self.file, self.fileTokens = None, 0
+
+    def write(self, tokenIds):
+        while len(tokenIds):
+            if self.file is None:
+                self.file = open(os.path.join(self.directory, f"{self.prefix}-{len(self.shards):05d}.bin.part"), "wb")
+            take = min(len(tokenIds), self.shardTokens - self.fileTokens)
+            tokenIds[:take].tofile(self.file)
+            self.fileTokens += take
+            self.numTokens += take
+            tokenIds = tokenIds[take:]
+            if self.fileTokens == self.shardTokens:
+                self.closeShard()
+
+    def closeShard(self):
+        partPath = self.file.name
+        self.file.close()
+        os.replace(partPath, partPath[:-len(".part")])
+        self.shards.append({"file": os.path.basename(partPath[:-len(".part")]), "tokens": self.fileTokens})
+        self.file, self.fileTokens = None, 0
+
+    def close(self):
+        if self.file is not None:
+            self.closeShard()
+        return self.shards
+
+
+def loadCorpusManifest(outputDir):
+    # {"shard_tokens": int, "generation": int, "shards": [{"file", "tokens"}],
+    #  "files": {relative path: {"sha256", "start", "tokens"}}}, start / tokens = the file's range in the token stream
+    path = os.path.join(outputDir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"shard_tokens": None, "generation": -1, "shards": [], "files": {}}
+    with open(path) as file:
+        return json.load(file)
+
+
+def shardPaths(outputDir):
+    # All shards in stream order, e.g. for GPTDatasetMemmap / dataLoaderV1(tokenFile=...)
+    manifest = loadCorpusManifest(outputDir)
+    return [os.path.join(outputDir, shard["file"]) for shard in manifest["shards"]]
+
+
+def readTokens(outputDir, shards, start, end):
+    # Token range [start, end) of the stream stored in shards, one memmap slice per shard it touches
+    shardStart = 0
+    for shard in shards:
+        shardEnd = shardStart + shard["tokens"]
+        if shardEnd > start and shardStart < end:
+            tokenIds = np.memmap(os.path.join(outputDir, shard["file"]), dtype=np.uint16, mode="r")
+            yield np.asarray(tokenIds[max(start, shardStart) - shardStart:min(end, shardEnd) - shardStart])
+        shardStart = shardEnd
+
+
+def preprocessCorpus(inputDir, outputDir, numWorkers=None, shardTokens=50_000_000, textKey="text"):
+    """
+    Tokenizes every .txt / .jsonl file under inputDir into one token stream, packed into uint16 shards of shardTokens
+    tokens in outputDir, plus MANIFEST_NAME with the token range of every file.
+    Files whose sha256 matches the manifest are not re-tokenized: shards before the first new / changed / deleted file
+    are kept, later unchanged files are copied from the old shards. Returns (stats, manifest).
+    """
+    os.makedirs(outputDir, exist_ok=True)
+    oldManifest = loadCorpusManifest(outputDir)
+    reusable = oldManifest["files"] if oldManifest["shard_tokens"] == shardTokens else {}
+    paths = sorted(os.path.relpath(os.path.join(root, name), inputDir) for root, _, names in os.walk(inputDir)
+                   for name in names if name.endswith((".txt", ".jsonl")))
+
+    startTime = time.time()
+    files, todo = {}, []
+    for fileIdx, relativePath in enumerate(paths):
+        sha256 = fileSha256(os.path.join(inputDir, relativePath))
+        previous = reusable.get(relativePath)
+        if previous and previous["sha256"] == sha256:
+            files[relativePath] = previous
+        else:
+            files[relativePath] = {"sha256": sha256}
+            todo.append(fileIdx)
+    hashTime = time.time() - startTime
+    if not todo and paths == list(reusable):
+        stats = {"files": len(paths), "tokenized_files": 0, "tokens": 0, "hash_seconds": hashTime,
+                 "tokenize_seconds": 0.0, "tokens_per_sec": 0.0}
+        return stats, oldManifest
+
+    # Files up to the first difference keep their place in the stream, their complete shards are kept as they are
+    oldPaths = list(reusable)
+    firstChanged = 0
+    while (firstChanged < min(len(paths), len(oldPaths)) and paths[firstChanged] == oldPaths[firstChanged]
+           and files[paths[firstChanged]] is reusable[paths[firstChanged]]):
+        firstChanged += 1
+    keptTokens = files[paths[firstChanged - 1]]["start"] + files[paths[firstChanged - 1]]["tokens"] if firstChanged else 0
+    keptShards = oldManifest["shards"][:keptTokens // shardTokens] if reusable else []
+
+    startTime = time.time()
+    numTokens, nextFile = 0, firstChanged
+    generation = oldManifest["generation"] + 1
+    writer = ShardWriter(outputDir, f"tokens-{generation:05d}", shardTokens, keptShards)
+    for tokenIds in readTokens(outputDir, oldManifest["shards"], writer.numTokens, keptTokens):
+        writer.write(tokenIds)
+
+    def finishFilesBefore(fileIdx):
+        # Every file before fileIdx is complete: unchanged ones are copied from the old shards
+        nonlocal nextFile
+        while nextFile < fileIdx:
+            entry = files[paths[nextFile]]
+            if entry is reusable.get(paths[nextFile]):
+                files[paths[nextFile]] = {**entry, "start": writer.numTokens}
+                for tokenIds in readTokens(outputDir, oldManifest["shards"], entry["start"], entry["start"] + entry["tokens"]):
+                    writer.write(tokenIds)
+            else:
+                entry["tokens"] = writer.numTokens - entry["start"]
+            nextFile += 1
+
+    def writeTokens(fileIdx, tokenIds):
+        nonlocal numTokens
+        finishFilesBefore(fileIdx)
+        files[paths[fileIdx]].setdefault("start", writer.numTokens)
+        writer.write(tokenIds)
+        numTokens += len(tokenIds)
+
+    with multiprocessing.Pool(numWorkers, initializer=initWorker) as pool:
+        # At most 2 chunks per worker in flight (bounded memory), results written in file / chunk order
+        pending, maxPending = deque(), 2 * (numWorkers or os.cpu_count() or 1)
+        for todoIdx, chunk in iterChunks([os.path.join(inputDir, paths[fileIdx]) for fileIdx in todo], textKey):
+            pending.append(pool.apply_async(encodeChunk, ((todo[todoIdx], chunk),)))
+            if len(pending) >= maxPending:
+                writeTokens(*pending.popleft().get())
+        while pending:
+            writeTokens(*pending.popleft().get())
+    finishFilesBefore(len(paths))
+    shards = writer.close()
+    tokenizeTime = time.time() - startTime
+
+    manifest = {"shard_tokens": shardTokens, "generation": generation, "shards": shards, "files": files}
+    with open(os.path.join(outputDir, MANIFEST_NAME + ".part"), "w") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(os.path.join(outputDir, MANIFEST_NAME + ".part"), os.path.join(outputDir, MANIFEST_NAME))
+
+    # Only after the new manifest is in place: remove the old shards that were rewritten
+    keep = {shard["file"] for shard in shards}
+    for shard in oldManifest["shards"]:
+        if shard["file"] not in keep and os.path.exists(os.path.join(outputDir, shard["file"])):
+            os.remove(os.path.join(outputDir, shard["file"]))
+
+    stats = {"files": len(paths), "tokenized_files": len(todo), "tokens": numTokens, "hash_seconds": hashTime,
+             "tokenize_seconds": tokenizeTime, "tokens_per_sec": numTokens / tokenizeTime if tokenizeTime else 0.0}
+    return stats, manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tokenize a directory of .txt / .jsonl files into uint16 token shards")
+    parser.add_argument("input_dir", nargs="?")
+    parser.add_argument("output_dir", nargs="?")
+    parser.add_argument("--workers", type=int, default=None, help="tokenizer processes (default: all cores)")
+    parser.add_argument("--shard_tokens", type=int, default=50_000_000, help="tokens per shard (2 bytes each)")
+    parser.add_argument("--text_key", default="text", help="field holding the document text in .jsonl lines")
+    parser.add_argument("--benchmark", action="store_true", help="parity + incremental re-run on a generated corpus")
+    args = parser.parse_args()
+
+    if not args.benchmark:
+        stats, _ = preprocessCorpus(args.input_dir, args.output_dir, args.workers, args.shard_tokens, args.text_key)
+        print(f"{stats['tokenized_files']} of {stats['files']} files tokenized (others unchanged): {stats['tokens']} tokens "
+              f"in {stats['tokenize_seconds']:.2f} s → {stats['tokens_per_sec']:,.0f} tokens/sec, hashing {stats['hash_seconds']:.2f} s")
+    else:
+        # Generated corpus: 100 .txt files ("The Verdict" x 5, each with its own title), one .txt file larger than
+        # CHUNK_CHARS (cut into pieces, with blank lines and trailing spaces in front of the cuts) + one .jsonl with its paragraphs
+        from benchmark_training import loadVerdict
+        rawtext = loadVerdict()
+        inputDir, outputDir = tempfile.mkdtemp(), tempfile.mkdtemp()
+        for i in range(100):
+            with open(os.path.join(inputDir, f"book-{i:03d}.txt"), "w", encoding="utf-8") as file:
+                file.write(f"Book {i}\n\n" + rawtext * 5)
+        with open(os.path.join(inputDir, "large.txt"), "w", encoding="utf-8") as file:
+            file.write((rawtext.replace("\n\n", " \n\n  \n") + "\n\n") * (CHUNK_CHARS // len(rawtext) + 10))
+        largeParts = list(iterDocumentParts(os.path.join(inputDir, "large.txt")))
+        with open(os.path.join(inputDir, "paragraphs.jsonl"), "w", encoding="utf-8") as file:
+            for paragraph in rawtext.split("\n\n") * 20:
+                file.write(json.dumps({"text": paragraph}) + "\n")
+
+        # Current way: one tokenizer.encode call per file on one core
+        tokenizer = tiktoken.get_encoding("gpt2")
+        startTime = time.time()
+        reference = {}
+        for name in sorted(os.listdir(inputDir)):
+            documents = [text for text, _ in iterDocumentParts(os.path.join(inputDir, name))]
+            if not name.endswith(".jsonl"):
+                documents = ["".join(documents)]
+            reference[name] = [t for document in documents for t in tokenizer.encode(document) + [tokenizer.eot_token]]
+        elapsed = time.time() - startTime
+        print(f"tokenizer.encode, 1 process: {sum(map(len, reference.values())) / elapsed:,.0f} tokens/sec")
+
+        for numWorkers in [1, 2, 4]:
+            shutil.rmtree(outputDir)
+            stats, manifest = preprocessCorpus(inputDir, outputDir, numWorkers, shardTokens=10_000)
+            print(f"preprocessCorpus, {numWorkers} worker(s): {stats['tokens_per_sec']:,.0f} tokens/sec "
+                  f"({stats['tokens']} tokens, {len(shardPaths(outputDir))} shards, hashing {stats['hash_seconds']:.2f} s)")
+        stream = np.concatenate([np.fromfile(path, dtype=np.uint16) for path in shardPaths(outputDir)])
+        parity = all(stream[entry["start"]:entry["start"] + entry["tokens"]].tolist() == reference[name]
+                     for name, entry in manifest["files"].items())
+        print(f"Parity with tokenizer.encode + <|endoftext|> per document ({len(largeParts)} pieces of large.txt): {parity}")
+        assert parity and len(largeParts) > 1
+        assert all(shard["tokens"] == 10_000 for shard in manifest["shards"][:-1])
+
+        stats, _ = preprocessCorpus(inputDir, outputDir, 4, shardTokens=10_000)
+        print(f"Re-run, nothing changed: {stats['tokenized_files']} of {stats['files']} files tokenized, "
+              f"{stats['hash_seconds'] + stats['tokenize_seconds']:.2f} s")
+        with open(os.path.join(inputDir, "book-007.txt"), "a", encoding="utf-8") as file:
+            file.write("\nTHE END")
+        os.remove(os.path.join(inputDir, "book-042.txt"))
+        stats, _ = preprocessCorpus(inputDir, outputDir, 4, shardTokens=10_000)
+        print(f"Re-run, one file edited + one deleted: {stats['tokenized_files']} of {stats['files']} files tokenized, "
+              f"{stats['hash_seconds'] + stats['tokenize_seconds']:.2f} s, "
+              f"{len(shardPaths(outputDir))} shards listed / {len(os.listdir(outputDir)) - 1} on disk")
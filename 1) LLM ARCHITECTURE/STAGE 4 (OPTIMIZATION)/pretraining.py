@@ -0,0 +1,334 @@
+import bisect
+import contextlib
+import copy
+import hashlib
+import itertools
+import math
+import numpy as np
+import os
+import time
+import tiktoken
+import torch
+import torch.distributed as dist
+from concurrent.futures import ThreadPoolExecutor
+from torch.utils.data import Dataset, DataLoader
+
+from gpt_model import GPT_CONFIG_124M, GPTModel, generateText, textToTokenId, tokenIdtoText
+
+
+class GPTDatasetV1(Dataset):
+    def __init__(self, txt, tokenizer, maxLen, stride):
+        self.ipIds = []
+        self.targetIds = []
+
+        # S1 --> Tokenize the Entire text
+        tokenIds = tokenizer.encode(txt, allowed_special={"<|endoftext|>"})
+
+        # S2 --> Using sliding window to chunk book into overlapping sequence of maxLen
+        for i in range(0, len(tokenIds) - maxLen, stride):
+            inputChunk = tokenIds[i:i+maxLen]  # 0->4
+            targetChunk = tokenIds[i+1:i+1+maxLen] # 1->5
+
+            self.ipIds.append(torch.tensor(inputChunk))  # Input Tensor X
+            self.targetIds.append(torch.tensor(targetChunk)) # Target Tensor Y
+
+    def __len__(self):
+        return len(self.ipIds)
+
+    def __getitem__(self, idx):
+        return self.ipIds[idx], self.targetIds[idx]  # Ip OP Pairs
+
+
+def textSha256(txt):
+    return hashlib.sha256(txt.encode("utf-8")).hexdigest()
+
+
+def writeTokenFile(txt, tokenizer, path):
+    # Token ids as a flat uint16 file (GPT-2 vocab 50257 < 2**16), read back by GPTDatasetMemmap.
+    # path + ".sha256" records the text the tokens came from (written last, so a half-written file never matches)
+    assert tokenizer.n_vocab <= 2**16, "vocab does not fit in uint16"
+    tokenIds = np.array(tokenizer.encode(txt, allowed_special={"<|endoftext|>"}), dtype=np.uint16)
+    tokenIds.tofile(path)
+    with open(path + ".sha256", "w") as sourceFile:
+        sourceFile.write(textSha256(txt))
+    return len(tokenIds)
+
+
+def tokenFileMatches(txt, path):
+    # True when path holds the tokens of exactly this text
+    if not os.path.exists(path) or not os.path.exists(path + ".sha256"):
+        return False
+    with open(path + ".sha256") as sourceFile:
+        return sourceFile.read().strip() == textSha256(txt)
+
+
+class GPTDatasetMemmap(Dataset):
+    # Same windows as GPTDatasetV1, but nothing is tokenized or copied up front: the token file is memory-mapped,
+    # window i starts at i*stride and input / target are views of the same maxLen+1 tokens.
+    # tokenFiles can also be a list of shards (preprocess_corpus.shardPaths), read as one token stream: a window
+    # that runs into the next shard is stitched together from both
+    def __init__(self, tokenFiles, maxLen, stride):
+        paths = [tokenFiles] if isinstance(tokenFiles, str) else tokenFiles
+        self.tokenIds = [np.memmap(path, dtype=np.uint16, mode="r") for path in paths]
+        self.maxLen = maxLen
+        self.stride = stride
+        self.shardOffsets = np.cumsum([0] + [len(tokenIds) for tokenIds in self.tokenIds])  # First token of every shard
+        self.numWindows = len(range(0, int(self.shardOffsets[-1]) - maxLen, stride))
+
+    def __len__(self):
+        return self.numWindows
+
+    def __getitem__(self, idx):
+        start = idx * self.stride
+        shardIdx = bisect.bisect_right(self.shardOffsets, start) - 1
+        localStart = start - self.shardOffsets[shardIdx]
+        window = self.tokenIds[shardIdx][localStart:localStart + self.maxLen + 1]
+        if len(window) < self.maxLen + 1:
+            # Crosses a shard boundary: the only case that copies (memmapCollate copies every window anyway)
+            pieces, numTokens = [window], len(window)
+            while numTokens < self.maxLen + 1:
+                shardIdx += 1
+                pieces.append(self.tokenIds[shardIdx][:self.maxLen + 1 - numTokens])
+                numTokens += len(pieces[-1])
+            window = np.concatenate(pieces)
+        return window[:-1], window[1:]  # Ip OP Pairs (uint16 views)
+
+
+def memmapCollate(batch):
+    # uint16 views -> int64 batch (nn.Embedding and cross_entropy need int64), the only copy of the tokens
+    inputBatch = torch.from_numpy(np.stack([inputs for inputs, _ in batch]).astype(np.int64))
+    targetBatch = torch.from_numpy(np.stack([targets for _, targets in batch]).astype(np.int64))
+    return inputBatch, targetBatch
+
+
+def dataLoaderV1(txt, batch_size = 4, max_length = 256,
+                 stride = 128, shuffle = True, drop_last = True,
+                 num_workers = 0, tokenFile = None):
+    # tokenFile --> windows read from a uint16 token file (GPTDatasetMemmap), (re)written from txt unless it already
+    # holds the tokens of txt. txt can be None when the file already exists, or tokenFile a list of preprocess_corpus.py shards.
+    # Shuffling only permutes window indices
+    # S1) Initialize the tokenizer
+    tokenizer = tiktoken.get_encoding("gpt2")
+    # S2) Create Dataset
+    if tokenFile is None:
+        dataset = GPTDatasetV1(txt, tokenizer, max_length, stride)
+    else:
+        if isinstance(tokenFile, str):
+            if txt is None and not os.path.exists(tokenFile):
+                raise ValueError(f"tokenFile {tokenFile} does not exist, pass txt to write it")
+            if txt is not None and not tokenFileMatches(txt, tokenFile):
+                writeTokenFile(txt, tokenizer, tokenFile)
+        dataset = GPTDatasetMemmap(tokenFile, max_length, stride)
+    # S3) Create Dataloader
+    dataloader = DataLoader(dataset, batch_size = batch_size,
+                            shuffle = shuffle, drop_last = drop_last,
+                            num_workers = num_workers,
+                            collate_fn = memmapCollate if tokenFile is not None else None)
+    return dataloader
+
+
+def calculateLossBatch(inputBatch, targetBatch, model, device):
+    inputBatch, targetBatch = inputBatch.to(device), targetBatch.to(device)
+    logits = model(inputBatch)
+    loss = torch.nn.functional.cross_entropy(logits.flatten(0,1), targetBatch.flatten(), ignore_index = 0)
+    return loss
+
+
+def calculateLossLoader(dataLoaderV1, model, device, num_batches = None):
+    totalLoss = 0
+    if(len(dataLoaderV1) == 0): return float("nan")
+    elif num_batches is None: num_batches = len(dataLoaderV1)
+    else:
+        # Reduce the number of batches to match the total no of batches in data loader
+        num_batches = min(num_batches, len(dataLoaderV1))
+    for i, (inputBatch, targetBatch) in enumerate(dataLoaderV1):
+        if i< num_batches:
+            loss = calculateLossBatch(inputBatch, targetBatch, model, device)
+            totalLoss += loss.item()
+        else : break
+    return totalLoss/num_batches # Mean Loss per batch
+
+
+def materializeBatches(dataLoader, numBatches):
+    # The first numBatches batches, drawn once: evaluation always scores the same rows and skips the DataLoader.
+    # The RNG state is restored, so the training shuffle order does not change
+    rngState = torch.get_rng_state()
+    batches = list(itertools.islice(dataLoader, numBatches))
+    torch.set_rng_state(rngState)
+    return batches
+
+
+def calculateLossBatches(batches, model, device):
+    # Mean loss over fixed batches, accumulated on the device: one .item() sync instead of one per batch
+    if len(batches) == 0: return float("nan")
+    totalLoss = torch.zeros((), device=device)
+    for inputBatch, targetBatch in batches:
+        totalLoss += calculateLossBatch(inputBatch, targetBatch, model, device)
+    return (totalLoss / len(batches)).item()
+
+
+def learningRate(step, totalSteps, trainConfig):
+    # Linear warmup to peak_lr, then cosine decay to min_lr at the last optimizer step
+    warmupSteps = trainConfig["warmup_steps"]
+    if step < warmupSteps:
+        return trainConfig["peak_lr"] * (step + 1) / warmupSteps
+    progress = (step - warmupSteps) / max(1, totalSteps - warmupSteps)
+    return trainConfig["min_lr"] + (trainConfig["peak_lr"] - trainConfig["min_lr"]) * 0.5 * (1 + math.cos(math.pi * progress))
+
+
+def trainModel(model, trainLoader, validationLoader,
+               optimizer, device, numOfEpochs, evalFreq, evalIter, startContext, tokenizer, lossFn=calculateLossBatch,
+               trainConfig=None, cachedEval=False, asyncEval=False):
+    # lossFn(inputBatch, targetBatch, model, device) is the training objective (e.g. a distillation loss),
+    # the evaluation losses stay plain next-token cross entropy. startContext=None skips the sample generation.
+    # trainConfig (see TRAIN_CONFIG_124M): bf16 autocast, gradient accumulation, warmup + cosine LR, grad-norm clipping.
+    # globalStep and evalFreq count optimizer steps (= grad_accum_steps batches each)
+    # model can be a DistributedDataParallel wrapper (distributed_training.py): evaluation and sampling run on rank 0 only,
+    # tokensSeen counts the tokens of all ranks
+    # cachedEval: evalIter train / validation batches drawn once and scored with one sync, samples use the KV cache.
+    # asyncEval: evaluation and sampling run in a background thread on a weight snapshot, training continues meanwhile
+    # (one evaluation in flight at a time); all results are in the returned lists. evalFreq=None skips evaluation.
+    # asyncEval needs cachedEval: the thread must not iterate trainLoader (and draw from the global RNG) during training
+    if asyncEval and not cachedEval:
+        raise ValueError("asyncEval=True needs cachedEval=True, the background evaluation only scores materialized batches")
+    trainLosses, validationLosses, trackSeenTokens = [], [], []
+    tokensSeen, globalStep = 0, -1
+    accumSteps = trainConfig["grad_accum_steps"] if trainConfig else 1
+    stepsPerEpoch = math.ceil(len(trainLoader) / accumSteps)
+    autocast = torch.autocast(device_type=torch.device(device).type, dtype=torch.bfloat16,
+                              enabled=bool(trainConfig and trainConfig["bf16"]))
+    distributed = dist.is_available() and dist.is_initialized()
+    worldSize = dist.get_world_size() if distributed else 1
+    isMainRank = not distributed or dist.get_rank() == 0
+    unwrappedModel = getattr(model, "module", model)  # DDP wrapper -> GPTModel
+
+    if cachedEval and isMainRank:
+        trainEvalBatches = materializeBatches(trainLoader, evalIter)
+        validationEvalBatches = materializeBatches(validationLoader, evalIter)
+    evalExecutor = ThreadPoolExecutor(max_workers=1) if asyncEval and isMainRank else None
+    snapshot, pendingEval = None, None
+
+    def runEvaluation(evalModel, epoch, globalStep, tokensSeen):
+        if cachedEval:
+            trainingLoss, validationLoss = evaluateBatches(evalModel, trainEvalBatches, validationEvalBatches, device)
+        else:
+            trainingLoss, validationLoss = evaluateModel(evalModel, trainLoader, validationLoader, device, evalIter)
+        trainLosses.append(trainingLoss)
+        validationLosses.append(validationLoss)
+        trackSeenTokens.append(tokensSeen)
+        print(f"Epoch {epoch+1} (Step {globalStep:06d}): Training Loss: {trainingLoss:.4f}, Validation Loss: {validationLoss:.4f}")
+
+    def runSample(evalModel, epoch):
+        print(f"Sample Generation After Epoch {epoch+1} :")
+        generateAndPrintSample(evalModel, startContext, tokenizer, device, useCache=cachedEval)
+        print()
+
+    def submit(task, *args):
+        # Synchronous, or on the snapshot in the background thread once the previous background task is done
+        nonlocal snapshot, pendingEval
+        if evalExecutor is None:
+            return task(unwrappedModel, *args)
+        if pendingEval is not None:
+            pendingEval.result()
+        if snapshot is None:
+            snapshot = copy.deepcopy(unwrappedModel)
+        snapshot.load_state_dict(unwrappedModel.state_dict())
+        pendingEval = evalExecutor.submit(task, snapshot, *args)
+
+    for epoch in range(numOfEpochs):
+        if hasattr(trainLoader.sampler, "set_epoch"):
+            trainLoader.sampler.set_epoch(epoch)  # DistributedSampler: new shuffle every epoch, same on all ranks
+        model.train()  # Set Model for training
+        optimizer.zero_grad()  # Clear gradients
+        for batchIdx, (inputBatch, targetBatch) in enumerate(trainLoader):
+            isStep = (batchIdx + 1) % accumSteps == 0 or batchIdx + 1 == len(trainLoader)
+            windowSize = min(accumSteps, len(trainLoader) - batchIdx // accumSteps * accumSteps)  # The last window can be shorter
+            # DDP: gradients are only all-reduced on the last batch of an accumulation window
+            noSync = model.no_sync() if hasattr(model, "no_sync") and not isStep else contextlib.nullcontext()
+            with noSync:
+                with autocast:
+                    loss = lossFn(inputBatch, targetBatch, model, device)
+                (loss / windowSize).backward()  # Calculate loss gradients, averaged over the batches of the window
+            tokensSeen += inputBatch.numel() * worldSize
+            if not isStep:
+                continue
+
+            globalStep += 1
+            if trainConfig:
+                for paramGroup in optimizer.param_groups:
+                    paramGroup["lr"] = learningRate(globalStep, numOfEpochs * stepsPerEpoch, trainConfig)
+                if trainConfig["max_grad_norm"] is not None:
+                    torch.nn.utils.clip_grad_norm_(model.parameters(), trainConfig["max_grad_norm"])
+            optimizer.step()  # Update model parameters
+            optimizer.zero_grad()
+
+            # Optional eval step
+            if evalFreq is not None and globalStep % evalFreq == 0 and isMainRank:
+                submit(runEvaluation, epoch, globalStep, tokensSeen)
+
+        if startContext is not None and isMainRank:
+            submit(runSample, epoch)
+
+    if evalExecutor is not None:
+        evalExecutor.shutdown(wait=True)
+        if pendingEval is not None:
+            pendingEval.result()  # Re-raises an exception of the last background task
+    return trainLosses, validationLosses, trackSeenTokens
+
+
+def evaluateModel(model, trainLoader, validationLoader, device, evalIter):
+    model.eval() # Set model for evaluation
+    with torch.no_grad():
+        trainingLoss = calculateLossLoader(trainLoader, model, device, num_batches= evalIter)
+        validationLoss = calculateLossLoader(validationLoader, model, device, num_batches= evalIter)
+    model.train()
+    return trainingLoss, validationLoss
+
+
+def evaluateBatches(model, trainBatches, validationBatches, device):
+    # evaluateModel on materializeBatches(...) batches
+    model.eval()
+    with torch.no_grad():
+        trainingLoss = calculateLossBatches(trainBatches, model, device)
+        validationLoss = calculateLossBatches(validationBatches, model, device)
+    model.train()
+    return trainingLoss, validationLoss
+
+
+def generateAndPrintSample(model, startContext, tokenizer, device, useCache=False):
+    model.eval()
+    contextSize = model.positionalEmbeddings.weight.shape[0]
+    encoded = textToTokenId(startContext, tokenizer).to(device)
+    with torch.no_grad():
+        tokenIds = generateText(model= model, idx = encoded, maxNewTokens=50,contextSize= contextSize, useCache=useCache)
+    decodedText = tokenIdtoText(tokenIds, tokenizer)
+    print(decodedText.replace("\n", " "))
+    model.train()
+
+
+if __name__ == "__main__":
+    # Same run as STAGE 2 PRETRAINED_BASE_MODEL.ipynb: GPT_CONFIG_124M on "The Verdict"
+    filePath = os.path.join(os.path.dirname(__file__), "..", "STAGE 1", "1) DATA PREP & SAMPLING", "TOKENIZATION", "the-verdict.txt")
+    with open(filePath, "r", encoding="utf-8") as file:
+        rawtext = file.read()
+
+    trainRatio = 0.90
+    splitIdx = int(trainRatio*len(rawtext))
+    torch.manual_seed(123)
+    trainLoader = dataLoaderV1(rawtext[:splitIdx], batch_size = 2, max_length = GPT_CONFIG_124M["context_length"],
+                               stride = GPT_CONFIG_124M["context_length"], shuffle = True, drop_last = True)
+    validationLoader = dataLoaderV1(rawtext[splitIdx:], batch_size = 2, max_length = GPT_CONFIG_124M["context_length"],
+                                    stride = GPT_CONFIG_124M["context_length"], shuffle = False, drop_last = False)
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    startingTime = time.time()
+    torch.manual_seed(123)
+    model = GPTModel(GPT_CONFIG_124M)
+    model.to(device)
+    optimizer = torch.optim.AdamW(model.parameters(), lr = 0.0004, weight_decay=0.1)
+    trainLosses, validationLosses, tokensSeen = trainModel(
+        model, trainLoader, validationLoader, optimizer, device,
+        numOfEpochs=10, evalFreq= 5, evalIter= 5,
+        startContext= "Every effort moves you", tokenizer = tiktoken.get_encoding("gpt2")
+    )
+    print(f"Training completed in {(time.time() - startingTime) / 60: .2f} minutes")
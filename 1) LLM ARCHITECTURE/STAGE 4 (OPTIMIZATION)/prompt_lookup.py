@@ -0,0 +1,100 @@
+import time
+import torch
+
+from gpt_model import GPTModel, modelConfigs, generate, nextTokenLogits, nextTokenProbs, sampleNextToken
+from speculative_decoding import cachedLogits, verifyDraft
+
+
+def findDraft(tokenIds, maxNgramSize=3, numDraftTokens=10):
+    # Match the last n tokens against earlier text (longest n first, latest match first)
+    # and propose the tokens that followed that match
+    for ngramSize in range(maxNgramSize, 0, -1):
+        if len(tokenIds) <= ngramSize:
+            continue
+        ngram = tokenIds[-ngramSize:]
+        for start in range(len(tokenIds) - ngramSize - 1, -1, -1):
+            if tokenIds[start:start + ngramSize] == ngram:
+                return tokenIds[start + ngramSize:start + ngramSize + numDraftTokens]
+    return []
+
+
+@torch.no_grad()
+def promptLookupGenerate(model, idx, maxNewTokens, contextSize, temperature=1.0, topK=None, eosId=None,
+                         maxNgramSize=3, numDraftTokens=10):
+    """
+    Generate with drafts copied from the prompt: the last generated n-gram is looked up in the
+    sequence so far and the tokens that followed it are verified in one cached forward pass.
+    No second model is needed, works best when the answer quotes the prompt (### Input:, RAG context).
+    Same arguments as generate() (batch size 1), returns (idx, stats).
+    """
+    stats = {"draftedTokens": 0, "acceptedTokens": 0, "steps": 0}
+    model.resetCache()
+
+    numGenerated = 0
+    while numGenerated < maxNewTokens:
+        tokenIds = idx[0].tolist()
+        if len(tokenIds) >= contextSize:
+            # Window is full: plain step, the cropped window is prefilled again like generate()
+            newIds = [sampleNextToken(nextTokenLogits(model, idx, contextSize), temperature, topK).item()]
+        else:
+            # S1) Draft from the n-gram match, it must fit in the window and in the remaining budget
+            draftIds = findDraft(tokenIds, maxNgramSize, numDraftTokens)
+            draftIds = draftIds[:min(contextSize - len(tokenIds), maxNewTokens - numGenerated - 1)]
+
+            # S2) One forward pass scores the last token and every draft token (cache holds the rest)
+            candidateIdx = torch.cat((idx, torch.tensor([draftIds], dtype=idx.dtype, device=idx.device)), dim=1)
+            targetProbs = nextTokenProbs(cachedLogits(model, candidateIdx, len(draftIds) + 1), temperature, topK)
+
+            # S3) A copied draft is deterministic (q is one-hot), so the speculative rule keeps the model's distribution
+            draftProbs = torch.zeros(len(draftIds), targetProbs.shape[-1], device=targetProbs.device)
+            draftProbs[torch.arange(len(draftIds)), draftIds] = 1.0
+            newIds = verifyDraft(targetProbs, draftIds, draftProbs)
+            stats["draftedTokens"] += len(draftIds)
+            stats["acceptedTokens"] += len(newIds) - 1
+            model.truncateCache(len(tokenIds) + len(newIds) - 1)
+        stats["steps"] += 1
+
+        # Append new tokens, stop at EOS
+        if eosId is not None and eosId in newIds:
+            newIds = newIds[:newIds.index(eosId) + 1]
+        idx = torch.cat((idx, torch.tensor([newIds], dtype=idx.dtype, device=idx.device)), dim=1)
+        numGenerated += len(newIds)
+        if eosId is not None and newIds[-1] == eosId:
+            break
+
+    model.resetCache()
+    return idx, stats
+
+
+if __name__ == "__main__":
+    # Accepted tokens per step and speedup on a long prompt, plus the cost of verifying a draft
+    BASE_CONFIG = {"vocab_size": 50257, "context_length": 1024, "drop_rate": 0.0, "qkv_bias": True}
+    cfg = {**BASE_CONFIG, **modelConfigs["gpt2-small (124M)"]}
+    torch.manual_seed(123)
+    model = GPTModel(cfg).eval()
+    prompt = torch.randint(0, cfg["vocab_size"], (1, 256))
+    numNewTokens = 64
+
+    startTime = time.time()
+    baseline = generate(model, prompt, numNewTokens, cfg["context_length"], temperature=0.0, useCache=True)
+    baselineTime = time.time() - startTime
+    startTime = time.time()
+    tokenIds, stats = promptLookupGenerate(model, prompt, numNewTokens, cfg["context_length"], temperature=0.0)
+    lookupTime = time.time() - startTime
+    print(f"generate(): {numNewTokens / baselineTime:.2f} tokens/sec | prompt lookup: {numNewTokens / lookupTime:.2f} tokens/sec, "
+          f"{numNewTokens / stats['steps']:.2f} accepted tokens per step, speedup {baselineTime / lookupTime:.2f}x")
+    print("Same greedy tokens as generate():", torch.equal(tokenIds, baseline))
+
+    # Verifying k draft tokens costs far less than k decode steps,
+    # speedup ≈ accepted tokens per step x (1-token step time / verification step time)
+    with torch.no_grad():
+        for numTokens in [1, 5, 11]:
+            model.resetCache()
+            model(prompt, useCache=True, lastLogitsOnly=True)
+            startTime = time.time()
+            for _ in range(10):
+                model.truncateCache(prompt.shape[1])
+                model(prompt[:, :numTokens], useCache=True, lastLogitsOnly=numTokens)
+            print(f"Cached forward of {numTokens:>2} token(s) after a {prompt.shape[1]}-token prompt: "
+                  f"{(time.time() - startTime) / 10 * 1000:.1f} ms")
+        model.resetCache()
@@ -0,0 +1,209 @@
+import copy
+import time
+import torch
+import torch.nn as nn
+
+from gpt_model import GPTModel, modelConfigs, generate
+from pretraining import calculateLossBatch
+
+
+def scoreUnits(model, dataLoader, device, lossFn=calculateLossBatch, method="gradient", numBatches=None):
+    """
+    Importance of every K/V head group and FFN neuron on a calibration loader of (input, target) batches.
+    A gate of ones multiplies each head's context vector (input of out_proj) and each GELU output:
+    - "gradient": |d loss / d gate| summed over batches (first-order estimate of the loss change if the unit is removed)
+    - "activation": mean |output| of the unit (no backward pass)
+    lossFn(inputBatch, targetBatch, model, device) defaults to the LM loss, pass the classifier loss for finetuned heads.
+    Returns (headScores, neuronScores): per layer, shapes (num_kv_heads,) and (hidden,)
+    """
+    headGates, neuronGates, hooks = [], [], []
+    headScores = [torch.zeros(block.attention.num_heads, device=device) for block in model.trf_blocks]
+    neuronScores = [torch.zeros(block.feedforwardNN.layers[0].out_features, device=device) for block in model.trf_blocks]
+
+    def gateHook(gate, scores, headDim=1):
+        def hook(module, args):
+            x = args[0] * gate.repeat_interleave(headDim).to(args[0].dtype)
+            if method == "activation":
+                with torch.no_grad():
+                    unitNorms = x.abs().reshape(-1, gate.shape[0], headDim).mean(dim=(0, 2))
+                    scores.add_(unitNorms)
+            return (x,)
+        return hook
+
+    for layer, block in enumerate(model.trf_blocks):
+        headGates.append(torch.ones(block.attention.num_heads, device=device, requires_grad=True))
+        neuronGates.append(torch.ones(block.feedforwardNN.layers[0].out_features, device=device, requires_grad=True))
+        hooks.append(block.attention.out_proj.register_forward_pre_hook(
+            gateHook(headGates[-1], headScores[layer], block.attention.head_dim)))
+        hooks.append(block.feedforwardNN.layers[2].register_forward_pre_hook(gateHook(neuronGates[-1], neuronScores[layer])))
+
+    training = model.training
+    model.eval()
+    try:
+        for i, (inputBatch, targetBatch) in enumerate(dataLoader):
+            if numBatches is not None and i >= numBatches:
+                break
+            if method == "gradient":
+                loss = lossFn(inputBatch, targetBatch, model, device)
+                gateGrads = torch.autograd.grad(loss, headGates + neuronGates)
+                for scores, grad in zip(headScores + neuronScores, gateGrads):
+                    scores += grad.abs()
+            else:
+                with torch.no_grad():
+                    lossFn(inputBatch, targetBatch, model, device)
+    finally:
+        for hook in hooks:
+            hook.remove()
+        model.train(training)
+
+    # Query heads sharing a K/V head are kept or removed together
+    headScores = [scores.view(block.attention.num_kv_heads, -1).sum(dim=1)
+                  for scores, block in zip(headScores, model.trf_blocks)]
+    return headScores, neuronScores
+
+
+def sliceLinear(linear, keep, dim):
+    # New nn.Linear with only the `keep` rows (dim=0, outputs) or columns (dim=1, inputs)
+    weight = linear.weight.detach().index_select(dim, keep)
+    bias = None if linear.bias is None else linear.bias.detach()
+    if bias is not None and dim == 0:
+        bias = bias.index_select(0, keep)
+    sliced = nn.Linear(weight.shape[1], weight.shape[0], bias=bias is not None, device=weight.device, dtype=weight.dtype)
+    with torch.no_grad():
+        sliced.weight.copy_(weight)
+        if bias is not None:
+            sliced.bias.copy_(bias)
+    return sliced
+
+
+def pruneHeads(attention, keepKvHeads):
+    # Physically removes K/V head groups (and their query heads) from a MultiHeadAttention
+    keepKvHeads = keepKvHeads.sort().values
+    headDim, groupSize = attention.head_dim, attention.group_size
+    device = keepKvHeads.device
+    keepQueryHeads = (keepKvHeads.unsqueeze(1) * groupSize + torch.arange(groupSize, device=device)).flatten()
+    queryRows = (keepQueryHeads.unsqueeze(1) * headDim + torch.arange(headDim, device=device)).flatten()
+    kvRows = (keepKvHeads.unsqueeze(1) * headDim + torch.arange(headDim, device=device)).flatten()
+
+    if attention.fused_qkv:
+        qkvRows = torch.cat((queryRows, attention.d_out + kvRows, attention.d_out + attention.kv_dim + kvRows))
+        attention.W_qkv = sliceLinear(attention.W_qkv, qkvRows.to(attention.W_qkv.weight.device), dim=0)
+    else:
+        attention.W_query = sliceLinear(attention.W_query, queryRows, dim=0)
+        attention.W_key = sliceLinear(attention.W_key, kvRows, dim=0)
+        attention.W_value = sliceLinear(attention.W_value, kvRows, dim=0)
+    attention.out_proj = sliceLinear(attention.out_proj, queryRows, dim=1)  # Output stays emb_dim wide
+
+    attention.num_kv_heads = len(keepKvHeads)
+    attention.num_heads = len(keepQueryHeads)
+    attention.d_out = attention.num_heads * headDim
+    attention.kv_dim = attention.num_kv_heads * headDim
+    attention.resetCache()
+
+
+def pruneNeurons(feedForward, keep):
+    # Physically removes hidden neurons: rows of the expansion, columns of the compression
+    keep = keep.sort().values
+    feedForward.layers[0] = sliceLinear(feedForward.layers[0], keep, dim=0)
+    feedForward.layers[2] = sliceLinear(feedForward.layers[2], keep, dim=1)
+
+
+def pruneModel(model, headScores, neuronScores, headRatio=0.0, neuronRatio=0.0):
+    # Removes the lowest-scoring headRatio of the K/V head groups and neuronRatio of the FFN neurons of every layer
+    # (at least one of each is kept), in place. Shapes then differ from cfg, save with torch.save(model)
+    for block, heads, neurons in zip(model.trf_blocks, headScores, neuronScores):
+        numHeads = max(1, round(len(heads) * (1 - headRatio)))
+        numNeurons = max(1, round(len(neurons) * (1 - neuronRatio)))
+        pruneHeads(block.attention, torch.topk(heads, numHeads).indices.to(block.attention.out_proj.weight.device))
+        pruneNeurons(block.feedforwardNN, torch.topk(neurons, numNeurons).indices.to(block.attention.out_proj.weight.device))
+    return model
+
+
+def finetune(model, trainLoader, device, numSteps, learningRate=1e-4, lossFn=calculateLossBatch):
+    # Short finetuning, used after pruning so the remaining weights take over the removed units' work
+    optimizer = torch.optim.AdamW(model.parameters(), lr=learningRate, weight_decay=0.1)
+    model.train()
+    step = 0
+    while step < numSteps:
+        for inputBatch, targetBatch in trainLoader:
+            optimizer.zero_grad()
+            loss = lossFn(inputBatch, targetBatch, model, device)
+            loss.backward()
+            optimizer.step()
+            step += 1
+            if step == numSteps:
+                break
+    return model.eval()
+
+
+def numParameters(model):
+    return sum(p.numel() for p in model.parameters())
+
+
+def copyTaskBatches(numBatches, batchSize, halfLen, vocabSize, seed):
+    # Random tokens followed by the same tokens again: only the copied half is predictable (needs attention heads).
+    # Targets of the random half are 0, which calculateLossBatch ignores (ignore_index=0)
+    generator = torch.Generator().manual_seed(seed)
+    batches = []
+    for _ in range(numBatches):
+        half = torch.randint(1, vocabSize, (batchSize, halfLen), generator=generator)
+        sequence = torch.cat((half, half), dim=1)
+        targets = sequence[:, 1:].clone()
+        targets[:, :halfLen - 1] = 0
+        batches.append((sequence[:, :-1], targets))
+    return batches
+
+
+@torch.no_grad()
+def copyAccuracy(model, batches):
+    correct = total = 0
+    for inputBatch, targetBatch in batches:
+        predictions = model(inputBatch).argmax(dim=-1)
+        scored = targetBatch != 0
+        correct += (predictions[scored] == targetBatch[scored]).sum().item()
+        total += scored.sum().item()
+    return correct / total
+
+
+if __name__ == "__main__":
+    device = torch.device("cpu")
+
+    # S1) Accuracy: a small GPTModel trained on a copy task, then pruned by gradient importance
+    smallCfg = {"vocab_size": 512, "context_length": 64, "emb_dim": 128, "n_layers": 4, "n_heads": 8,
+                "drop_rate": 0.0, "qkv_bias": True}
+    torch.manual_seed(123)
+    model = finetune(GPTModel(smallCfg), copyTaskBatches(600, 32, 16, smallCfg["vocab_size"], seed=1), device,
+                     numSteps=600, learningRate=1e-3)
+    calibration = copyTaskBatches(8, 32, 16, smallCfg["vocab_size"], seed=2)
+    evaluation = copyTaskBatches(8, 32, 16, smallCfg["vocab_size"], seed=3)
+    headScores, neuronScores = scoreUnits(model, calibration, device)
+
+    for pruneRatio in [0.0, 0.25, 0.5, 0.75]:
+        pruned = pruneModel(copy.deepcopy(model), headScores, neuronScores, headRatio=pruneRatio, neuronRatio=pruneRatio)
+        accuracy = copyAccuracy(pruned, evaluation)
+        recovered = copyAccuracy(finetune(pruned, copyTaskBatches(100, 32, 16, smallCfg["vocab_size"], seed=4), device,
+                                          numSteps=100, learningRate=1e-3), evaluation)
+        print(f"Copy task, pruned {pruneRatio:.0%} of heads and FFN neurons: {numParameters(pruned) / 1e6:.2f}M params, "
+              f"accuracy {accuracy:.1%}, after 100 recovery steps {recovered:.1%}")
+
+    # S2) Latency: 124M (random weights, speed does not depend on them) at the same pruning levels
+    BASE_CONFIG = {"vocab_size": 50257, "context_length": 1024, "drop_rate": 0.0, "qkv_bias": True}
+    cfg = {**BASE_CONFIG, **modelConfigs["gpt2-small (124M)"]}
+    torch.manual_seed(123)
+    model = GPTModel(cfg).eval()
+    headScores, neuronScores = scoreUnits(model, copyTaskBatches(2, 4, 32, cfg["vocab_size"], seed=2), device,
+                                          method="activation")
+    prompt = torch.randint(0, cfg["vocab_size"], (1, 32))
+    longPrompt = torch.randint(0, cfg["vocab_size"], (4, 512))
+    for pruneRatio in [0.0, 0.25, 0.5, 0.75]:
+        pruned = pruneModel(copy.deepcopy(model), headScores, neuronScores, headRatio=pruneRatio, neuronRatio=pruneRatio)
+        startTime = time.time()
+        generate(pruned, prompt, 32, cfg["context_length"], temperature=0.0, useCache=True)
+        tokensPerSec = 32 / (time.time() - startTime)
+        with torch.no_grad():
+            startTime = time.time()
+            pruned(longPrompt)
+            prefillMs = (time.time() - startTime) * 1000
+        print(f"124M pruned {pruneRatio:.0%}: {numParameters(pruned) / 1e6:.1f}M params, "
+              f"{tokensPerSec:.2f} tokens/sec, prefill 4x512 {prefillMs:.0f} ms")
+        del pruned
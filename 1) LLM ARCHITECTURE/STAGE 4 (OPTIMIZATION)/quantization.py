@@ -0,0 +1,155 @@
+import time
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from gpt_model import GPTModel, modelConfigs, generate
+
+# fbgemm/x86 int8 GEMM: activations are quantized per call, the int32 result is dequantized inside the kernel
+INT8_KERNEL = "x86" in torch.backends.quantized.supported_engines or "fbgemm" in torch.backends.quantized.supported_engines
+
+
+def quantizePerChannel(weight):
+    # Symmetric int8 with one scale per output channel (row): weight ≈ weightInt8 * scales[:, None]
+    scales = weight.abs().amax(dim=1).clamp(min=1e-8) / 127
+    weightInt8 = torch.clamp(torch.round(weight / scales[:, None]), -127, 127).to(torch.int8)
+    return weightInt8, scales
+
+
+def packWeight(weightInt8, scales, bias=None):
+    # Kernel layout: weightInt8 * scales re-quantizes to exactly weightInt8 (scales and bias are packed with it)
+    qWeight = torch.quantize_per_channel(
+        weightInt8.float() * scales[:, None], scales.double(), torch.zeros(len(scales), dtype=torch.long), 0, torch.qint8
+    )
+    return torch.ops.quantized.linear_prepack(qWeight, bias)
+
+
+'Int8 Linear Layer'
+class Int8Linear(nn.Module):
+    def __init__(self, weightInt8, scales, bias=None):
+        super().__init__()
+        self.out_features, self.in_features = weightInt8.shape
+        self.hasBias = bias is not None
+        self.packedWeight = None
+
+        if INT8_KERNEL:
+            # Weights are kept only in the kernel's packed int8 layout, the state_dict unpacks them (see below)
+            self.packedWeight = packWeight(weightInt8, scales, bias)
+        else:
+            self.register_buffer("weightInt8", weightInt8)
+            self.register_buffer("scales", scales)
+            self.register_buffer("bias", bias)
+
+    def _save_to_state_dict(self, destination, prefix, keepVars):
+        # Both paths save the same weightInt8 / scales / bias entries, so a state_dict loads with or without the kernel
+        if self.packedWeight is None:
+            return super()._save_to_state_dict(destination, prefix, keepVars)
+        qWeight, bias = torch.ops.quantized.linear_unpack(self.packedWeight)
+        destination[prefix + "weightInt8"] = qWeight.int_repr()
+        destination[prefix + "scales"] = qWeight.q_per_channel_scales().float()
+        if bias is not None:
+            destination[prefix + "bias"] = bias
+
+    def _load_from_state_dict(self, stateDict, prefix, localMetadata, strict, missingKeys, unexpectedKeys, errorMsgs):
+        if self.packedWeight is None:
+            return super()._load_from_state_dict(stateDict, prefix, localMetadata, strict, missingKeys, unexpectedKeys, errorMsgs)
+        names = ["weightInt8", "scales"] + ["bias"] * self.hasBias
+        missing = [prefix + name for name in names if prefix + name not in stateDict]
+        if missing:
+            missingKeys.extend(missing)
+            return
+        weightInt8 = stateDict[prefix + "weightInt8"]
+        if weightInt8.shape != (self.out_features, self.in_features):
+            errorMsgs.append(f"size mismatch for {prefix}weightInt8: copying a param with shape {tuple(weightInt8.shape)}, "
+                             f"the shape in current model is {(self.out_features, self.in_features)}.")
+            return
+        bias = stateDict[prefix + "bias"].float() if self.hasBias else None
+        self.packedWeight = packWeight(weightInt8, stateDict[prefix + "scales"].float(), bias)
+        if strict and not self.hasBias and prefix + "bias" in stateDict:
+            unexpectedKeys.append(prefix + "bias")
+
+    @classmethod
+    def fromLinear(cls, linear):
+        weight = linear.weight.detach().float()
+        bias = None if linear.bias is None else linear.bias.detach().float().clone()
+        return cls(*quantizePerChannel(weight), bias)
+
+    def numBytes(self):
+        # int8 weights + fp32 scales (+ fp32 bias)
+        return self.out_features * (self.in_features + 4 + 4 * self.hasBias)
+
+    def forward(self, x):
+        if self.packedWeight is not None:
+            return torch.ops.quantized.linear_dynamic(x.float(), self.packedWeight, True).to(x.dtype)
+
+        # Fallback: the per-channel scale is applied to the matmul output (same as dequantizing each row first).
+        # Only int8 is stored, but every call builds a full float copy of the weight: this path saves no memory
+        # at run time and is slower than fp32, it only keeps quantized models usable without the int8 engine
+        out = F.linear(x, self.weightInt8.to(x.dtype)) * self.scales.to(x.dtype)
+        if self.bias is not None:
+            out = out + self.bias.to(x.dtype)
+        return out
+
+    def extra_repr(self):
+        return f"in_features={self.in_features}, out_features={self.out_features}, int8 kernel={self.packedWeight is not None}"
+
+
+def quantizeModel(model):
+    # Swaps every nn.Linear of the transformer blocks and out_head for Int8Linear, in place
+    # (layer by layer, so peak RAM stays at the fp32 size). Embeddings and LayerNorms stay fp32
+    linears = [(parent, name) for parent in model.trf_blocks.modules()
+               for name, child in parent.named_children() if isinstance(child, nn.Linear)]
+    for parent, name in linears:
+        setattr(parent, name, Int8Linear.fromLinear(getattr(parent, name)))
+    model.out_head = Int8Linear.fromLinear(model.out_head)
+    return model.eval()
+
+
+def modelMegabytes(model):
+    numBytes = sum(p.numel() * p.element_size() for p in model.parameters())
+    numBytes += sum(b.numel() * b.element_size() for b in model.buffers())
+    numBytes += sum(m.numBytes() for m in model.modules() if isinstance(m, Int8Linear) and m.packedWeight is not None)
+    return numBytes / 1024**2
+
+
+@torch.no_grad()
+def calculatePerplexity(model, tokenIds):
+    # tokenIds: (batch, seqLen), next-token cross entropy over every position
+    logits = model(tokenIds[:, :-1])
+    loss = F.cross_entropy(logits.flatten(0, 1), tokenIds[:, 1:].flatten())
+    return torch.exp(loss).item(), F.log_softmax(logits, dim=-1)
+
+
+if __name__ == "__main__":
+    # Size, perplexity delta and decode speed of fp32 vs per-channel int8
+    BASE_CONFIG = {"vocab_size": 50257, "context_length": 1024, "drop_rate": 0.0, "qkv_bias": True}
+    promptLen, numNewTokens = 32, 32
+
+    for modelName in ["gpt2-small (124M)", "gpt2-medium (355M)", "gpt2-large (774M)"]:
+        cfg = {**BASE_CONFIG, **modelConfigs[modelName]}
+        torch.manual_seed(123)
+        model = GPTModel(cfg).eval()
+        prompt = torch.randint(0, cfg["vocab_size"], (1, promptLen))
+
+        # Evaluation text is sampled from the fp32 model itself (random weights have no real text to score),
+        # so the int8 increase in perplexity is pure quantization error
+        evalIds = generate(model, torch.randint(0, cfg["vocab_size"], (4, 1)), 127, cfg["context_length"],
+                           temperature=1.0, topK=50, useCache=True)
+
+        results = {}
+        for precision in ["fp32", "int8"]:
+            if precision == "int8":
+                model = quantizeModel(model)
+            startTime = time.time()
+            tokenIds = generate(model, prompt, numNewTokens, cfg["context_length"], temperature=0.0, useCache=True)
+            tokensPerSec = numNewTokens / (time.time() - startTime)
+            perplexity, logProbs = calculatePerplexity(model, evalIds)
+            results[precision] = (tokenIds, logProbs)
+            print(f"{modelName} {precision}: {modelMegabytes(model):.0f} MB, "
+                  f"perplexity {perplexity:.2f}, {tokensPerSec:.2f} tokens/sec")
+
+        fp32LogProbs, int8LogProbs = results["fp32"][1], results["int8"][1]
+        klDivergence = (fp32LogProbs.exp() * (fp32LogProbs - int8LogProbs)).sum(dim=-1).mean().item()
+        agreement = (results["fp32"][0][0, promptLen:] == results["int8"][0][0, promptLen:]).float().mean().item()
+        print(f"{modelName} KL(fp32 || int8): {klDivergence:.2e}, greedy tokens matching fp32: {agreement:.0%}")
+        del model
@@ -0,0 +1,49 @@
+import time
+import torch
+import torch.nn.functional as F
+
+from gpt_model import GPTModel, modelConfigs, generate
+from benchmark_attention import BASE_CONFIG, measurePeakMegabytes
+
+
+@torch.no_grad()
+def scoreLongDocument(model, tokenIds):
+    # Mean next-token log-likelihood of a (batch, seqLen) document in one pass, seqLen may exceed context_length
+    logits = model(tokenIds[:, :-1])
+    return -F.cross_entropy(logits.flatten(0, 1), tokenIds[:, 1:].flatten()).item()
+
+
+if __name__ == "__main__":
+    # Memory vs length of full causal attention and sliding-window attention (window 256), plus long-document
+    # scoring and generation past context_length with the rolling positions
+    cfg = {**BASE_CONFIG, **modelConfigs["gpt2-small (124M)"]}
+    window = 256
+    seqLens = [512, 1024, 2048, 4096, 8192]
+
+    # S1) Peak extra memory of one attention layer (batch 1), each in its own process. Full attention needs
+    # context_length >= seqLen and a seqLen x seqLen score matrix per head, 8192 tokens would not fit here
+    print(f"{'seqLen':>6} | {'full MB':>8} | {'sliding MB':>10}")
+    for seqLen in seqLens:
+        full = measurePeakMegabytes({**cfg, "context_length": seqLen}, False, seqLen, batchSize=1) if seqLen <= 4096 else float("nan")
+        sliding = measurePeakMegabytes({**cfg, "sliding_window": window}, False, seqLen, batchSize=1)
+        print(f"{seqLen:>6} | {full:>8.1f} | {sliding:>10.1f}")
+
+    # S2) Whole 124M model on documents longer than its 1024-token context
+    torch.manual_seed(123)
+    model = GPTModel({**cfg, "sliding_window": window}).eval()
+    for seqLen in [1024, 4096]:
+        document = torch.randint(0, cfg["vocab_size"], (1, seqLen))
+        startTime = time.time()
+        logLikelihood = scoreLongDocument(model, document)
+        print(f"Scored {seqLen} tokens in {time.time() - startTime:.2f} s (mean log-likelihood {logLikelihood:.2f})")
+
+    # S3) Decode speed stays flat with the length of the text: every step reads at most `window` cached keys
+    prompt = torch.randint(0, cfg["vocab_size"], (1, 1536))
+    numNewTokens = 32
+    stepTimes = []
+    for maxNewTokens in [1, numNewTokens + 1]:  # Time of the first token (prefill) is subtracted
+        startTime = time.time()
+        tokenIds = generate(model, prompt, maxNewTokens, cfg["context_length"], temperature=0.0, useCache=True)
+        stepTimes.append(time.time() - startTime)
+    print(f"Generated past context_length ({tokenIds.shape[1]} tokens total): "
+          f"{numNewTokens / (stepTimes[1] - stepTimes[0]):.2f} tokens/sec")
@@ -0,0 +1,132 @@
+import time
+import torch
+
+from gpt_model import GPTModel, modelConfigs, generate, nextTokenLogits, nextTokenProbs, sampleNextToken
+
+
+def cachedLogits(model, idx, numLogits):
+    # Feeds every token of idx the model has not cached yet and returns the logits of the last numLogits positions
+    logits = model(idx[:, model.currentPos:], useCache=True, lastLogitsOnly=numLogits)
+    return logits[0]  # (numLogits, vocabSize)
+
+
+def verifyDraft(targetProbs, draftIds, draftProbs):
+    """
+    Speculative sampling accept/reject rule, the accepted tokens follow the target distribution exactly.
+
+    Args:
+        targetProbs: (k+1, vocabSize) target probabilities after the context and after each draft token
+        draftIds: list of k draft token ids
+        draftProbs: (k, vocabSize) probabilities the draft tokens were sampled from
+    Returns the new tokens: the accepted draft prefix plus one token sampled from the target
+    """
+    newIds = []
+    for i, draftId in enumerate(draftIds):
+        p, q = targetProbs[i, draftId], draftProbs[i, draftId]
+        # Accept with probability min(1, p/q), strict so that a token with p == 0 is never accepted (rand can be 0)
+        if torch.rand(1).item() * q < p:
+            newIds.append(draftId)
+            continue
+        # Rejected: resample from the part of the target distribution the draft under-covers, norm(max(0, p - q))
+        residual = torch.clamp(targetProbs[i] - draftProbs[i], min=0.0)
+        newIds.append(torch.multinomial(residual / residual.sum(), num_samples=1).item())
+        return newIds
+
+    # Every draft token accepted: the last target position gives one bonus token for free
+    newIds.append(torch.multinomial(targetProbs[-1], num_samples=1).item())
+    return newIds
+
+
+@torch.no_grad()
+def speculativeGenerate(targetModel, draftModel, idx, maxNewTokens, contextSize, numDraftTokens=4,
+                        temperature=1.0, topK=None, eosId=None):
+    """
+    Generate with a small draft model proposing numDraftTokens tokens and the large target model
+    checking all of them in one cached forward pass.
+    Same arguments as generate() (batch size 1), returns (idx, stats).
+    """
+    draftContext = draftModel.positionalEmbeddings.weight.shape[0]
+    stats = {"draftedTokens": 0, "acceptedTokens": 0, "targetCalls": 0}
+    targetModel.resetCache()
+    draftModel.resetCache()
+
+    numGenerated = 0
+    while numGenerated < maxNewTokens:
+        # Both caches hold the sequence minus its last token, drafting must stay inside the target window
+        numDraft = min(numDraftTokens, contextSize - idx.shape[1], maxNewTokens - numGenerated - 1)
+        if numDraft <= 0:
+            # Window is full (or one token left): plain step, the cropped window is prefilled again like generate()
+            nextId = sampleNextToken(nextTokenLogits(targetModel, idx, contextSize, useCache=False), temperature, topK)
+            stats["targetCalls"] += 1
+            newIds = [nextId.item()]
+        else:
+            # S1) Draft k tokens one by one, the draft rolls its own window if its context is shorter
+            draftRolled = idx.shape[1] + numDraft - 1 > draftContext
+            if draftRolled:
+                draftModel.resetCache()
+                draftIdx = idx[:, -(draftContext - numDraft + 1):]
+            else:
+                draftIdx = idx
+            draftIds, draftProbs = [], []
+            for _ in range(numDraft):
+                probs = nextTokenProbs(cachedLogits(draftModel, draftIdx, 1), temperature, topK)
+                nextId = torch.multinomial(probs, num_samples=1)
+                draftIds.append(nextId.item())
+                draftProbs.append(probs[0])
+                draftIdx = torch.cat((draftIdx, nextId), dim=1)
+
+            # S2) Target scores the context and all draft tokens in a single forward pass
+            candidateIdx = torch.cat((idx, torch.tensor([draftIds], device=idx.device)), dim=1)
+            targetProbs = nextTokenProbs(cachedLogits(targetModel, candidateIdx, numDraft + 1), temperature, topK)
+            stats["targetCalls"] += 1
+
+            # S3) Accept/reject, then roll both caches back to the accepted sequence minus its last token
+            newIds = verifyDraft(targetProbs, draftIds, torch.stack(draftProbs))
+            stats["draftedTokens"] += numDraft
+            stats["acceptedTokens"] += len(newIds) - 1
+            keepLen = idx.shape[1] + len(newIds) - 1
+            targetModel.truncateCache(keepLen)
+            if draftRolled:
+                draftModel.resetCache()  # Cropped window no longer lines up with the sequence, prefilled again next round
+            else:
+                draftModel.truncateCache(min(draftModel.currentPos, keepLen))
+
+        # Append new tokens, stop at EOS
+        if eosId is not None and eosId in newIds:
+            newIds = newIds[:newIds.index(eosId) + 1]
+        idx = torch.cat((idx, torch.tensor([newIds], device=idx.device)), dim=1)
+        numGenerated += len(newIds)
+        if eosId is not None and newIds[-1] == eosId:
+            break
+
+    targetModel.resetCache()
+    draftModel.resetCache()
+    return idx, stats
+
+
+if __name__ == "__main__":
+    # Acceptance rate and speedup of a 124M draft in front of a 774M target
+    BASE_CONFIG = {"vocab_size": 50257, "context_length": 1024, "drop_rate": 0.0, "qkv_bias": True}
+    torch.manual_seed(123)
+    targetModel = GPTModel({**BASE_CONFIG, **modelConfigs["gpt2-large (774M)"]}).eval()
+    draftModel = GPTModel({**BASE_CONFIG, **modelConfigs["gpt2-small (124M)"]}).eval()
+    # Random weights rarely agree with each other, load the released GPT-2 params (loadWeights) for real acceptance rates
+    prompt = torch.randint(0, BASE_CONFIG["vocab_size"], (1, 32))
+    numNewTokens = 48
+
+    for temperature, topK in [(0.0, None), (1.0, 50)]:
+        startTime = time.time()
+        baseline = generate(targetModel, prompt, numNewTokens, BASE_CONFIG["context_length"], temperature, topK, useCache=True)
+        baselineTime = time.time() - startTime
+        print(f"temperature={temperature} topK={topK} | generate(): {numNewTokens / baselineTime:.2f} tokens/sec")
+
+        for numDraftTokens in [2, 4]:
+            startTime = time.time()
+            tokenIds, stats = speculativeGenerate(targetModel, draftModel, prompt, numNewTokens, BASE_CONFIG["context_length"],
+                                                  numDraftTokens, temperature, topK)
+            speculativeTime = time.time() - startTime
+            print(f"  k={numDraftTokens}: acceptance rate {stats['acceptedTokens'] / stats['draftedTokens']:.2%}, "
+                  f"{numNewTokens / stats['targetCalls']:.2f} tokens per target pass, "
+                  f"{numNewTokens / speculativeTime:.2f} tokens/sec, speedup {baselineTime / speculativeTime:.2f}x")
+            if temperature == 0.0:
+                print("  Same greedy tokens as generate():", torch.equal(tokenIds, baseline))
@@ -0,0 +1,126 @@
+import asyncio
+import codecs
+import threading
+import time
+import tiktoken
+import torch
+
+from gpt_model import GPTModel, modelConfigs, generate, nextTokenLogits, sampleNextToken, textToTokenId, tokenIdtoText
+
+
+'Incremental Detokenizer'
+class IncrementalDetokenizer:
+    """
+    Turns token ids into text one token at a time. A GPT-2 token is a byte sequence that can end
+    in the middle of a UTF-8 character (emoji, accented letters), so bytes are buffered by an
+    incremental UTF-8 decoder and only complete characters are returned.
+    """
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def tokenBytes(self, tokenId):
+        if hasattr(self.tokenizer, "decode_single_token_bytes"):  # tiktoken
+            return self.tokenizer.decode_single_token_bytes(tokenId)
+        return self.tokenizer.decode([tokenId]).encode("utf-8")
+
+    def push(self, tokenId):
+        # Text completed by this token ("" while a character is still incomplete)
+        return self.decoder.decode(self.tokenBytes(tokenId))
+
+    def flush(self):
+        # Leftover bytes of an unfinished character at the end of the stream become U+FFFD, like tokenizer.decode
+        return self.decoder.decode(b"", final=True)
+
+
+@torch.no_grad()
+def streamGenerate(model, idx, maxNewTokens, contextSize, tokenizer, temperature=1.0, topK=None, eosId=None,
+                   useCache=True, stopEvent=None):
+    """
+    Same sampling as generate() (batch size 1), but yields text deltas as soon as they are decoded.
+    Cancel by closing the generator (or breaking out of the loop) or by setting stopEvent (threading.Event),
+    the KV cache is released either way. The EOS token ends the stream and is not yielded.
+    """
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    model.resetCache()
+    try:
+        for _ in range(maxNewTokens):
+            if stopEvent is not None and stopEvent.is_set():
+                break
+            logits = nextTokenLogits(model, idx, contextSize, useCache)
+            nextId = sampleNextToken(logits, temperature, topK)
+            idx = torch.cat((idx, nextId), dim=1)
+            if eosId is not None and nextId.item() == eosId:
+                break
+
+            delta = detokenizer.push(nextId.item())
+            if delta:
+                yield delta
+
+        tail = detokenizer.flush()
+        if tail:
+            yield tail
+    finally:
+        model.resetCache()
+
+
+async def streamGenerateAsync(model, idx, maxNewTokens, contextSize, tokenizer, temperature=1.0, topK=None, eosId=None,
+                              useCache=True):
+    """
+    Async iterator over streamGenerate: every model step runs in a worker thread so the event loop
+    (e.g. a chat server) keeps serving while tokens are produced. Cancelling the consuming task or
+    calling aclose() stops generation after the step in flight.
+    """
+    stopEvent = threading.Event()
+    generator = streamGenerate(model, idx, maxNewTokens, contextSize, tokenizer, temperature, topK, eosId,
+                               useCache, stopEvent)
+    step = None
+    try:
+        while True:
+            step = asyncio.ensure_future(asyncio.to_thread(next, generator, None))
+            delta = await asyncio.shield(step)  # A cancelled consumer must not abandon the running step
+            if delta is None:
+                break
+            yield delta
+    finally:
+        stopEvent.set()
+        if step is not None and not step.done():
+            await asyncio.wait([step])  # The model is still inside a step, wait before releasing its cache
+        generator.close()
+
+
+if __name__ == "__main__":
+    # Time to first token: streamGenerate shows text after one step, generate() only after every step
+    BASE_CONFIG = {"vocab_size": 50257, "context_length": 1024, "drop_rate": 0.0, "qkv_bias": True}
+    cfg = {**BASE_CONFIG, **modelConfigs["gpt2-small (124M)"]}
+    torch.manual_seed(123)
+    model = GPTModel(cfg).eval()
+    tokenizer = tiktoken.get_encoding("gpt2")
+    prompt = textToTokenId("Every effort moves you", tokenizer)
+    numNewTokens = 64
+
+    startTime = time.time()
+    tokenIds = generate(model, prompt, numNewTokens, cfg["context_length"], temperature=0.0, useCache=True)
+    print(f"generate(): first text after {(time.time() - startTime) * 1000:.0f} ms (whole sequence)")
+
+    startTime, firstTokenTime, text = time.time(), None, ""
+    for delta in streamGenerate(model, prompt, numNewTokens, cfg["context_length"], tokenizer, temperature=0.0):
+        firstTokenTime = firstTokenTime or time.time() - startTime
+        text += delta
+    print(f"streamGenerate(): first text after {firstTokenTime * 1000:.0f} ms, "
+          f"total {(time.time() - startTime) * 1000:.0f} ms")
+    print("Streamed text equals tokenIdtoText:", text == tokenIdtoText(tokenIds[:, prompt.shape[1]:], tokenizer))
+
+    async def cancelAfter(numDeltas):
+        # A chat client going away mid-answer: the stream stops and the cache is released
+        deltas = []
+        stream = streamGenerateAsync(model, prompt, numNewTokens, cfg["context_length"], tokenizer, temperature=0.0)
+        async for delta in stream:
+            deltas.append(delta)
+            if len(deltas) == numDeltas:
+                break
+        await stream.aclose()
+        return deltas
+
+    deltas = asyncio.run(cancelAfter(5))
+    print(f"Async stream cancelled after {len(deltas)} deltas, cache released: {model.currentPos == 0}")
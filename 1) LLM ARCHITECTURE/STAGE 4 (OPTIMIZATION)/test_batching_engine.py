@@ -0,0 +1,27 @@
+import pytest
+import torch
+
+from batching_engine import ContinuousBatchingEngine, GenerationRequest
+from gpt_model import GPTModel, generate
+
+SMALL_CONFIG = {"vocab_size": 97, "context_length": 48, "emb_dim": 32, "n_layers": 2, "n_heads": 4,
+                "drop_rate": 0.0, "qkv_bias": True}
+
+
+@torch.no_grad()
+def test_engine_matches_generate_and_rejects_bad_requests():
+    torch.manual_seed(123)
+    model = GPTModel(SMALL_CONFIG).eval()
+    engine = ContinuousBatchingEngine(model, maxSlots=2)
+    with pytest.raises(ValueError, match="at least one token"):
+        engine.submit(GenerationRequest([], 3))
+    with pytest.raises(ValueError, match="maxNewTokens"):
+        engine.submit(GenerationRequest([1, 2], 0))
+
+    # Rejected requests never reach the batch, the others are served as usual
+    prompts, maxNewTokens = [[5, 6, 7], [8], [9, 10, 11, 12]], [4, 7, 2]
+    requests = [engine.submit(GenerationRequest(p, n, temperature=0.0)) for p, n in zip(prompts, maxNewTokens)]
+    engine.run()
+    for request, prompt, newTokens in zip(requests, prompts, maxNewTokens):
+        expected = generate(model, torch.tensor([prompt]), newTokens, SMALL_CONFIG["context_length"], temperature=0.0)
+        assert request.outputIds == expected[0, len(prompt):].tolist() and request.finishReason == "length"
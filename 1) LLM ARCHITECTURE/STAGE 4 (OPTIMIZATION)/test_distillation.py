@@ -0,0 +1,21 @@
+import torch
+
+from distillation import cacheTeacherLogits, rowKey
+from gpt_model import GPTModel
+
+SMALL_CONFIG = {"vocab_size": 97, "context_length": 16, "emb_dim": 32, "n_layers": 2, "n_heads": 4,
+                "drop_rate": 0.0, "qkv_bias": False}
+
+
+@torch.no_grad()
+def test_cached_top_k_matches_full_logits():
+    torch.manual_seed(123)
+    teacher = GPTModel(SMALL_CONFIG)
+    inputs = torch.randint(0, SMALL_CONFIG["vocab_size"], (6, 16))
+    cache = cacheTeacherLogits(teacher, [(inputs[:3], None), (inputs[3:], None)], "cpu", topK=5, teacherBatchSize=4)
+    assert isinstance(teacher.out_head, torch.nn.Linear)  # Restored after the hidden-state pass
+    values, indices = torch.topk(teacher(inputs), 5, dim=-1)
+    for i, row in enumerate(inputs):
+        cachedValues, cachedIndices = cache[rowKey(row)]
+        torch.testing.assert_close(cachedValues, values[i].half())
+        assert torch.equal(cachedIndices, indices[i].int())
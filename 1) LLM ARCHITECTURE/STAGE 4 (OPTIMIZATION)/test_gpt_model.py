@@ -0,0 +1,150 @@
+import pytest
+import torch
+
+import gpt_model
+from benchmark_attention import randomGpt2Params
+from gpt_model import GPTModel, generate, loadWeights
+
+SMALL_CONFIG = {"vocab_size": 97, "context_length": 48, "emb_dim": 32, "n_layers": 2, "n_heads": 4,
+                "drop_rate": 0.0, "qkv_bias": True}
+
+
+def buildModel(params=None, **options):
+    # Same GPT-2 style params through loadWeights, or seeded random init when params is None
+    torch.manual_seed(123)
+    model = GPTModel({**SMALL_CONFIG, **options})
+    if params is not None:
+        loadWeights(model, params)
+    return model.eval()
+
+
+def incrementalLogits(model, idx, numPrefill):
+    # Prefill numPrefill tokens into the KV cache, then feed the rest one token at a time
+    model.resetCache()
+    logits = [model(idx[:, :numPrefill], useCache=True)]
+    for pos in range(numPrefill, idx.shape[1]):
+        logits.append(model(idx[:, pos:pos + 1], useCache=True))
+    model.resetCache()
+    return torch.cat(logits, dim=1)
+
+
+@torch.no_grad()
+def test_fused_matches_unfused():
+    params = randomGpt2Params(SMALL_CONFIG)
+    unfused, fused = buildModel(params, fused_qkv=False), buildModel(params, fused_qkv=True)
+    idx = torch.randint(0, SMALL_CONFIG["vocab_size"], (2, 40))
+    torch.testing.assert_close(fused(idx), unfused(idx), rtol=1e-4, atol=1e-5)
+    prompt = idx[:1, :8]
+    assert torch.equal(generate(fused, prompt, 20, SMALL_CONFIG["context_length"], temperature=0.0),
+                       generate(unfused, prompt, 20, SMALL_CONFIG["context_length"], temperature=0.0))
+
+
+@pytest.mark.parametrize("fusedQkv", [False, True])
+@torch.no_grad()
+def test_kv_cache_matches_full_forward(fusedQkv):
+    model = buildModel(randomGpt2Params(SMALL_CONFIG), fused_qkv=fusedQkv)
+    idx = torch.randint(0, SMALL_CONFIG["vocab_size"], (2, 30))
+    torch.testing.assert_close(incrementalLogits(model, idx, 10), model(idx), rtol=1e-4, atol=1e-5)
+    # Generating past context_length re-prefills the cropped window
+    prompt = idx[:1, :8]
+    assert torch.equal(generate(model, prompt, 60, SMALL_CONFIG["context_length"], temperature=0.0, useCache=True),
+                       generate(model, prompt, 60, SMALL_CONFIG["context_length"], temperature=0.0))
+
+
+def repeatHeads(tensor, numKvHeads, groupSize):
+    # (numKvHeads*head_dim, ...) -> (numKvHeads*groupSize*head_dim, ...), each K/V head copied for its query heads
+    grouped = tensor.reshape(numKvHeads, -1, *tensor.shape[1:])
+    return grouped.repeat_interleave(groupSize, dim=0).reshape(-1, *tensor.shape[1:])
+
+
+@pytest.mark.parametrize("fusedQkv", [False, True])
+@pytest.mark.parametrize("sdpaEnableGqa", [False, True])
+@torch.no_grad()
+def test_grouped_query_matches_repeated_heads(monkeypatch, fusedQkv, sdpaEnableGqa):
+    # A GQA model equals a multi-head model whose K/V heads are copies of the shared group heads
+    monkeypatch.setattr(gpt_model, "SDPA_ENABLE_GQA", sdpaEnableGqa)  # False --> the torch < 2.5 path
+    numHeads, numKvHeads, embDim = SMALL_CONFIG["n_heads"], 2, SMALL_CONFIG["emb_dim"]
+    grouped = buildModel(fused_qkv=fusedQkv, n_kv_heads=numKvHeads)
+    stateDict = grouped.state_dict()
+    for b in range(SMALL_CONFIG["n_layers"]):
+        prefix = f"trf_blocks.{b}.attention."
+        if fusedQkv:
+            for name in ["W_qkv.weight", "W_qkv.bias"]:
+                queries, keys, values = stateDict[prefix + name].split([embDim, embDim // 2, embDim // 2])
+                stateDict[prefix + name] = torch.cat([queries, repeatHeads(keys, numKvHeads, 2), repeatHeads(values, numKvHeads, 2)])
+        else:
+            for name in ["W_key.weight", "W_key.bias", "W_value.weight", "W_value.bias"]:
+                stateDict[prefix + name] = repeatHeads(stateDict[prefix + name], numKvHeads, 2)
+    multiHead = buildModel(fused_qkv=fusedQkv, n_kv_heads=numHeads)
+    multiHead.load_state_dict(stateDict)
+
+    idx = torch.randint(0, SMALL_CONFIG["vocab_size"], (2, 30))
+    torch.testing.assert_close(grouped(idx), multiHead(idx), rtol=1e-4, atol=1e-5)
+    torch.testing.assert_close(incrementalLogits(grouped, idx, 10), grouped(idx), rtol=1e-4, atol=1e-5)
+
+
+def bandedReference(attention, x, window):
+    # Plain softmax attention of one MultiHeadAttention layer with an explicit sliding-window band mask
+    b, numTokens, _ = x.shape
+    split = lambda t: t.view(b, numTokens, attention.num_heads, attention.head_dim).transpose(1, 2)
+    queries, keys, values = split(attention.W_query(x)), split(attention.W_key(x)), split(attention.W_value(x))
+    positions = torch.arange(numTokens)
+    visible = (positions.view(1, -1) <= positions.view(-1, 1)) & (positions.view(1, -1) > positions.view(-1, 1) - window)
+    scores = (queries @ keys.transpose(2, 3) / attention.head_dim ** 0.5).masked_fill(~visible, -torch.inf)
+    context = (torch.softmax(scores, dim=-1) @ values).transpose(1, 2).reshape(b, numTokens, -1)
+    return attention.out_proj(context)
+
+
+@torch.no_grad()
+def test_sliding_window_attention():
+    params = randomGpt2Params(SMALL_CONFIG)
+    idx = torch.randint(0, SMALL_CONFIG["vocab_size"], (2, 40))
+    # A window covering the whole input is plain causal attention
+    torch.testing.assert_close(buildModel(params, sliding_window=64)(idx), buildModel(params)(idx), rtol=1e-4, atol=1e-5)
+
+    windowed = buildModel(params, sliding_window=8)
+    attention = windowed.trf_blocks[0].attention
+    x = torch.randn(2, 40, SMALL_CONFIG["emb_dim"])
+    torch.testing.assert_close(attention(x), bandedReference(attention, x, 8), rtol=1e-4, atol=1e-5)
+
+    # Fused path, ring-buffer KV cache and inputs longer than context_length
+    longIdx = torch.randint(0, SMALL_CONFIG["vocab_size"], (2, 100))
+    fusedWindowed = buildModel(params, sliding_window=8, fused_qkv=True)
+    torch.testing.assert_close(fusedWindowed(longIdx), windowed(longIdx), rtol=1e-4, atol=1e-5)
+    for model in [windowed, fusedWindowed]:
+        torch.testing.assert_close(incrementalLogits(model, longIdx, 13), model(longIdx), rtol=1e-4, atol=1e-5)
+
+
+def trainingGradients(options, idx):
+    # One training step with dropout on, same seed for init and for the dropout masks
+    torch.manual_seed(123)
+    model = GPTModel({**SMALL_CONFIG, "n_layers": 4, "drop_rate": 0.1, **options}).train()
+    logits = model(idx[:, :-1])
+    torch.nn.functional.cross_entropy(logits.flatten(0, 1), idx[:, 1:].flatten()).backward()
+    return model, torch.cat([p.grad.flatten() for p in model.parameters()])
+
+
+def test_activation_checkpointing_gradients():
+    idx = torch.randint(0, SMALL_CONFIG["vocab_size"], (2, 41))
+    _, reference = trainingGradients({}, idx)
+    for options, numCheckpointed in [({"checkpoint_every": 1}, 4), ({"checkpoint_every": 2}, 2),
+                                     ({"checkpoint_budget_mb": 1e-3}, 4)]:
+        model, gradients = trainingGradients(options, idx)
+        assert len(model.checkpointedBlocks(2, 40)) == numCheckpointed
+        assert torch.equal(gradients, reference)
+
+
+def test_checkpoint_budget_picks_more_blocks_as_it_shrinks():
+    model = GPTModel({**SMALL_CONFIG, "n_layers": 4, "checkpoint_budget_mb": 1e3})
+    assert model.checkpointedBlocks(2, 40) == set()  # Everything fits, the cost is measured on first use
+    perCall, perToken, perTokenSquared = model.activationCost
+    assert perCall >= 0 and perToken > 0 and perTokenSquared > 0
+    allBlocksMb = 4 * (perCall + 2 * (perToken * 40 + perTokenSquared * 40 ** 2)) / 1024**2  # Every block stored, batch 2
+    counts = []
+    for fraction in [1.0, 0.9, 0.8, 0.7, 0.6, 0.5, 1e-3]:
+        model.checkpointBudgetMb = fraction * allBlocksMb
+        counts.append(len(model.checkpointedBlocks(2, 40)))
+    assert counts == sorted(counts) and counts[0] == 0 and counts[-1] == 4 and len(set(counts)) > 2
+    # Longer inputs need more checkpointed blocks under the same budget
+    model.checkpointBudgetMb = 0.7 * allBlocksMb
+    assert len(model.checkpointedBlocks(2, 20)) < len(model.checkpointedBlocks(2, 40)) <= len(model.checkpointedBlocks(2, 48))
@@ -0,0 +1,23 @@
+import copy
+import torch
+
+from gpt_model import GPTModel, generate
+from inference_optimization import FusedLayerNorm, optimizeForInference
+
+SMALL_CONFIG = {"vocab_size": 97, "context_length": 48, "emb_dim": 32, "n_layers": 2, "n_heads": 4,
+                "drop_rate": 0.0, "qkv_bias": True}
+
+
+def test_optimized_build_matches_educational_model():
+    torch.manual_seed(123)
+    model = GPTModel(SMALL_CONFIG).eval()
+    optimized = optimizeForInference(copy.deepcopy(model), compile=False)
+    assert isinstance(optimized.finalNormalization, FusedLayerNorm)
+    assert all(block.attention.fused_qkv for block in optimized.trf_blocks)
+
+    idx = torch.randint(0, SMALL_CONFIG["vocab_size"], (2, 20))
+    with torch.no_grad():
+        torch.testing.assert_close(optimized(idx), model(idx), rtol=1e-4, atol=1e-5)
+    prompt = idx[:1, :8]
+    assert torch.equal(generate(optimized, prompt, 20, SMALL_CONFIG["context_length"], temperature=0.0, useCache=True),
+                       generate(model, prompt, 20, SMALL_CONFIG["context_length"], temperature=0.0))
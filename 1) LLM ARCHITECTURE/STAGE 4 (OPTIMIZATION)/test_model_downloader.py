@@ -0,0 +1,111 @@
+import os
+import time
+import pytest
+
+from model_downloader import RangeRequestHandler, downloadFiles, fileSha256, startStandInServer, writeManifest
+
+FILE_SIZES = {"small.json": 90, "medium.bin": 300_000, "large.bin": 3_000_000}
+
+
+@pytest.fixture
+def standIn(tmp_path):
+    # Random files behind the local stand-in server + their manifest, counters reset per test
+    serverDir, clientDir = tmp_path / "server", tmp_path / "client"
+    os.makedirs(serverDir)
+    for name, size in FILE_SIZES.items():
+        with open(serverDir / name, "wb") as file:
+            file.write(os.urandom(size))
+    RangeRequestHandler.failAfter, RangeRequestHandler.bytesServed = {}, 0
+    RangeRequestHandler.active, RangeRequestHandler.maxActive = 0, 0
+    manifest = writeManifest(str(serverDir), list(FILE_SIZES), str(serverDir / "manifest.json"))
+    servers = []
+
+    def start(handlerClass=RangeRequestHandler):
+        server, baseUrl = startStandInServer(str(serverDir), handlerClass)
+        servers.append(server)
+        return baseUrl
+
+    yield start, str(clientDir), manifest
+    for server in servers:
+        server.shutdown()
+
+
+def matches(directory, manifest):
+    return all(fileSha256(os.path.join(directory, name)) == manifest[name]["sha256"] for name in manifest)
+
+
+def test_concurrent_download(standIn):
+    class SlowHandler(RangeRequestHandler):
+        def sendFile(self):
+            time.sleep(0.3)
+            super().sendFile()
+
+    start, clientDir, manifest = standIn
+    baseUrl = start(SlowHandler)
+    startTime = time.time()
+    transferred = downloadFiles(baseUrl, list(FILE_SIZES), clientDir, manifest, maxWorkers=3)
+    assert time.time() - startTime < 0.3 * len(FILE_SIZES)
+    assert RangeRequestHandler.maxActive > 1
+    assert transferred == FILE_SIZES and matches(clientDir, manifest)
+    assert sum(downloadFiles(baseUrl, list(FILE_SIZES), clientDir, manifest).values()) == 0  # Re-run: HEAD only
+
+
+def test_dropped_connection_resumes(standIn):
+    start, clientDir, manifest = standIn
+    baseUrl = start()
+    RangeRequestHandler.failAfter["large.bin"] = 2_500_000
+    with pytest.raises(RuntimeError):
+        downloadFiles(baseUrl, list(FILE_SIZES), clientDir, manifest)
+    assert not os.path.exists(os.path.join(clientDir, "large.bin"))
+    partSize = os.path.getsize(os.path.join(clientDir, "large.bin.part"))  # Whole 1 MB buffers received before the drop
+    assert 0 < partSize <= 2_500_000
+    transferred = downloadFiles(baseUrl, list(FILE_SIZES), clientDir, manifest)
+    assert transferred["large.bin"] == 3_000_000 - partSize
+    assert matches(clientDir, manifest)
+
+
+def test_short_response_without_error_is_kept(standIn):
+    # The body ends early but matches its Content-Length (no error on the client side): the .part is not deleted
+    class ShortBodyHandler(RangeRequestHandler):
+        def sendFile(self):
+            if os.path.basename(self.path) != "large.bin" or self.headers.get("Range"):
+                return super().sendFile()
+            self.send_response(200)
+            self.send_header("Content-Length", "1000000")
+            self.end_headers()
+            with open(self.translate_path(self.path), "rb") as file:
+                self.wfile.write(file.read(1_000_000))
+
+    start, clientDir, manifest = standIn
+    baseUrl = start(ShortBodyHandler)
+    with pytest.raises(RuntimeError, match="incomplete"):
+        downloadFiles(baseUrl, ["large.bin"], clientDir, manifest)
+    assert os.path.getsize(os.path.join(clientDir, "large.bin.part")) == 1_000_000
+    assert downloadFiles(baseUrl, ["large.bin"], clientDir, manifest)["large.bin"] == 2_000_000
+    assert matches(clientDir, {"large.bin": manifest["large.bin"]})
+
+
+def test_checksum_failure_removes_part(standIn):
+    start, clientDir, manifest = standIn
+    baseUrl = start()
+    badManifest = {**manifest, "medium.bin": {**manifest["medium.bin"], "sha256": "0" * 64}}
+    with pytest.raises(RuntimeError, match="sha256"):
+        downloadFiles(baseUrl, list(FILE_SIZES), clientDir, badManifest)
+    assert [name for name in os.listdir(clientDir) if name.startswith("medium.bin")] == []
+    assert matches(clientDir, {name: manifest[name] for name in ["small.json", "large.bin"]})
+
+
+def test_unknown_size_does_not_append(standIn):
+    # No Content-Length on HEAD: a stale .part must be overwritten, not appended to
+    class NoLengthHandler(RangeRequestHandler):
+        def send_header(self, keyword, value):
+            if not (self.command == "HEAD" and keyword == "Content-Length"):
+                super().send_header(keyword, value)
+
+    start, clientDir, manifest = standIn
+    baseUrl = start(NoLengthHandler)
+    os.makedirs(clientDir)
+    with open(os.path.join(clientDir, "medium.bin.part"), "wb") as file:
+        file.write(b"x" * 1000)
+    downloadFiles(baseUrl, ["medium.bin"], clientDir)
+    assert matches(clientDir, {"medium.bin": manifest["medium.bin"]})
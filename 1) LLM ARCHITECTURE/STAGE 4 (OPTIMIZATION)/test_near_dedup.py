@@ -0,0 +1,44 @@
+import json
+import numpy as np
+
+from near_dedup import deduplicateCorpus, documentUnits, findRoot, joinBucket
+
+
+def test_join_bucket_compares_against_every_cluster():
+    # Units 1 and 2 agree on 7/8 permutations with each other, on none with unit 0 (the bucket's first unit)
+    signatures = np.array([[0] * 8, [1] * 8, [1] * 7 + [2], [0] * 7 + [3]], dtype=np.uint32)
+    parent = np.arange(4)
+    numPairs = joinBucket(parent, signatures, np.arange(4), threshold=0.8)
+    assert [findRoot(parent, unit) for unit in range(4)] == [0, 1, 1, 0]
+    assert numPairs == 2 * 3  # Two representatives (units 0 and 1), each compared with the 3 other units
+
+    # Unit 2 is close only to unit 1, which already joined unit 0's cluster: still one cluster
+    signatures = np.array([[0] * 10, [0] * 8 + [1] * 2, [0] * 6 + [1] * 4], dtype=np.uint32)
+    parent = np.arange(3)
+    joinBucket(parent, signatures, np.arange(3), threshold=0.8)
+    assert [findRoot(parent, unit) for unit in range(3)] == [0, 0, 0]
+
+
+def test_deduplicate_generated_corpus(tmp_path):
+    # 10 base paragraphs of 200 words, each with 3 later copies (exact, first word changed, last word changed, all
+    # >= 0.9 Jaccard), mixed with 30 unique paragraphs, over a .jsonl and a .txt file
+    generator = np.random.RandomState(0)
+    randomText = lambda: " ".join(f"w{n}" for n in generator.randint(0, 5000, 200))
+    bases = [randomText() for _ in range(10)]
+    copies = [base for base in bases] + [base.replace(base.split()[0], "changed", 1) for base in bases] + \
+             [base.rsplit(" ", 1)[0] + " changed" for base in bases]
+    uniques = [randomText() for _ in range(30)]
+    inputDir, outputDir = tmp_path / "input", tmp_path / "output"
+    (inputDir / "web").mkdir(parents=True)
+    (inputDir / "book.txt").write_text("\n\n".join(bases + uniques[:15] + copies[:15]), encoding="utf-8")  # Units 0-39
+    with open(inputDir / "web" / "pages.jsonl", "w", encoding="utf-8") as file:
+        file.writelines(json.dumps({"text": text, "id": idx}) + "\n" for idx, text in enumerate(uniques[15:] + copies[15:]))
+
+    stats = deduplicateCorpus(str(inputDir), str(outputDir), numWorkers=1)
+    kept = [text for path in [outputDir / "book.txt", outputDir / "web" / "pages.jsonl"] for text in documentUnits(str(path))]
+    assert sorted(kept) == sorted(bases + uniques)  # The earliest unit of every cluster is kept
+    assert stats["units"] == 70 and stats["removed_units"] == 30 and stats["duplicate_clusters"] == 10
+    assert stats["cluster_size_histogram"] == {4: 10}
+    # .jsonl records are copied unchanged, other fields included
+    with open(outputDir / "web" / "pages.jsonl", encoding="utf-8") as file:
+        assert [json.loads(line)["id"] for line in file] == list(range(15))
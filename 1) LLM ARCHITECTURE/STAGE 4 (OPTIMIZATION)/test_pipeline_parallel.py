@@ -0,0 +1,50 @@
+import pytest
+import torch
+
+from gpt_model import GPTModel
+from pipeline_parallel import PipelineGPT, saveCheckpoint
+
+SMALL_CONFIG = {"vocab_size": 97, "context_length": 32, "emb_dim": 32, "n_layers": 4, "n_heads": 4,
+                "drop_rate": 0.0, "qkv_bias": True}
+
+
+@pytest.fixture
+def checkpointPath(tmp_path):
+    torch.manual_seed(123)
+    model = GPTModel(SMALL_CONFIG).eval()
+    path = str(tmp_path / "model.pt")
+    saveCheckpoint(model, path)
+    return model, path
+
+
+@torch.no_grad()
+def test_pipeline_matches_model(checkpointPath):
+    model, path = checkpointPath
+    idx = torch.randint(0, SMALL_CONFIG["vocab_size"], (4, 10))
+    pipeline = PipelineGPT(SMALL_CONFIG, path, numStages=2, numThreads=1)
+    try:
+        torch.testing.assert_close(pipeline(idx, numMicrobatches=2), model(idx), rtol=1e-4, atol=1e-5)
+    finally:
+        assert [(start, end) for start, end, _ in pipeline.close()] == [(0, 2), (2, 4)]
+
+
+def test_dead_stage_raises_on_load(checkpointPath, tmp_path):
+    # Stage 1 cannot find its blocks in the checkpoint: the constructor reports it instead of waiting forever
+    _, path = checkpointPath
+    stateDict = torch.load(path)
+    brokenPath = str(tmp_path / "broken.pt")
+    torch.save({name: tensor for name, tensor in stateDict.items() if not name.startswith("trf_blocks.3.")}, brokenPath)
+    with pytest.raises(RuntimeError, match=r"stage 1 \(blocks 2-3\) exited with code 1"):
+        PipelineGPT(SMALL_CONFIG, brokenPath, numStages=2, numThreads=1)
+
+
+def test_dead_stage_raises_on_forward(checkpointPath):
+    _, path = checkpointPath
+    pipeline = PipelineGPT(SMALL_CONFIG, path, numStages=2, numThreads=1)
+    pipeline.processes[0].kill()
+    pipeline.processes[0].join()
+    with pytest.raises(RuntimeError, match="stage 0 .* exited with code -9"):
+        pipeline(torch.randint(0, SMALL_CONFIG["vocab_size"], (1, 5)))
+    for process in pipeline.processes:
+        process.join(timeout=10)
+        assert process.exitcode is not None  # The other stages are stopped too
@@ -0,0 +1,45 @@
+import torch
+
+from gpt_model import GPTModel, generate
+from prefix_cache import PrefixCache, generateWithPrefixCache
+
+SMALL_CONFIG = {"vocab_size": 97, "context_length": 48, "emb_dim": 32, "n_layers": 2, "n_heads": 4,
+                "drop_rate": 0.0, "qkv_bias": True}
+
+
+def fakeLayerCache(numTokens, fill=0.0):
+    # (n_layers, 2, num_heads, numTokens, head_dim) fp32 → 4 * 2 * 1 * numTokens * 1 * 4 = 32 bytes per token
+    return torch.full((4, 2, 1, numTokens, 1), fill)
+
+
+def test_lru_eviction_stays_within_budget():
+    cache = PrefixCache(maxBytes=32 * 10)  # 10 tokens
+    cache.insert([1, 2, 3, 4], fakeLayerCache(4, 1.0))
+    cache.insert([5, 6, 7], fakeLayerCache(3, 2.0))
+    assert cache.lookup([1, 2, 9])[0] == 2  # Prefix of the first entry, which becomes the most recently used
+    cache.insert([1, 2], fakeLayerCache(2))  # Already served by slicing, nothing stored
+    assert len(cache.entries) == 2 and cache.numBytes == 32 * 7
+
+    cache.insert([8, 9, 10, 11], fakeLayerCache(4, 3.0))  # 11 tokens > 10 --> the LRU entry [5, 6, 7] goes
+    assert [tokens for tokens, _ in cache.entries.values()] == [[1, 2, 3, 4], [8, 9, 10, 11]]
+    assert cache.numBytes == 32 * 8 and cache.lookup([5, 6]) == (0, None)
+    matchLen, layerCache = cache.lookup([8, 9, 10, 11, 12])
+    assert matchLen == 4 and torch.equal(layerCache, fakeLayerCache(4, 3.0))
+
+    # An entry larger than the whole budget is skipped, the cache keeps what it had
+    cache.insert(list(range(20, 31)), fakeLayerCache(11))
+    assert cache.numBytes == 32 * 8 and len(cache.entries) == 2 and cache.lookup([20])[0] == 0
+    assert cache.root.children.keys() == {1, 8}  # No trie branch left behind
+
+
+@torch.no_grad()
+def test_prefix_cache_generation_matches_generate():
+    torch.manual_seed(123)
+    model = GPTModel(SMALL_CONFIG).eval()
+    template = torch.randint(0, SMALL_CONFIG["vocab_size"], (1, 16))
+    prefixCache = PrefixCache()
+    for _ in range(3):
+        prompt = torch.cat((template, torch.randint(0, SMALL_CONFIG["vocab_size"], (1, 4))), dim=1)
+        assert torch.equal(generateWithPrefixCache(model, prompt, 6, SMALL_CONFIG["context_length"], prefixCache, temperature=0.0),
+                           generate(model, prompt, 6, SMALL_CONFIG["context_length"], temperature=0.0))
+    assert prefixCache.stats["hits"] == 2 and prefixCache.stats["reusedTokens"] >= 32
@@ -0,0 +1,87 @@
+import json
+import os
+import numpy as np
+import pytest
+
+import preprocess_corpus
+from pretraining import GPTDatasetMemmap
+from preprocess_corpus import CHUNK_CHARS, iterDocumentParts, preprocessCorpus, shardPaths
+
+PARAGRAPH = "I had always thought Jack Gisburn rather a cheap genius--though a good fellow enough.\n"
+
+
+def writeFile(path, text):
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(text)
+
+
+def referenceTokens(tokenizer, inputDir, name):
+    with open(os.path.join(inputDir, name), encoding="utf-8") as file:
+        if name.endswith(".jsonl"):
+            documents = [json.loads(line)["text"] for line in file if line.strip()]
+        else:
+            documents = [file.read()]
+    return [t for document in documents for t in tokenizer.encode_ordinary(document) + [tokenizer.eot_token]]
+
+
+@pytest.mark.parametrize("chunkChars", [CHUNK_CHARS, 997])
+def test_text_cut_keeps_tokens(tmp_path, monkeypatch, toyTokenizer, chunkChars):
+    # Every line that starts a piece follows a blank line or a line with trailing spaces
+    monkeypatch.setattr(preprocess_corpus, "CHUNK_CHARS", chunkChars)
+    lines = [PARAGRAPH, "\n", "the end \n", "  \n", "Jack\n", "    indented\n", "\n", "\n"]
+    text = "".join(lines) * (CHUNK_CHARS // len("".join(lines)) + 1)
+    writeFile(tmp_path / "large.txt", text)
+    parts = list(iterDocumentParts(str(tmp_path / "large.txt")))
+    assert len(parts) > 1 and len(text) > CHUNK_CHARS
+    assert "".join(part for part, _ in parts) == text
+    assert [t for part, _ in parts for t in toyTokenizer.encode_ordinary(part)] == toyTokenizer.encode_ordinary(text)
+
+
+def test_shards_are_packed_and_rerun_is_incremental(tmp_path, toyTokenizer):
+    inputDir, outputDir = tmp_path / "corpus", str(tmp_path / "tokens")
+    os.makedirs(inputDir)
+    for i in range(6):
+        writeFile(inputDir / f"doc-{i}.txt", f"Doc {i}\n" + PARAGRAPH * (i + 1))  # Each far below one shard
+    writeFile(inputDir / "lines.jsonl", "".join(json.dumps({"text": f"line {i} {PARAGRAPH}"}) + "\n" for i in range(5)))
+
+    def checkOutput(manifest):
+        stream = np.concatenate([np.fromfile(path, dtype=np.uint16) for path in shardPaths(outputDir)])
+        assert all(shard["tokens"] == 100 for shard in manifest["shards"][:-1])
+        assert sorted(os.listdir(outputDir)) == sorted([shard["file"] for shard in manifest["shards"]] + ["manifest.json"])
+        offset = 0
+        for name in sorted(os.listdir(inputDir)):
+            entry = manifest["files"][name]
+            assert entry["start"] == offset
+            assert stream[offset:offset + entry["tokens"]].tolist() == referenceTokens(toyTokenizer, inputDir, name)
+            offset += entry["tokens"]
+        assert offset == len(stream)
+
+    stats, manifest = preprocessCorpus(str(inputDir), outputDir, numWorkers=2, shardTokens=100)
+    assert stats["tokenized_files"] == 7
+    checkOutput(manifest)
+    firstShard = manifest["shards"][0]["file"]
+
+    stats, manifest = preprocessCorpus(str(inputDir), outputDir, numWorkers=2, shardTokens=100)
+    assert stats["tokenized_files"] == 0
+
+    with open(inputDir / "doc-4.txt", "a", encoding="utf-8") as file:
+        file.write("THE END\n")
+    os.remove(inputDir / "doc-5.txt")
+    writeFile(inputDir / "doc-9.txt", PARAGRAPH)
+    stats, manifest = preprocessCorpus(str(inputDir), outputDir, numWorkers=2, shardTokens=100)
+    assert stats["tokenized_files"] == 2
+    assert manifest["shards"][0]["file"] == firstShard  # Shards before the first changed file are kept
+    checkOutput(manifest)
+
+
+def test_memmap_windows_span_shards(tmp_path):
+    tokenIds = np.arange(1000, dtype=np.uint16)
+    tokenIds.tofile(tmp_path / "all.bin")
+    paths = []
+    for i, (start, end) in enumerate([(0, 7), (7, 20), (20, 400), (400, 1000)]):  # Two shards shorter than a window
+        tokenIds[start:end].tofile(tmp_path / f"shard-{i}.bin")
+        paths.append(str(tmp_path / f"shard-{i}.bin"))
+    sharded, single = GPTDatasetMemmap(paths, 32, 5), GPTDatasetMemmap(str(tmp_path / "all.bin"), 32, 5)
+    assert len(sharded) == len(single)
+    for idx in range(len(single)):
+        assert all(np.array_equal(a, b) for a, b in zip(sharded[idx], single[idx]))
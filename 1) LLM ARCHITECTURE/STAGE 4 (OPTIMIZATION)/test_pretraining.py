@@ -0,0 +1,64 @@
+import copy
+import os
+import pytest
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from gpt_model import GPTModel
+from pretraining import calculateLossBatch, dataLoaderV1, trainModel
+
+SMALL_CONFIG = {"vocab_size": 97, "context_length": 16, "emb_dim": 32, "n_layers": 2, "n_heads": 4,
+                "drop_rate": 0.0, "qkv_bias": False}
+
+
+def tinyLoader(numBatches, batchSize=2, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    tokens = torch.randint(1, SMALL_CONFIG["vocab_size"], (numBatches * batchSize, SMALL_CONFIG["context_length"] + 1),
+                           generator=generator)
+    return DataLoader(TensorDataset(tokens[:, :-1], tokens[:, 1:]), batch_size=batchSize, shuffle=False)
+
+
+def test_async_eval_requires_cached_eval():
+    model = GPTModel(SMALL_CONFIG)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    with pytest.raises(ValueError, match="cachedEval"):
+        trainModel(model, tinyLoader(2), tinyLoader(1), optimizer, "cpu", 1, 1, 1, None, None, asyncEval=True)
+
+
+def test_partial_accumulation_window_is_a_mean():
+    # 5 batches, grad_accum_steps 2 --> windows of 2, 2 and 1 batches, each step uses the mean gradient of its window
+    trainConfig = {"peak_lr": 0.1, "min_lr": 0.1, "warmup_steps": 0, "grad_accum_steps": 2, "max_grad_norm": None, "bf16": False}
+    torch.manual_seed(123)
+    model = GPTModel(SMALL_CONFIG)
+    reference = copy.deepcopy(model)
+    trainLoader = tinyLoader(5)
+    batches = list(trainLoader)
+    trainModel(model, trainLoader, tinyLoader(1), torch.optim.SGD(model.parameters(), lr=0.1), "cpu", 1, None, 1, None, None,
+               trainConfig=trainConfig)
+
+    reference.train()
+    optimizer = torch.optim.SGD(reference.parameters(), lr=0.1)
+    for window in [batches[0:2], batches[2:4], batches[4:5]]:
+        optimizer.zero_grad()
+        loss = sum(calculateLossBatch(inputBatch, targetBatch, reference, "cpu") for inputBatch, targetBatch in window) / len(window)
+        loss.backward()
+        optimizer.step()
+    for parameter, expected in zip(model.parameters(), reference.parameters()):
+        torch.testing.assert_close(parameter, expected)
+
+
+def test_token_file_follows_txt(toyTokenizer, tmp_path):
+    tokenFile = str(tmp_path / "train.bin")
+    loaderTokens = lambda txt: torch.cat([inputs.flatten() for inputs, _ in
+                                          dataLoaderV1(txt, batch_size=1, max_length=4, stride=4, shuffle=False, tokenFile=tokenFile)])
+    first, second = "abcdefghijklmnopqrstuvwxyz", "zyxwvutsrqponmlkjihgfedcba"
+    assert bytes(loaderTokens(first).tolist()) == first[:24].encode()
+    assert bytes(loaderTokens(second).tolist()) == second[:24].encode()  # Different text --> file rewritten
+    assert bytes(loaderTokens(None).tolist()) == second[:24].encode()  # txt=None --> existing file as is
+
+    modified = os.path.getmtime(tokenFile)
+    loaderTokens(second)
+    assert os.path.getmtime(tokenFile) == modified  # Same text --> not tokenized again
+
+    with pytest.raises(ValueError, match="does not exist"):
+        dataLoaderV1(None, tokenFile=str(tmp_path / "missing.bin"))
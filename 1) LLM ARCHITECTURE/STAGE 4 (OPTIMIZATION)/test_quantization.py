@@ -0,0 +1,69 @@
+import pytest
+import torch
+import torch.nn as nn
+
+import quantization
+from batching_engine import ContinuousBatchingEngine, GenerationRequest
+from gpt_model import GPTModel, generate
+from quantization import Int8Linear, quantizeModel, quantizePerChannel
+
+SMALL_CONFIG = {"vocab_size": 97, "context_length": 48, "emb_dim": 32, "n_layers": 2, "n_heads": 4,
+                "drop_rate": 0.0, "qkv_bias": True}
+
+
+@pytest.mark.skipif(not quantization.INT8_KERNEL, reason="no fbgemm/x86 quantized engine")
+@torch.no_grad()
+def test_int8_kernel_matches_fallback(monkeypatch):
+    torch.manual_seed(123)
+    linear = nn.Linear(64, 48)
+    x = torch.randn(3, 5, 64)
+    packed = Int8Linear.fromLinear(linear)
+    monkeypatch.setattr(quantization, "INT8_KERNEL", False)
+    fallback = Int8Linear.fromLinear(linear)
+    assert packed.packedWeight is not None and fallback.packedWeight is None
+
+    weightInt8, scales = quantizePerChannel(linear.weight)
+    qWeight, _ = torch.ops.quantized.linear_unpack(packed.packedWeight)
+    assert torch.equal(qWeight.int_repr(), weightInt8)  # Re-quantizing weightInt8 * scales is exact
+    # The kernel also quantizes the activations, so it is close to (not equal to) the fallback
+    torch.testing.assert_close(packed(x), fallback(x), rtol=0.05, atol=0.05)
+    torch.testing.assert_close(fallback(x), linear(x), rtol=0.05, atol=0.02)
+
+
+@pytest.mark.parametrize("kernel", [False, True])
+@torch.no_grad()
+def test_state_dict_round_trip(monkeypatch, kernel):
+    if kernel and not quantization.INT8_KERNEL:
+        pytest.skip("no fbgemm/x86 quantized engine")
+    monkeypatch.setattr(quantization, "INT8_KERNEL", kernel)
+    torch.manual_seed(123)
+    model = quantizeModel(GPTModel(SMALL_CONFIG))
+    stateDict = model.state_dict()
+    assert "out_head.weightInt8" in stateDict and "trf_blocks.0.attention.W_query.bias" in stateDict
+    assert stateDict["out_head.weightInt8"].dtype == torch.int8
+
+    torch.manual_seed(456)
+    restored = quantizeModel(GPTModel(SMALL_CONFIG))
+    restored.load_state_dict(stateDict)
+    idx = torch.randint(0, SMALL_CONFIG["vocab_size"], (2, 12))
+    assert torch.equal(restored(idx), model(idx))
+
+    # Same keys with and without the kernel, so a saved model loads on either path
+    monkeypatch.setattr(quantization, "INT8_KERNEL", not kernel and quantization.INT8_KERNEL)
+    other = quantizeModel(GPTModel(SMALL_CONFIG))
+    other.load_state_dict(stateDict)
+    assert other.state_dict().keys() == stateDict.keys()
+    torch.testing.assert_close(other(idx), model(idx), rtol=0.05, atol=0.05)
+
+
+@torch.no_grad()
+def test_quantized_model_in_slot_cache():
+    torch.manual_seed(123)
+    model = quantizeModel(GPTModel(SMALL_CONFIG))
+    prompts = [[5, 6, 7], [8, 9, 10, 11, 12]]
+    engine = ContinuousBatchingEngine(model, maxSlots=2)
+    requests = [engine.submit(GenerationRequest(prompt, 6, temperature=0.0)) for prompt in prompts]
+    engine.run()
+    for request, prompt in zip(requests, prompts):
+        expected = generate(model, torch.tensor([prompt]), 6, SMALL_CONFIG["context_length"], temperature=0.0)
+        assert request.outputIds == expected[0, len(prompt):].tolist()
@@ -0,0 +1,18 @@
+import torch
+
+from speculative_decoding import verifyDraft
+
+
+def test_zero_target_probability_is_never_accepted(monkeypatch):
+    # rand() == 0 is the worst case for the accept test: a draft token the target rules out must still be rejected
+    monkeypatch.setattr(torch, "rand", lambda *shape: torch.zeros(shape))
+    targetProbs = torch.tensor([[0.0, 1.0, 0.0], [0.2, 0.3, 0.5]])
+    draftProbs = torch.tensor([[1.0, 0.0, 0.0]])
+    assert verifyDraft(targetProbs, [0], draftProbs) == [1]  # Resampled from the residual, which is all on token 1
+
+
+def test_greedy_draft_matching_target_is_accepted():
+    # One-hot target and draft (temperature 0) that agree: every draft token + the bonus token
+    targetProbs = torch.eye(4)[[2, 3, 1]]
+    draftProbs = torch.eye(4)[[2, 3]]
+    assert verifyDraft(targetProbs, [2, 3], draftProbs) == [2, 3, 1]
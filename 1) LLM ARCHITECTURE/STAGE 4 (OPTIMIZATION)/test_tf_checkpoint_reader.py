@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+import torch
+
+import tf_checkpoint_reader
+from benchmark_attention import randomGpt2Params
+from gpt_model import GPTModel, loadWeights
+from tf_checkpoint_reader import modelFromTfCheckpoint
+
+SMALL_CONFIG = {"vocab_size": 97, "context_length": 16, "emb_dim": 32, "n_layers": 2, "n_heads": 4,
+                "drop_rate": 0.0, "qkv_bias": True}
+
+
+def gpt2Variables(params):
+    # {variable name: array} in the layout of OpenAI's GPT-2 checkpoint (same as writeFakeGpt2Checkpoint)
+    variables = {"model/wte": params["wte"], "model/wpe": params["wpe"], "model/ln_f/g": params["g"], "model/ln_f/b": params["b"]}
+    for b, block in enumerate(params["blocks"]):
+        for group in ("attn", "mlp"):
+            for layer, values in block[group].items():
+                variables[f"model/h{b}/{group}/{layer}/w"] = values["w"][None]  # Conv1D weight (1, in, out)
+                variables[f"model/h{b}/{group}/{layer}/b"] = values["b"]
+        for norm in ("ln_1", "ln_2"):
+            variables[f"model/h{b}/{norm}/g"] = block[norm]["g"]
+            variables[f"model/h{b}/{norm}/b"] = block[norm]["b"]
+    return variables
+
+
+class InMemoryReader:
+    # Stands in for TfCheckpointReader (no TensorFlow needed to write a real bundle): same entries / read / close
+    variables = {}
+
+    def __init__(self, prefix):
+        self.entries = {name: (array.dtype, array.shape) for name, array in self.variables.items()}
+
+    def read(self, name, out=None):
+        out = np.empty_like(self.variables[name]) if out is None else out
+        out[...] = self.variables[name]
+        return out
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def checkpoint(monkeypatch):
+    params = randomGpt2Params(SMALL_CONFIG)
+    monkeypatch.setattr(InMemoryReader, "variables", gpt2Variables(params))
+    monkeypatch.setattr(tf_checkpoint_reader, "TfCheckpointReader", InMemoryReader)
+    return params
+
+
+@pytest.mark.parametrize("fusedQkv", [False, True])
+@torch.no_grad()
+def test_matches_load_weights(checkpoint, fusedQkv):
+    cfg = {**SMALL_CONFIG, "fused_qkv": fusedQkv}
+    reference = GPTModel(cfg)
+    loadWeights(reference, checkpoint)
+    idx = torch.randint(0, SMALL_CONFIG["vocab_size"], (2, 12))
+    torch.testing.assert_close(modelFromTfCheckpoint("unused", cfg)(idx), reference.eval()(idx))
+
+
+def test_missing_variable_raises(checkpoint):
+    del InMemoryReader.variables["model/h1/mlp/c_fc/b"]
+    with pytest.raises(ValueError, match=r"trf_blocks\.1\.feedforwardNN\.layers\.0\.bias"):
+        modelFromTfCheckpoint("unused", SMALL_CONFIG)
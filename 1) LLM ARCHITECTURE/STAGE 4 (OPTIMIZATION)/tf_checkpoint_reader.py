@@ -0,0 +1,289 @@
+import multiprocessing
+import os
+import struct
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+
+from gpt_model import GPTModel, modelConfigs
+
+# TF tensor bundle (what tf.train.Saver writes): "<prefix>.index" is a LevelDB table {variable name: BundleEntryProto}
+# (the empty key holds the BundleHeaderProto), "<prefix>.data-0000s-of-0000n" are the raw tensor bytes
+TABLE_MAGIC = 0xdb4775248b80fb57
+FOOTER_SIZE = 48  # metaindex handle + index handle (varints, zero padded) + 8-byte magic
+BLOCK_TRAILER_SIZE = 5  # compression type (1 byte) + crc32c (4 bytes) after every block
+TF_DTYPES = {1: np.float32, 2: np.float64, 3: np.int32, 4: np.uint8, 6: np.int8, 9: np.int64, 19: np.float16}
+
+
+def readVarint(buffer, pos):
+    result, shift = 0, 0
+    while True:
+        byte = buffer[pos]
+        result |= (byte & 0x7F) << shift
+        pos += 1
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def parseProto(buffer):
+    # Minimal protobuf decoder: {field number: [values]}, varints as ints, length-delimited fields as bytes
+    fields, pos = {}, 0
+    while pos < len(buffer):
+        key, pos = readVarint(buffer, pos)
+        fieldNumber, wireType = key >> 3, key & 7
+        if wireType == 0:
+            value, pos = readVarint(buffer, pos)
+        elif wireType == 1:
+            value, pos = buffer[pos:pos + 8], pos + 8
+        elif wireType == 2:
+            length, pos = readVarint(buffer, pos)
+            value, pos = buffer[pos:pos + length], pos + length
+        elif wireType == 5:
+            value, pos = buffer[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wireType}")
+        fields.setdefault(fieldNumber, []).append(value)
+    return fields
+
+
+def readBlock(file, handle):
+    offset, size = handle
+    file.seek(offset)
+    block = file.read(size + BLOCK_TRAILER_SIZE)
+    if block[size] != 0:
+        raise ValueError("Compressed table blocks are not supported (tensor bundles are written uncompressed)")
+    return block[:size]
+
+
+def blockEntries(block):
+    # Keys are prefix-compressed against the previous key; the block ends with the restart offsets
+    numRestarts = struct.unpack("<I", block[-4:])[0]
+    end = len(block) - 4 * (numRestarts + 1)
+    pos, key = 0, b""
+    while pos < end:
+        shared, pos = readVarint(block, pos)
+        nonShared, pos = readVarint(block, pos)
+        valueLength, pos = readVarint(block, pos)
+        key = key[:shared] + block[pos:pos + nonShared]
+        pos += nonShared
+        yield key, block[pos:pos + valueLength]
+        pos += valueLength
+
+
+def readBlockHandle(buffer, pos=0):
+    offset, pos = readVarint(buffer, pos)
+    size, pos = readVarint(buffer, pos)
+    return (offset, size), pos
+
+
+def latestCheckpoint(modelDir):
+    # Same as tf.train.latest_checkpoint: the "checkpoint" text file names the newest prefix
+    with open(os.path.join(modelDir, "checkpoint")) as file:
+        for line in file:
+            if line.startswith("model_checkpoint_path:"):
+                prefix = line.split(":", 1)[1].strip().strip('"')
+                return prefix if os.path.isabs(prefix) else os.path.join(modelDir, prefix)
+    raise ValueError(f"No model_checkpoint_path in {os.path.join(modelDir, 'checkpoint')}")
+
+
+'TF Checkpoint Reader'
+class TfCheckpointReader:
+    """
+    Reads a TF V2 checkpoint (tensor bundle) with NumPy only: the .index table is parsed once into
+    {name: (dtype, shape, shard, offset, size)}, and every read(name) seeks to one tensor in the .data file.
+    """
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.entries = {}
+        numShards = 1
+        with open(prefix + ".index", "rb") as file:
+            file.seek(0, os.SEEK_END)
+            file.seek(file.tell() - FOOTER_SIZE)
+            footer = file.read(FOOTER_SIZE)
+            if struct.unpack("<Q", footer[-8:])[0] != TABLE_MAGIC:
+                raise ValueError(f"{prefix}.index is not a tensor bundle index")
+            _, pos = readBlockHandle(footer)  # metaindex, unused
+            indexHandle, _ = readBlockHandle(footer, pos)
+            for _, handleBytes in blockEntries(readBlock(file, indexHandle)):
+                for key, value in blockEntries(readBlock(file, readBlockHandle(handleBytes)[0])):
+                    fields = parseProto(value)
+                    if key == b"":
+                        numShards = fields.get(1, [1])[0]
+                        continue
+                    if 7 in fields:
+                        raise ValueError(f"{key.decode()} is saved as slices, which are not supported")
+                    shape = [parseProto(dim).get(1, [0])[0] for dim in parseProto(fields[2][0]).get(2, [])] if 2 in fields else []
+                    self.entries[key.decode()] = (TF_DTYPES[fields[1][0]], tuple(shape), fields.get(3, [0])[0],
+                                                  fields.get(4, [0])[0], fields.get(5, [0])[0])
+        self.dataFiles = [open(f"{prefix}.data-{shard:05d}-of-{numShards:05d}", "rb") for shard in range(numShards)]
+
+    def variables(self):
+        # [(name, shape)], same as tf.train.list_variables
+        return [(name, list(entry[1])) for name, entry in self.entries.items()]
+
+    def read(self, name, out=None):
+        # Reads one tensor straight into out (a contiguous NumPy array of its size), or a new array
+        dtype, shape, shard, offset, size = self.entries[name]
+        out = np.empty(shape, dtype) if out is None else out
+        if out.nbytes != size or out.dtype != dtype:
+            raise ValueError(f"{name}: {size} bytes of {np.dtype(dtype)} on disk, got a buffer of {out.nbytes} bytes of {out.dtype}")
+        file = self.dataFiles[shard]
+        file.seek(offset)
+        if file.readinto(memoryview(out).cast("B")) != size:
+            raise ValueError(f"{name}: data file is truncated")
+        return out.reshape(shape)
+
+    def close(self):
+        for file in self.dataFiles:
+            file.close()
+
+
+def gpt2Targets(gpt, name):
+    # Parameters of GPTModel that one GPT-2 variable goes to: [(parameter, transposed, column slice)]
+    parts = name.split("/")[1:]  # Skip the 'model/' prefix
+    if parts[0] == "wte":
+        return [(gpt.tokenEmbeddings.weight, False, None), (gpt.out_head.weight, False, None)]
+    if parts[0] == "wpe":
+        return [(gpt.positionalEmbeddings.weight, False, None)]
+    if parts[0] == "ln_f":
+        return [(gpt.finalNormalization.scale if parts[1] == "g" else gpt.finalNormalization.shift, False, None)]
+
+    block = gpt.trf_blocks[int(parts[0][1:])]
+    if parts[1] in ("ln_1", "ln_2"):
+        normalization = block.normalization1 if parts[1] == "ln_1" else block.normalization2
+        return [(normalization.scale if parts[2] == "g" else normalization.shift, False, None)]
+    isWeight = parts[3] == "w"
+    if parts[1:3] == ["attn", "c_attn"]:
+        attention = block.attention
+        if attention.fused_qkv:
+            return [(attention.W_qkv.weight if isWeight else attention.W_qkv.bias, isWeight, None)]
+        # Q, K and V are consecutive column ranges of c_attn
+        layers = [attention.W_query, attention.W_key, attention.W_value]
+        return [(layer.weight if isWeight else layer.bias, isWeight, slice(i * attention.d_out, (i + 1) * attention.d_out))
+                for i, layer in enumerate(layers)]
+    layer = {"attn": {"c_proj": block.attention.out_proj},
+             "mlp": {"c_fc": block.feedforwardNN.layers[0], "c_proj": block.feedforwardNN.layers[2]}}[parts[1]][parts[2]]
+    return [(layer.weight if isWeight else layer.bias, isWeight, None)]
+
+
+@torch.no_grad()
+def loadTfCheckpoint(gpt, prefix):
+    """
+    Streams a GPT-2 TF checkpoint into gpt's parameters in place, one variable at a time (replaces
+    download_and_load_gpt2's params dict + loadWeights). A variable whose first target needs no transpose
+    is read from disk straight into that parameter, the others go through one buffer of the variable's size.
+    Raises if a parameter of gpt is not written by any variable of the checkpoint.
+    """
+    reader = TfCheckpointReader(prefix)
+    missing = {id(parameter): name for name, parameter in gpt.named_parameters()}
+    try:
+        for name, (dtype, shape, *_) in reader.entries.items():
+            targets = gpt2Targets(gpt, name)
+            parameter, transposed, columns = targets[0]
+            squeezedShape = tuple(size for size in shape if size != 1) or shape  # Conv1D weights are (1, in, out)
+            if not transposed and columns is None and parameter.dtype == torch.float32 and tuple(parameter.shape) == squeezedShape:
+                values = torch.from_numpy(reader.read(name, parameter.detach().numpy().reshape(shape))).reshape(squeezedShape)
+                missing.pop(id(parameter), None)
+                targets = targets[1:]  # e.g. wte: tokenEmbeddings is read from disk, out_head is copied from it
+            else:
+                values = torch.from_numpy(reader.read(name)).reshape(squeezedShape)
+            for parameter, transposed, columns in targets:
+                source = values[..., columns] if columns is not None else values
+                source = source.T if transposed else source
+                if parameter.shape != source.shape:
+                    raise ValueError(f"Shape mismatch for {name}, Left: {parameter.shape}, Right: {source.shape}")
+                parameter.copy_(source)
+                missing.pop(id(parameter), None)
+    finally:
+        reader.close()
+    if missing:
+        raise ValueError(f"Parameters missing from the checkpoint {prefix}: {', '.join(missing.values())}")
+    return gpt
+
+
+def modelFromTfCheckpoint(prefix, cfg):
+    # GPTModel allocated without random init (meta → empty), then filled from the checkpoint
+    with torch.device("meta"):
+        model = GPTModel(cfg)
+    model.to_empty(device="cpu")
+    for block in model.trf_blocks:
+        if hasattr(block.attention, "mask"):
+            block.attention.mask.copy_(torch.triu(torch.ones(cfg["context_length"], cfg["context_length"]), diagonal=1))
+    return loadTfCheckpoint(model, prefix).eval()
+
+
+def writeFakeGpt2Checkpoint(cfg, prefix):
+    # Random weights in the exact layout of OpenAI's GPT-2 checkpoint (needs TensorFlow, only for the benchmark)
+    import tensorflow as tf
+    from benchmark_attention import randomGpt2Params
+
+    params = randomGpt2Params(cfg)
+    names, tensors = ["model/wte", "model/wpe", "model/ln_f/g", "model/ln_f/b"], [params["wte"], params["wpe"], params["g"], params["b"]]
+    for b, block in enumerate(params["blocks"]):
+        for group in ("attn", "mlp"):
+            for layer, values in block[group].items():
+                names += [f"model/h{b}/{group}/{layer}/w", f"model/h{b}/{group}/{layer}/b"]
+                tensors += [values["w"][None], values["b"]]  # Conv1D weight (1, in, out)
+        for norm in ("ln_1", "ln_2"):
+            names += [f"model/h{b}/{norm}/g", f"model/h{b}/{norm}/b"]
+            tensors += [block[norm]["g"], block[norm]["b"]]
+    tf.raw_ops.SaveV2(prefix=prefix, tensor_names=names, shape_and_slices=[""] * len(names), tensors=tensors)
+    return params
+
+
+def rssMegabytes(field="VmHWM"):
+    # VmHWM = peak RSS of this process, VmRSS = current RSS
+    with open("/proc/self/status") as status:
+        return next(int(line.split()[1]) for line in status if line.startswith(field)) / 1024
+
+
+def loadWorker(method, prefix, cfg, idx, queue):
+    # Fresh process per method, so import time and peak RSS are measured from zero
+    startTime = time.time()
+    if method == "tensorflow":
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "STAGE 2", "MODEL WEIGHTS"))
+        from gpt_download3 import load_gpt2_params_from_tf_ckpt
+        from gpt_model import loadWeights
+        importTime, importMegabytes = time.time() - startTime, rssMegabytes("VmRSS")
+        params = load_gpt2_params_from_tf_ckpt(prefix, {"n_layer": cfg["n_layers"]})
+        model = GPTModel(cfg)
+        loadWeights(model, params)
+        del params
+    else:
+        importTime, importMegabytes = 0.0, rssMegabytes("VmRSS")
+        model = modelFromTfCheckpoint(prefix, cfg)
+    loadTime = time.time() - startTime
+    with torch.no_grad():
+        logits = model.eval()(idx)
+    queue.put((importTime, loadTime, importMegabytes, rssMegabytes(), logits))
+
+
+if __name__ == "__main__":
+    # Startup time and peak RSS: TensorFlow + params dict + loadWeights vs the streaming reader (random weights)
+    BASE_CONFIG = {"vocab_size": 50257, "context_length": 1024, "drop_rate": 0.0, "qkv_bias": True}
+    for modelName in ["gpt2-small (124M)", "gpt2-medium (355M)"]:
+        cfg = {**BASE_CONFIG, **modelConfigs[modelName]}
+        prefix = os.path.join(tempfile.mkdtemp(), "model.ckpt")
+        context = multiprocessing.get_context("spawn")
+        queue = context.Queue()
+        process = context.Process(target=writeFakeGpt2Checkpoint, args=(cfg, prefix))
+        process.start()
+        process.join()
+
+        idx = torch.randint(0, cfg["vocab_size"], (1, 16))
+        modelMegabytes = sum(p.numel() for p in GPTModel(cfg).parameters()) * 4 / 1024**2
+        results = {}
+        for method in ["tensorflow", "streaming"]:
+            process = context.Process(target=loadWorker, args=(method, prefix, cfg, idx, queue))
+            process.start()
+            importTime, loadTime, importMegabytes, peakMegabytes, logits = queue.get()
+            process.join()
+            results[method] = logits
+            print(f"{modelName} {method}: {loadTime:.2f} s (import {importTime:.2f} s), peak RSS {peakMegabytes:.0f} MB, "
+                  f"{peakMegabytes - importMegabytes:.0f} MB above the imports (parameters {modelMegabytes:.0f} MB)")
+        print(f"{modelName} max logit diff: {(results['tensorflow'] - results['streaming']).abs().max().item():.1e}")
+        for fileName in os.listdir(os.path.dirname(prefix)):
+            os.remove(os.path.join(os.path.dirname(prefix), fileName))
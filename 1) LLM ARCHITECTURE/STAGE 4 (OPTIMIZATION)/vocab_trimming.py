@@ -0,0 +1,129 @@
+import json
+import os
+import time
+import tiktoken
+import torch
+import torch.nn as nn
+
+from gpt_model import GPTModel, modelConfigs, generate
+from quantization import modelMegabytes
+
+
+def collectTokenIds(corpus, tokenizer=None, extraIds=(50256,)):
+    """
+    Sorted tensor of every token id used by a corpus, plus extraIds (<|endoftext|> is also the padding id).
+    corpus: list of texts (encoded with tokenizer) or a dataset of token ids like SpamDataset / InstructionDataset
+    (items are id lists/tensors, or (ids, label) pairs).
+    """
+    usedIds = set(extraIds)
+    for item in corpus:
+        if isinstance(item, str):
+            item = tokenizer.encode(item, allowed_special={"<|endoftext|>"})
+        elif isinstance(item, tuple):
+            item = item[0]
+        usedIds.update(torch.as_tensor(item).flatten().tolist())
+    return torch.tensor(sorted(usedIds))
+
+
+def trimVocabulary(model, keepIds):
+    # Keeps only the rows of keepIds in tokenEmbeddings and out_head, in place. New id i = old id keepIds[i].
+    # A classification head (out_head not vocab-sized) is left as it is
+    vocabSize = model.tokenEmbeddings.num_embeddings
+    weight = model.tokenEmbeddings.weight
+    keepIds = keepIds.to(weight.device)
+
+    model.tokenEmbeddings = nn.Embedding(len(keepIds), weight.shape[1], device=weight.device, dtype=weight.dtype)
+    with torch.no_grad():
+        model.tokenEmbeddings.weight.copy_(weight[keepIds])
+
+    if model.out_head.out_features == vocabSize:
+        outHead = model.out_head
+        model.out_head = nn.Linear(outHead.in_features, len(keepIds), bias=outHead.bias is not None,
+                                   device=weight.device, dtype=weight.dtype)
+        with torch.no_grad():
+            model.out_head.weight.copy_(outHead.weight[keepIds])
+            if outHead.bias is not None:
+                model.out_head.bias.copy_(outHead.bias[keepIds])
+    return model
+
+
+'Trimmed Tokenizer'
+class TrimmedTokenizer:
+    """
+    Wraps a tokenizer (tiktoken) so it speaks the compact ids of a trimmed model:
+    encode maps old → new ids, decode maps them back. Text with a token outside the kept vocabulary raises ValueError.
+    """
+    def __init__(self, tokenizer, keepIds):
+        self.tokenizer = tokenizer
+        self.keepIds = keepIds.tolist()
+        self.oldToNew = {oldId: newId for newId, oldId in enumerate(self.keepIds)}
+        self.n_vocab = len(self.keepIds)
+        self.eot_token = self.oldToNew.get(getattr(tokenizer, "eot_token", 50256))
+
+    def encode(self, text, **kwargs):
+        oldIds = self.tokenizer.encode(text, **kwargs)
+        missing = [oldId for oldId in oldIds if oldId not in self.oldToNew]
+        if missing:
+            raise ValueError(f"{len(missing)} token(s) outside the trimmed vocabulary, e.g. {missing[:5]}")
+        return [self.oldToNew[oldId] for oldId in oldIds]
+
+    def decode(self, tokenIds):
+        return self.tokenizer.decode([self.keepIds[newId] for newId in tokenIds])
+
+    def decode_single_token_bytes(self, tokenId):
+        # Lets IncrementalDetokenizer (streaming.py) stream a trimmed model
+        return self.tokenizer.decode_single_token_bytes(self.keepIds[tokenId])
+
+
+def outHeadLatency(model, numTokens=1, repeats=50):
+    # Time of the final projection alone (decode: one token per step)
+    x = torch.randn(1, numTokens, model.out_head.in_features)
+    with torch.no_grad():
+        model.out_head(x)
+        startTime = time.time()
+        for _ in range(repeats):
+            model.out_head(x)
+    return (time.time() - startTime) / repeats * 1000
+
+
+if __name__ == "__main__":
+    BASE_CONFIG = {"vocab_size": 50257, "context_length": 1024, "drop_rate": 0.0, "qkv_bias": True}
+    cfg = {**BASE_CONFIG, **modelConfigs["gpt2-small (124M)"]}
+    tokenizer = tiktoken.get_encoding("gpt2")
+
+    # S1) Vocabulary of the instruction finetuning data (same text as InstructionDataset)
+    filePath = os.path.join(os.path.dirname(__file__), "..", "STAGE 3 (FINETUNING)", "INSTRUCTION FINETUNING", "datatset.json")
+    with open(filePath, "r", encoding="utf-8") as file:
+        data = json.load(file)
+    texts = [
+        "Below is an instruction that describes a task. Write a response that appropriately completes the request.\n\n"
+        f"\n\n### Instruction: \n{entry['instruction']}"
+        + (f"\n\n### Input: \n{entry['input']}" if entry["input"] else "")
+        + f"\n\n### Response:\n{entry['output']}"
+        for entry in data
+    ]
+    keepIds = collectTokenIds(texts, tokenizer)
+    print(f"Instruction dataset uses {len(keepIds)} of {cfg['vocab_size']} token ids")
+
+    # S2) Size, projection and decode speed, and parity of the kept logits
+    torch.manual_seed(123)
+    model = GPTModel(cfg).eval()
+    prompt = torch.tensor([tokenizer.encode(texts[0])])
+    with torch.no_grad():
+        referenceLogits = model(prompt)[:, :, keepIds]
+    for trimmed in [False, True]:
+        if trimmed:
+            model = trimVocabulary(model, keepIds)
+            trimmedTokenizer = TrimmedTokenizer(tokenizer, keepIds)
+            prompt = torch.tensor([trimmedTokenizer.encode(texts[0])])
+        startTime = time.time()
+        generate(model, prompt, 32, cfg["context_length"], temperature=0.0, useCache=True)
+        tokensPerSec = 32 / (time.time() - startTime)
+        print(f"trimmed={trimmed}: {modelMegabytes(model):.0f} MB, out_head {outHeadLatency(model):.2f} ms/token, "
+              f"{tokensPerSec:.2f} tokens/sec")
+
+    # Logits of the kept ids are unchanged, so text stays the same as long as the full model picks in-vocabulary tokens
+    with torch.no_grad():
+        maxDiff = (model(prompt) - referenceLogits).abs().max().item()
+    print(f"Max difference of the kept logits: {maxDiff:.2e}")
+    print("Prompt round-trips through TrimmedTokenizer:", trimmedTokenizer.decode(prompt[0].tolist()) == texts[0])